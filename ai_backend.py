@@ -0,0 +1,315 @@
+"""
+Бэкенд модели для gemini_helper (AI_BACKEND):
+- gemini — настоящий Gemini (по умолчанию);
+- fake — локальная заглушка без сети и квоты: задержка из логнормального распределения (медиана, разброс),
+  доля ошибок, ответ — из кассеты, если такой запрос там есть, иначе синтезируется по JSON-схеме запроса;
+- record — запросы идут в Gemini, ответы (текст, токены, задержка) дописываются в кассету AI_CASSETTE_PATH;
+- replay — ответы из кассеты, детерминированно: одинаковые запросы получают записанные ответы по кругу
+  в порядке записи, задержка — записанная × AI_REPLAY_SPEED. Нет в кассете — ответ заглушки fake.
+Все бэкенды реализуют generate_content_async(contents, stream=..., request_options=..., generation_config=...)
+в том объёме, в каком его использует gemini_helper: .text, .usage_metadata и async for по кускам при stream=True.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import re
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+import google.generativeai as genai
+
+from config import (
+    AI_BACKEND,
+    AI_CASSETTE_PATH,
+    AI_REPLAY_SPEED,
+    FAKE_AI_LATENCY_MEDIAN,
+    FAKE_AI_LATENCY_SIGMA,
+    FAKE_AI_ERROR_RATE,
+    FAKE_AI_SEED,
+)
+
+logger = logging.getLogger("ai_backend")
+
+stats = {"backend": AI_BACKEND, "calls": 0, "errors": 0, "recorded": 0, "replayed": 0, "replay_misses": 0}
+
+
+class FakeAPIError(RuntimeError):
+    """Ошибка, которую заглушка отдаёт с вероятностью FAKE_AI_ERROR_RATE (как 503 от API)."""
+
+    code = 503
+
+
+def _schema(generation_config) -> dict | None:
+    if generation_config is None:
+        return None
+    if isinstance(generation_config, dict):
+        return generation_config.get("response_schema")
+    return getattr(generation_config, "response_schema", None)
+
+
+def cassette_key(model_name: str, contents, generation_config=None) -> str:
+    """Ключ записи в кассете: модель, промпт (текст и байты картинок) и схема ответа."""
+    h = hashlib.sha256(model_name.encode())
+    for part in contents if isinstance(contents, list) else [contents]:
+        if isinstance(part, dict):
+            h.update(str(part.get("mime_type", "")).encode())
+            h.update(part.get("data") or b"")
+        else:
+            h.update(str(part).encode())
+        h.update(b"\0")
+    schema = _schema(generation_config)
+    if schema:
+        h.update(json.dumps(schema, sort_keys=True, ensure_ascii=False).encode())
+    return h.hexdigest()
+
+
+def _prompt_text(contents) -> str:
+    return "\n".join(p for p in (contents if isinstance(contents, list) else [contents]) if isinstance(p, str))
+
+
+def _tokens(text: str) -> int:
+    """Грубая оценка токенов (~4 символа на токен) для usage_metadata заглушки."""
+    return max(1, len(text) // 4)
+
+
+def _usage(prompt_tokens: int, answer_tokens: int):
+    return SimpleNamespace(
+        prompt_token_count=prompt_tokens,
+        candidates_token_count=answer_tokens,
+        total_token_count=prompt_tokens + answer_tokens,
+    )
+
+
+class FakeResponse:
+    """Ответ в форме GenerateContentResponse: .text, .usage_metadata; при stream — async for по кускам."""
+
+    def __init__(self, text: str, usage, chunk_delay: float = 0.0):
+        self.text = text
+        self.usage_metadata = usage
+        self._chunk_delay = chunk_delay
+
+    async def __aiter__(self):
+        words = self.text.split(" ")
+        step = max(1, len(words) // 4)
+        for i in range(0, len(words), step):
+            if i:
+                await asyncio.sleep(self._chunk_delay)
+            yield SimpleNamespace(text=(" " if i else "") + " ".join(words[i:i + step]))
+
+
+def _sample_value(schema: dict, prompt: str, rng: random.Random):
+    kind = schema.get("type", "STRING").upper()
+    if kind == "OBJECT":
+        return {name: _sample_value(sub, prompt, rng) for name, sub in schema.get("properties", {}).items()}
+    if kind == "ARRAY":
+        items = schema.get("items", {})
+        # Пачка по пользователям (напоминания): по элементу на каждый «Пользователь N» из промпта
+        ids = [int(n) for n in re.findall(r"### Пользователь (\d+)", prompt)]
+        if "id" in items.get("properties", {}) and ids:
+            return [{**_sample_value(items, prompt, rng), "id": i} for i in ids]
+        return [_sample_value(items, prompt, rng)]
+    if kind == "NUMBER":
+        return round(rng.uniform(5, 500), 1)
+    if kind == "INTEGER":
+        return rng.randint(1, 100)
+    if kind == "BOOLEAN":
+        return False
+    return "Тестовый ответ заглушки."
+
+
+def _synthesize(contents, generation_config, rng: random.Random) -> str:
+    """Правдоподобный ответ без модели: JSON по схеме запроса или короткий текст."""
+    schema = _schema(generation_config)
+    prompt = _prompt_text(contents)
+    if not schema:
+        return "Попробуй творог с ягодами или омлет с овощами — это добавит белка без лишних калорий."
+    value = _sample_value(schema, prompt, rng)
+    if isinstance(value, dict):
+        if "confidence" in value:
+            value["confidence"] = 0.9
+        if "needs_clarification" in value:
+            value["needs_clarification"] = False
+    return json.dumps(value, ensure_ascii=False)
+
+
+class Cassette:
+    """Кассета JSONL: по строке на ответ {"key", "model", "text", "prompt_tokens", "answer_tokens", "latency"}."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: dict[str, list[dict]] = defaultdict(list)
+        self._cursor: dict[str, int] = defaultdict(int)
+
+    def load(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        n = 0
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError as e:
+                    logger.warning("Пропущена строка кассеты: %s", e)
+                    continue
+                self._entries[entry["key"]].append(entry)
+                n += 1
+        return n
+
+    def next(self, key: str) -> dict | None:
+        """Следующий записанный ответ на этот запрос (по кругу) или None."""
+        entries = self._entries.get(key)
+        if not entries:
+            return None
+        i = self._cursor[key]
+        self._cursor[key] = i + 1
+        return entries[i % len(entries)]
+
+    def append(self, entry: dict):
+        self._entries[entry["key"]].append(entry)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class FakeModel:
+    """Локальная заглушка модели: задержка, ошибки, ответ из кассеты (если есть) или по схеме."""
+
+    def __init__(self, model_name: str, cassette: Cassette | None = None, seed: int | None = FAKE_AI_SEED,
+                 latency_median: float = FAKE_AI_LATENCY_MEDIAN, latency_sigma: float = FAKE_AI_LATENCY_SIGMA,
+                 error_rate: float = FAKE_AI_ERROR_RATE):
+        self.model_name = model_name
+        self.cassette = cassette
+        self.rng = random.Random(seed)
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+
+    def _latency(self) -> float:
+        return self.latency_median * math.exp(self.latency_sigma * self.rng.gauss(0, 1))
+
+    async def generate_content_async(self, contents, stream: bool = False, request_options=None, generation_config=None, **_):
+        stats["calls"] += 1
+        latency = self._latency()
+        entry = self.cassette.next(cassette_key(self.model_name, contents, generation_config)) if self.cassette else None
+        await asyncio.sleep(latency / 2 if stream else latency)
+        if self.rng.random() < self.error_rate:
+            stats["errors"] += 1
+            raise FakeAPIError("503 fake backend unavailable")
+        if entry is not None:
+            text, usage = entry["text"], _usage(entry["prompt_tokens"], entry["answer_tokens"])
+        else:
+            text = _synthesize(contents, generation_config, self.rng)
+            usage = _usage(_tokens(_prompt_text(contents)), _tokens(text))
+        return FakeResponse(text, usage, chunk_delay=latency / 8)
+
+
+class ReplayModel:
+    """Ответы из кассеты с записанной задержкой; промах — ответ заглушки."""
+
+    def __init__(self, model_name: str, cassette: Cassette):
+        self.model_name = model_name
+        self.cassette = cassette
+        self.fallback = FakeModel(model_name, seed=FAKE_AI_SEED if FAKE_AI_SEED is not None else 0, error_rate=0.0)
+
+    async def generate_content_async(self, contents, stream: bool = False, request_options=None, generation_config=None, **_):
+        entry = self.cassette.next(cassette_key(self.model_name, contents, generation_config))
+        if entry is None:
+            stats["replay_misses"] += 1
+            return await self.fallback.generate_content_async(contents, stream=stream, generation_config=generation_config)
+        stats["calls"] += 1
+        stats["replayed"] += 1
+        latency = entry.get("latency", 0.0) * AI_REPLAY_SPEED
+        await asyncio.sleep(latency / 2 if stream else latency)
+        return FakeResponse(entry["text"], _usage(entry["prompt_tokens"], entry["answer_tokens"]), chunk_delay=latency / 8)
+
+
+class _RecordingStream:
+    """Проксирует стриминговый ответ и пишет его в кассету после последнего куска."""
+
+    def __init__(self, response, on_done):
+        self._response = response
+        self._on_done = on_done
+
+    @property
+    def usage_metadata(self):
+        return self._response.usage_metadata
+
+    async def __aiter__(self):
+        text = ""
+        async for chunk in self._response:
+            try:
+                text += chunk.text
+            except ValueError:
+                pass
+            yield chunk
+        self._on_done(text, self._response.usage_metadata)
+
+
+class RecordingModel:
+    """Настоящий Gemini; каждый успешный ответ дописывается в кассету."""
+
+    def __init__(self, model_name: str, cassette: Cassette):
+        self.model_name = model_name
+        self.cassette = cassette
+        self.model = genai.GenerativeModel(model_name)
+
+    async def generate_content_async(self, contents, stream: bool = False, **kwargs):
+        key = cassette_key(self.model_name, contents, kwargs.get("generation_config"))
+        started = time.monotonic()
+        stats["calls"] += 1
+        try:
+            response = await self.model.generate_content_async(contents, stream=stream, **kwargs)
+        except Exception:
+            stats["errors"] += 1
+            raise
+
+        def save(text: str, usage):
+            self.cassette.append({
+                "key": key,
+                "model": self.model_name,
+                "text": text,
+                "prompt_tokens": getattr(usage, "prompt_token_count", 0) or 0,
+                "answer_tokens": getattr(usage, "candidates_token_count", 0) or 0,
+                "latency": round(time.monotonic() - started, 3),
+            })
+            stats["recorded"] += 1
+
+        if stream:
+            return _RecordingStream(response, save)
+        try:
+            save(response.text, response.usage_metadata)
+        except ValueError:  # ответ без текста (заблокирован) — не записываем
+            pass
+        return response
+
+
+_cassette: Cassette | None = None
+
+
+def _get_cassette() -> Cassette:
+    global _cassette
+    if _cassette is None:
+        _cassette = Cassette(AI_CASSETTE_PATH)
+        n = _cassette.load()
+        logger.info("Кассета ИИ %s: %s ответов", AI_CASSETTE_PATH, n)
+    return _cassette
+
+
+def create_model(model_name: str):
+    """Модель для gemini_helper по AI_BACKEND."""
+    if AI_BACKEND == "fake":
+        return FakeModel(model_name, _get_cassette() if os.path.exists(AI_CASSETTE_PATH) else None)
+    if AI_BACKEND == "record":
+        return RecordingModel(model_name, _get_cassette())
+    if AI_BACKEND == "replay":
+        return ReplayModel(model_name, _get_cassette())
+    if AI_BACKEND != "gemini":
+        logger.warning("Неизвестный AI_BACKEND=%s — используется gemini", AI_BACKEND)
+    return genai.GenerativeModel(model_name)
@@ -0,0 +1,122 @@
+"""
+Разбор JSON из ответов модели. Быстрый путь — json.loads как есть; если не вышло — снять ```json-обёртку,
+вырезать объект/массив из текста и починить типичные поломки: «умные» кавычки, запятые перед } и ],
+оборванный ответ — только незакрытые скобки после законченного значения (оборванная строка или число не
+дописываются: «"calories": 3» могло быть 312). С schema проверяются обязательные поля (required) —
+у оборванного ответа их обычно нет. Не удалось — JSONParseError, дальше повтор или эскалация.
+"""
+import json
+import re
+
+stats = {"parsed": 0, "repaired": 0, "failures": 0, "incomplete": 0}
+
+_FENCE_RE = re.compile(r"```(?:json)?", re.IGNORECASE)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+# «» не трогаем — это обычные кавычки внутри русского текста
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "„": '"'})
+
+
+class JSONParseError(ValueError):
+    """Ответ модели не удалось разобрать как JSON даже после починки."""
+
+
+def _extract(text: str) -> str:
+    """От первой { или [ до парной закрывающей (или до конца, если ответ оборван)."""
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return text
+    start = min(starts)
+    close = "}" if text[start] == "{" else "]"
+    end = text.rfind(close)
+    return text[start:end + 1] if end > start else text[start:]
+
+
+_COMPLETE_TAIL_RE = re.compile(r'(?:[\]}",]|\btrue|\bfalse|\bnull)$')
+
+
+def _close_unbalanced(text: str) -> str | None:
+    """Дописать незакрытые скобки в порядке вложенности; None — ответ оборван внутри строки или числа."""
+    stack = []
+    in_string = escaped = False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    text = text.rstrip()
+    if in_string or not _COMPLETE_TAIL_RE.search(text):
+        return None
+    return text.rstrip(",") + "".join(reversed(stack))
+
+
+def _missing_required(value, schema: dict, path: str = "") -> str | None:
+    """Путь первого отсутствующего обязательного поля по схеме (OBJECT/ARRAY) или None."""
+    kind = schema.get("type", "").upper()
+    if kind == "OBJECT":
+        if not isinstance(value, dict):
+            return path or "<root>"
+        for key in schema.get("required", []):
+            if key not in value or value[key] is None:
+                return f"{path}.{key}" if path else key
+        for key, sub in schema.get("properties", {}).items():
+            if key in value:
+                missing = _missing_required(value[key], sub, f"{path}.{key}" if path else key)
+                if missing:
+                    return missing
+    elif kind == "ARRAY":
+        if not isinstance(value, list):
+            return path or "<root>"
+        for i, item in enumerate(value):
+            missing = _missing_required(item, schema.get("items", {}), f"{path}[{i}]")
+            if missing:
+                return missing
+    return None
+
+
+def parse_json_response(text: str, schema: dict | None = None):
+    """
+    dict/list из текста ответа модели; JSONParseError, если не разбирается и после починки
+    или (при schema) нет обязательного поля.
+    """
+    value = _parse(text)
+    missing = _missing_required(value, schema) if schema else None
+    if missing:
+        stats["incomplete"] += 1
+        raise JSONParseError(f"missing required field {missing!r}: {(text or '')[:200]!r}")
+    return value
+
+
+def _parse(text: str):
+    text = (text or "").strip()
+    try:
+        value = json.loads(text)
+        stats["parsed"] += 1
+        return value
+    except ValueError:
+        pass
+    candidate = _extract(_FENCE_RE.sub("", text).strip())
+    for attempt in (
+        candidate,
+        _TRAILING_COMMA_RE.sub(r"\1", candidate.translate(_SMART_QUOTES)),
+    ):
+        closed = _close_unbalanced(attempt)
+        for fixed in (attempt, _TRAILING_COMMA_RE.sub(r"\1", closed) if closed else None):
+            if fixed is None:
+                continue
+            try:
+                value = json.loads(fixed)
+            except ValueError:
+                continue
+            stats["repaired"] += 1
+            return value
+    stats["failures"] += 1
+    raise JSONParseError(f"invalid JSON: {text[:200]!r}")
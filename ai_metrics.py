@@ -0,0 +1,166 @@
+"""
+Метрики запросов к ИИ по хелперам gemini_helper: число вызовов и время (гистограмма), токены промпта и ответа
+из usage_metadata и оценка стоимости по уровням моделей, классы ошибок и попадания в кэши/справочник.
+Имя хелпера задаёт декоратор @instrument на публичной функции и хранится в contextvar — нижний уровень
+(запрос к модели) пишет токены и ошибки на текущий хелпер. Снимок — в GET /metrics, сводка — в лог раз в AI_METRICS_LOG_MINUTES.
+"""
+import asyncio
+import functools
+import inspect
+import logging
+import time
+from contextvars import ContextVar
+
+from config import AI_METRICS_LOG_MINUTES, AI_PRICE_PER_M_TOKENS
+
+logger = logging.getLogger("ai_metrics")
+
+# Верхние границы корзин гистограммы времени (сек); последняя — всё, что дольше
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)
+
+_helper: ContextVar[str] = ContextVar("ai_helper", default="other")
+
+_metrics: dict[str, dict] = {}
+
+
+def _entry(name: str) -> dict:
+    m = _metrics.get(name)
+    if m is None:
+        m = _metrics[name] = {
+            "calls": 0,
+            "time_sum_s": 0.0,
+            "time_hist": [0] * (len(LATENCY_BUCKETS) + 1),
+            "model_calls": 0,
+            "prompt_tokens": 0,
+            "response_tokens": 0,
+            "cost_usd": 0.0,
+            "errors": {},
+            "cache_hits": {},
+        }
+    return m
+
+
+def current_helper() -> str:
+    return _helper.get()
+
+
+def _observe(name: str, elapsed: float):
+    m = _entry(name)
+    m["calls"] += 1
+    m["time_sum_s"] += elapsed
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if elapsed <= bound:
+            m["time_hist"][i] += 1
+            break
+    else:
+        m["time_hist"][-1] += 1
+
+
+def instrument(fn):
+    """Декоратор публичного хелпера (корутина или async-генератор): имя для метрик и время вызова."""
+    name = fn.__name__
+
+    if inspect.isasyncgenfunction(fn):
+        @functools.wraps(fn)
+        async def gen_wrapper(*args, **kwargs):
+            # Генератор выполняется в контексте вызывающего: имя хелпера ставим только на время шага,
+            # иначе запросы, которые вызывающий делает между кусками, записались бы на этот хелпер
+            agen = fn(*args, **kwargs)
+            started = time.monotonic()
+            try:
+                while True:
+                    token = _helper.set(name)
+                    try:
+                        item = await agen.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    finally:
+                        _helper.reset(token)
+                    yield item
+            finally:
+                await agen.aclose()
+                _observe(name, time.monotonic() - started)
+        return gen_wrapper
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        token = _helper.set(name)
+        started = time.monotonic()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            _observe(name, time.monotonic() - started)
+            _helper.reset(token)
+    return wrapper
+
+
+def record_usage(tier: str, response):
+    """Токены из usage_metadata ответа модели и их стоимость по ценам уровня — на текущий хелпер."""
+    m = _entry(current_helper())
+    m["model_calls"] += 1
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    prompt = getattr(usage, "prompt_token_count", 0) or 0
+    answer = getattr(usage, "candidates_token_count", 0) or 0
+    m["prompt_tokens"] += prompt
+    m["response_tokens"] += answer
+    price_in, price_out = AI_PRICE_PER_M_TOKENS.get(tier, (0.0, 0.0))
+    m["cost_usd"] += (prompt * price_in + answer * price_out) / 1_000_000
+
+
+def record_error(exc: BaseException):
+    """Ошибка запроса к модели (API, таймаут, разомкнутая цепь, кривой JSON) — по имени класса."""
+    errors = _entry(current_helper())["errors"]
+    key = type(exc).__name__
+    errors[key] = errors.get(key, 0) + 1
+
+
+def record_cache_hit(source: str):
+    """Ответ без модели: source — откуда (кэш, справочник, пул)."""
+    hits = _entry(current_helper())["cache_hits"]
+    hits[source] = hits.get(source, 0) + 1
+
+
+def snapshot() -> dict:
+    """Метрики по хелперам: среднее время, гистограмма (ключи — верхняя граница корзины), токены, стоимость."""
+    labels = [f"le_{b}s" for b in LATENCY_BUCKETS] + ["inf"]
+    out = {}
+    for name, m in sorted(_metrics.items()):
+        out[name] = {
+            "calls": m["calls"],
+            "avg_ms": round(m["time_sum_s"] / m["calls"] * 1000, 1) if m["calls"] else None,
+            "time_hist": dict(zip(labels, m["time_hist"])),
+            "model_calls": m["model_calls"],
+            "prompt_tokens": m["prompt_tokens"],
+            "response_tokens": m["response_tokens"],
+            "cost_usd": round(m["cost_usd"], 6),
+            "errors": dict(m["errors"]),
+            "cache_hits": dict(m["cache_hits"]),
+        }
+    return out
+
+
+def log_summary():
+    """Одна строка на хелпер, самые затратные по времени — первыми."""
+    rows = sorted(_metrics.items(), key=lambda kv: kv[1]["time_sum_s"], reverse=True)
+    if not rows:
+        return
+    total_cost = sum(m["cost_usd"] for _, m in rows)
+    logger.info("Метрики ИИ: %s хелперов, оценка стоимости $%.4f", len(rows), total_cost)
+    for name, m in rows:
+        logger.info(
+            "  %s: вызовов %s, время %.1f с (ср. %.0f мс), запросов к модели %s, токенов %s/%s, $%.4f, ошибки %s, кэш %s",
+            name, m["calls"], m["time_sum_s"], m["time_sum_s"] / m["calls"] * 1000 if m["calls"] else 0,
+            m["model_calls"], m["prompt_tokens"], m["response_tokens"], m["cost_usd"],
+            m["errors"] or "-", m["cache_hits"] or "-",
+        )
+
+
+async def log_loop():
+    """Периодическая сводка метрик в лог (AI_METRICS_LOG_MINUTES, 0 — выключено)."""
+    if AI_METRICS_LOG_MINUTES <= 0:
+        return
+    while True:
+        await asyncio.sleep(AI_METRICS_LOG_MINUTES * 60)
+        log_summary()
@@ -0,0 +1,181 @@
+"""
+Планировщик запросов к Gemini: общий лимит параллельных запросов, token bucket по частоте и два класса приоритета.
+Интерактивные запросы (пользователь ждёт ответ) всегда выходят из очереди раньше фоновых (напоминания, серии,
+статус недели), а часть слотов и токенов зарезервирована под интерактив — фоновый всплеск не занимает всю квоту.
+Класс берётся из contextvar: фоновые задачи вызывают set_priority(BACKGROUND) один раз в начале.
+Там же крайний срок апдейта (set_deadline в middleware): запросы к ИИ не ждут дольше, чем пользователь готов ждать ответ.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from config import (
+    GEMINI_MAX_CONCURRENCY,
+    GEMINI_RATE_PER_SEC,
+    GEMINI_BURST,
+    GEMINI_INTERACTIVE_RESERVED,
+)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+_priority: ContextVar[int] = ContextVar("ai_priority", default=INTERACTIVE)
+# Крайний срок (time.monotonic()) для всех запросов к ИИ в рамках одного апдейта; None — только таймауты вызовов
+_deadline: ContextVar[float | None] = ContextVar("ai_deadline", default=None)
+
+
+def set_priority(priority: int):
+    """Класс для всех запросов к ИИ из текущей задачи (и задач, созданных из неё)."""
+    _priority.set(priority)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+def set_deadline(seconds: float | None, started: float | None = None):
+    """Крайний срок для запросов к ИИ: seconds от started (time.monotonic() прихода апдейта). None — снять."""
+    _deadline.set(None if seconds is None else (started if started is not None else time.monotonic()) + seconds)
+
+
+def time_left() -> float | None:
+    """Сколько секунд осталось до крайнего срока (может быть ≤ 0) или None, если срока нет."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """Перцентиль q (0–1) отсортированного списка, ближайший ранг; пустой список — 0."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))]
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше capacity. Один запрос — один токен."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, reserve: float = 0) -> float:
+        """Взять токен, оставив в ведре не меньше reserve. 0 — взят, иначе сколько секунд подождать."""
+        self._refill()
+        if self.tokens >= 1 + reserve:
+            self.tokens -= 1
+            return 0.0
+        return (1 + reserve - self.tokens) / self.rate
+
+
+class RetryBudget:
+    """
+    Бюджет повторов: каждый успешный запрос добавляет ratio повтора (не больше capacity), повтор тратит один.
+    При массовых сбоях повторы быстро кончаются и не удваивают нагрузку на модель.
+    """
+
+    def __init__(self, ratio: float, capacity: float):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.balance = capacity
+
+    def deposit(self):
+        self.balance = min(self.capacity, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.balance >= 1:
+            self.balance -= 1
+            return True
+        return False
+
+
+class AIScheduler:
+    def __init__(self, concurrency: int, rate: float, burst: float, interactive_reserved: int):
+        self.concurrency = max(1, concurrency)
+        # Фоновые не занимают последние interactive_reserved слотов и токенов
+        self.background_limit = max(1, self.concurrency - interactive_reserved)
+        self.background_token_reserve = min(interactive_reserved, max(0, burst - 1))
+        self.bucket = TokenBucket(rate, burst)
+        self._queue: list = []
+        self._seq = itertools.count()
+        self._active = {INTERACTIVE: 0, BACKGROUND: 0}
+        self._wakeup: asyncio.TimerHandle | None = None
+        self._waits = {INTERACTIVE: deque(maxlen=500), BACKGROUND: deque(maxlen=500)}
+        self._served = {INTERACTIVE: 0, BACKGROUND: 0}
+
+    def _dispatch(self):
+        self._wakeup = None
+        while self._queue and sum(self._active.values()) < self.concurrency:
+            prio, _, fut, _ = self._queue[0]
+            if fut.done():  # ожидающий отменён
+                heapq.heappop(self._queue)
+                continue
+            # Голова очереди фоновая — значит интерактивных в очереди нет
+            if prio == BACKGROUND and self._active[BACKGROUND] >= self.background_limit:
+                break
+            wait = self.bucket.take(self.background_token_reserve if prio == BACKGROUND else 0)
+            if wait > 0:
+                self._wakeup = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                break
+            heapq.heappop(self._queue)
+            self._active[prio] += 1
+            fut.set_result(None)
+
+    def _kick(self):
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+        self._dispatch()
+
+    def _release(self, prio: int):
+        self._active[prio] -= 1
+        self._kick()
+
+    @asynccontextmanager
+    async def slot(self, priority: int | None = None):
+        """Дождаться очереди, выполнить запрос внутри блока, освободить слот."""
+        prio = current_priority() if priority is None else priority
+        fut = asyncio.get_running_loop().create_future()
+        enqueued = time.monotonic()
+        heapq.heappush(self._queue, (prio, next(self._seq), fut, enqueued))
+        self._kick()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self._release(prio)  # слот уже выдан, но ожидающий отменён
+            raise
+        self._waits[prio].append(time.monotonic() - enqueued)
+        self._served[prio] += 1
+        try:
+            yield
+        finally:
+            self._release(prio)
+
+    def stats(self) -> dict:
+        out = {"concurrency": self.concurrency, "tokens": round(self.bucket.tokens, 2)}
+        for prio, name in PRIORITY_NAMES.items():
+            waits = sorted(self._waits[prio])
+            out[name] = {
+                "queued": sum(1 for p, _, f, _ in self._queue if p == prio and not f.done()),
+                "active": self._active[prio],
+                "served": self._served[prio],
+                "wait_avg_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0,
+                "wait_p95_ms": round(percentile(waits, 0.95) * 1000, 1),
+                "wait_max_ms": round(waits[-1] * 1000, 1) if waits else 0,
+            }
+        return out
+
+
+scheduler = AIScheduler(GEMINI_MAX_CONCURRENCY, GEMINI_RATE_PER_SEC, GEMINI_BURST, GEMINI_INTERACTIVE_RESERVED)
@@ -0,0 +1,54 @@
+"""
+Фоновые задачи после ответа пользователю (совет к сводке, поздравление с целью).
+Задачи хранятся в множестве — иначе asyncio может собрать их сборщиком мусора, — ограничены таймаутом,
+ошибки логируются, при остановке бота незавершённые задачи отменяются (cancel_all).
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger("background")
+
+_tasks: set[asyncio.Task] = set()
+
+stats = {"spawned": 0, "done": 0, "failed": 0, "timed_out": 0, "cancelled": 0}
+
+
+async def _run(coro, name: str, timeout: float | None):
+    try:
+        if timeout:
+            await asyncio.wait_for(coro, timeout)
+        else:
+            await coro
+        stats["done"] += 1
+    except asyncio.TimeoutError:
+        stats["timed_out"] += 1
+        logger.warning("Фоновая задача %s не уложилась в %s с", name, timeout)
+    except Exception as e:
+        stats["failed"] += 1
+        logger.exception("Фоновая задача %s: %s", name, e)
+
+
+def _forget(task: asyncio.Task, coro):
+    _tasks.discard(task)
+    if task.cancelled():
+        stats["cancelled"] += 1
+        coro.close()  # отменена до старта — иначе «coroutine was never awaited»
+
+
+def spawn(coro, name: str, timeout: float | None = None) -> asyncio.Task:
+    """Запустить корутину в фоне, не дожидаясь её. timeout — общий лимит, по истечении задача отменяется."""
+    task = asyncio.create_task(_run(coro, name, timeout), name=name)
+    _tasks.add(task)
+    task.add_done_callback(lambda t: _forget(t, coro))
+    stats["spawned"] += 1
+    return task
+
+
+async def cancel_all():
+    """Отменить незавершённые фоновые задачи и дождаться их (при остановке бота)."""
+    tasks = list(_tasks)
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info("Отменено фоновых задач: %s", len(tasks))
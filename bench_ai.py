@@ -0,0 +1,68 @@
+"""
+Нагрузочный прогон слоя ИИ без Telegram и без квоты: N запросов analyze_food_text / get_meal_suggestion
+с заданной параллельностью против заглушки или кассеты. Печатает пропускную способность, p50/p95 и метрики по хелперам.
+
+    AI_BACKEND=fake FAKE_AI_SEED=1 python bench_ai.py --requests 500 --concurrency 50
+    AI_BACKEND=replay AI_REPLAY_SPEED=0 python bench_ai.py
+
+По умолчанию AI_BACKEND=fake. БД не нужна: кэши работают только в памяти.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("AI_BACKEND", "fake")
+
+import ai_metrics  # noqa: E402
+from ai_backend import stats as backend_stats  # noqa: E402
+from ai_scheduler import percentile  # noqa: E402
+from gemini_helper import analyze_food_text, get_meal_suggestion  # noqa: E402
+
+FOODS = ["гречка с курицей", "борщ со сметаной", "паста карбонара", "плов с говядиной", "салат цезарь", "сырники со сметаной"]
+USER = {"goal": "cutting", "calories_goal": 2000, "protein_goal": 140, "fat_goal": 60, "carbs_goal": 200}
+TOTALS = {"calories": 900, "protein": 50, "fat": 30, "carbs": 100}
+
+
+async def _one(i: int, distinct: int) -> bool:
+    if i % 5 == 4:
+        return await get_meal_suggestion(TOTALS, USER, "dinner", [FOODS[i % len(FOODS)]]) is not None
+    # Разные порции одного блюда — попадания в кэш и пересчёт порций как в жизни
+    return await analyze_food_text(f"{FOODS[i % len(FOODS)]} {150 + (i % distinct) * 10}г") is not None
+
+
+async def run(requests: int, concurrency: int, distinct: int):
+    sem = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    ok = 0
+
+    async def worker(i: int):
+        nonlocal ok
+        async with sem:
+            started = time.monotonic()
+            success = await _one(i, distinct)  # не «ok += await …»: ok читается до await, и параллельные инкременты теряются
+            latencies.append(time.monotonic() - started)
+            ok += success
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker(i) for i in range(requests)))
+    elapsed = time.monotonic() - started
+    latencies.sort()
+    print(f"backend={backend_stats['backend']} requests={requests} concurrency={concurrency} ok={ok}")
+    print(f"elapsed={elapsed:.2f}s throughput={requests / elapsed:.1f} req/s "
+          f"p50={percentile(latencies, 0.5) * 1000:.0f}ms p95={percentile(latencies, 0.95) * 1000:.0f}ms")
+    print(json.dumps({"ai_backend": backend_stats, "helpers": ai_metrics.snapshot()}, ensure_ascii=False, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--distinct", type=int, default=20, help="сколько разных порций на блюдо")
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.concurrency, args.distinct))
+
+
+if __name__ == "__main__":
+    main()
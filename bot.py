@@ -1,13 +1,18 @@
 import asyncio
 import logging
 import sys
+import time
 import asyncpg
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN, GEMINI_API_KEY, DATABASE_URL
-from database import init_db, set_pool, update_last_activity
+from config import BOT_TOKEN, GEMINI_API_KEY, DATABASE_URL, AI_UPDATE_DEADLINE
+from database import init_db, set_pool, update_last_activity, check_access_paths
 from handlers import common, food, stats, profile, quick
 from reminders import reminder_loop
+from background import cancel_all as cancel_background
+from ai_scheduler import set_deadline
+import ai_metrics
+from gemini_helper import food_text_cache, portion_cache, goals_cache
 
 logging.basicConfig(
     level=logging.INFO,
@@ -42,6 +47,12 @@ async def log_updates_middleware(handler, event, data):
     return await handler(event, data)
 
 
+async def deadline_middleware(handler, event, data):
+    """Крайний срок для запросов к ИИ от прихода апдейта: дольше AI_UPDATE_DEADLINE пользователь ответ не ждёт."""
+    set_deadline(AI_UPDATE_DEADLINE, started=time.monotonic())
+    return await handler(event, data)
+
+
 async def activity_middleware(handler, event, data):
     """Обновить last_activity_at при любом действии пользователя (сообщение или кнопка)."""
     update = event
@@ -62,10 +73,21 @@ async def setup_bot_dp():
     check_config()
     pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=5, command_timeout=60)
     set_pool(pool)
-    await init_db(pool)
+    # Схема актуальна — один SELECT; миграции применяются только при новой версии
+    if await init_db(pool):
+        # Регрессия индексов после изменения схемы: горячие запросы «пользователь + день» должны читаться индексом
+        try:
+            for problem in await check_access_paths(pool):
+                log_updates.warning("Индекс не используется: %s", problem)
+        except Exception as e:
+            log_updates.warning("Проверка индексов не выполнена: %s", e)
+    await food_text_cache.purge_stale()
+    await portion_cache.store.purge_stale()
+    await goals_cache.purge_stale()
 
     bot = Bot(token=BOT_TOKEN)
     dp = Dispatcher(storage=MemoryStorage())
+    dp.update.outer_middleware(deadline_middleware)
     dp.update.outer_middleware(log_updates_middleware)
     dp.update.outer_middleware(activity_middleware)
 
@@ -102,7 +124,11 @@ async def main():
 
     asyncio.create_task(log_waiting())
     asyncio.create_task(reminder_loop(bot))
-    await dp.start_polling(bot)
+    asyncio.create_task(ai_metrics.log_loop())
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await cancel_background()
 
 if __name__ == "__main__":
     try:
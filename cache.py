@@ -0,0 +1,123 @@
+"""
+Кэши ответов ИИ: LRU с TTL в памяти процесса и двухуровневый кэш (память → таблица ai_cache в PostgreSQL).
+"""
+import logging
+import time
+from collections import OrderedDict
+
+import database
+
+logger = logging.getLogger("cache")
+
+_MISSING = object()
+
+
+class LRUCache:
+    """LRU-кэш с TTL. Хранит не больше maxsize записей, запись живёт ttl секунд."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            self.misses += 1
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float | None = None):
+        self._data[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, _MISSING)
+        return default if item is _MISSING else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def items(self):
+        """Живые записи (key, value) без учёта в hits/misses — для перебора, например поиска похожих."""
+        now = time.monotonic()
+        return [(k, v) for k, (expires_at, v) in self._data.items() if expires_at >= now]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class TwoTierCache:
+    """
+    Память (LRUCache) → PostgreSQL (ai_cache). namespace разделяет кэши разных функций,
+    version — версия промпта: записи другой версии считаются промахом и удаляются purge_stale().
+    Если БД недоступна (пул не создан, ошибка запроса) — работает только память.
+    """
+
+    def __init__(self, namespace: str, version: int, maxsize: int = 2048, ttl: float = 6 * 3600, db_ttl_days: int | None = None):
+        self.namespace = namespace
+        self.version = version
+        self.db_ttl_days = db_ttl_days
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.db_hits = 0
+        self.misses = 0
+
+    async def get(self, key: str):
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        try:
+            value = await database.ai_cache_get(self.namespace, key, self.version, self.db_ttl_days)
+        except Exception as e:
+            logger.debug("ai_cache_get %s: %s", self.namespace, e)
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.db_hits += 1
+        self.memory.set(key, value)
+        return value
+
+    async def set(self, key: str, value):
+        self.memory.set(key, value)
+        try:
+            await database.ai_cache_set(self.namespace, key, self.version, value)
+        except Exception as e:
+            logger.debug("ai_cache_set %s: %s", self.namespace, e)
+
+    async def purge_stale(self):
+        """Удалить из БД записи старых версий промпта (вызывается при старте)."""
+        try:
+            await database.ai_cache_purge(self.namespace, keep_version=self.version)
+        except Exception as e:
+            logger.warning("ai_cache_purge %s: %s", self.namespace, e)
+
+    async def invalidate(self):
+        """Полный сброс: память и все записи namespace в БД."""
+        self.memory.clear()
+        try:
+            await database.ai_cache_purge(self.namespace)
+        except Exception as e:
+            logger.warning("ai_cache_purge %s: %s", self.namespace, e)
+
+    def stats(self) -> dict:
+        return {
+            "memory_hits": self.memory.hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "memory_size": len(self.memory),
+        }
@@ -0,0 +1,104 @@
+"""
+Предохранитель для запросов к Gemini. После AI_BREAKER_FAILURES сбоев подряд (таймаут, 5xx, 429, обрыв соединения) цепь
+размыкается: AI_BREAKER_OPEN_SECONDS запросы не отправляются вовсе, вызывающий код сразу уходит
+в локальный режим (справочник, шаблонные советы и напоминания). Затем пропускается один пробный запрос
+(half-open): успех — цепь замкнута, ошибка — снова разомкнута.
+Ошибки конкретного запроса (4xx: невалидный аргумент, заблокированный контент на одном фото) сбоем не считаются —
+несколько неудачных вводов подряд не отключают ИИ для всех.
+"""
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("circuit_breaker")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """Цепь разомкнута — запрос к модели не отправлялся."""
+
+
+def _http_code(exc: BaseException) -> int | None:
+    # google.api_core.exceptions.GoogleAPICallError и заглушка ai_backend несут HTTP-код в .code
+    code = getattr(exc, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Сбой сервиса или сети: таймаут, обрыв соединения, 5xx, 429."""
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, OSError)):
+        return True
+    code = _http_code(exc)
+    return code is not None and (code == 429 or code >= 500)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, open_seconds: float, probe_timeout: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_seconds = open_seconds
+        # Пробный запрос, не отчитавшийся за это время (потерялся), не блокирует следующие пробы
+        self.probe_timeout = probe_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_started: float | None = None
+        self.stats = {"rejected": 0, "opened": 0, "probes": 0, "client_errors": 0}
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос сейчас. В half-open пропускает один пробный запрос."""
+        now = time.monotonic()
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            self._probe_started = None
+            logger.info("Цепь ИИ: пробный запрос (half-open)")
+        if self.state == HALF_OPEN and (self._probe_started is None or now - self._probe_started >= self.probe_timeout):
+            self._probe_started = now
+            self.stats["probes"] += 1
+            return True
+        self.stats["rejected"] += 1
+        return False
+
+    def is_open(self) -> bool:
+        """Разомкнута (в том числе ждёт результат пробы) — для выбора локального режима без попытки запроса."""
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            return False  # пора пробовать
+        return self.state != CLOSED
+
+    def record_success(self):
+        if self.state != CLOSED:
+            logger.info("Цепь ИИ замкнута: модель снова отвечает")
+        self.state = CLOSED
+        self.failures = 0
+        self._probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.stats["opened"] += 1
+                logger.warning("Цепь ИИ разомкнута на %s с после %s ошибок подряд", self.open_seconds, self.failures)
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self._probe_started = None
+
+    def record_error(self, exc: BaseException):
+        """
+        Исход упавшего запроса: сбой сервиса — record_failure; ошибка самого запроса (4xx) — сервис ответил,
+        это успех для цепи; прочие ошибки без кода счётчик не меняют.
+        """
+        if is_transient(exc):
+            self.record_failure()
+        elif _http_code(exc) is not None:
+            self.stats["client_errors"] += 1
+            self.record_success()
+
+    def snapshot(self) -> dict:
+        out = {"state": self.state, "consecutive_failures": self.failures, **self.stats}
+        if self.state == OPEN:
+            out["retry_in_s"] = round(max(0.0, self.open_seconds - (time.monotonic() - self.opened_at)), 1)
+        return out
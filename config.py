@@ -16,3 +16,111 @@ if DATABASE_URL and "sslmode=" not in DATABASE_URL:
 WEBHOOK_BASE_URL = (os.getenv("WEBHOOK_BASE_URL") or "").rstrip("/")
 # Секрет для заголовка X-Telegram-Bot-Api-Secret-Token (рекомендуется)
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+
+# Кэш анализа текста еды (analyze_food_text): размер LRU в памяти, TTL в памяти (сек) и срок жизни записей в БД (дни)
+FOOD_TEXT_CACHE_SIZE = int(os.getenv("FOOD_TEXT_CACHE_SIZE") or 5000)
+FOOD_TEXT_CACHE_TTL = int(os.getenv("FOOD_TEXT_CACHE_TTL") or 6 * 3600)
+FOOD_TEXT_CACHE_DB_DAYS = int(os.getenv("FOOD_TEXT_CACHE_DB_DAYS") or 90)
+
+# Кэш распознавания фото: сколько результатов держать, TTL (сек), порог расстояния Хэмминга для похожих снимков (dHash, 64 бита)
+PHOTO_CACHE_SIZE = int(os.getenv("PHOTO_CACHE_SIZE") or 2000)
+PHOTO_CACHE_TTL = int(os.getenv("PHOTO_CACHE_TTL") or 24 * 3600)
+PHOTO_HASH_MAX_DISTANCE = int(os.getenv("PHOTO_HASH_MAX_DISTANCE") or 6)
+
+# Планировщик запросов к Gemini: параллельные запросы, частота (запросов/сек) и всплеск token bucket,
+# сколько слотов и токенов зарезервировано под интерактивные запросы (фоновые их не занимают)
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY") or 8)
+GEMINI_RATE_PER_SEC = float(os.getenv("GEMINI_RATE_PER_SEC") or 5)
+GEMINI_BURST = float(os.getenv("GEMINI_BURST") or 10)
+GEMINI_INTERACTIVE_RESERVED = int(os.getenv("GEMINI_INTERACTIVE_RESERVED") or 2)
+
+# Локальный справочник КБЖУ (CSV) и минимальное сходство названия (0–1), при котором ответ даётся без модели
+FOOD_CATALOG_PATH = os.getenv("FOOD_CATALOG_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "foods.csv")
+FOOD_CATALOG_MIN_SCORE = float(os.getenv("FOOD_CATALOG_MIN_SCORE") or 0.7)
+
+# Сколько пользователей упаковывать в один запрос к модели при генерации напоминаний «пора поесть»
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE") or 20)
+# Проверка напоминаний: сколько пользователей читать одним запросом (страница iter_reminder_candidates)
+REMINDER_SCAN_PAGE_SIZE = int(os.getenv("REMINDER_SCAN_PAGE_SIZE") or 500)
+
+# Потоковый совет «что съесть»: как часто (сек) обновлять сообщение по мере генерации — не чаще лимитов Telegram на edit
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL") or 0.7)
+
+# Подготовка фото перед отправкой в модель: длинная сторона (px), качество JPEG и число потоков для Pillow
+PHOTO_MAX_EDGE = int(os.getenv("PHOTO_MAX_EDGE") or 1024)
+PHOTO_JPEG_QUALITY = int(os.getenv("PHOTO_JPEG_QUALITY") or 85)
+PHOTO_PREP_WORKERS = int(os.getenv("PHOTO_PREP_WORKERS") or 2)
+
+# Кэш совета после приёма пищи: шаг округления процентов КБЖУ, сколько разных советов держать на корзину, размер и TTL (сек)
+TIP_BUCKET_PCT = int(os.getenv("TIP_BUCKET_PCT") or 10)
+TIP_POOL_SIZE = int(os.getenv("TIP_POOL_SIZE") or 3)
+TIP_CACHE_SIZE = int(os.getenv("TIP_CACHE_SIZE") or 2000)
+TIP_CACHE_TTL = int(os.getenv("TIP_CACHE_TTL") or 12 * 3600)
+# Сколько повторов уже известного совета подряд — и корзина считается заполненной, фоновое пополнение прекращается
+TIP_REFILL_MAX_DUPLICATES = int(os.getenv("TIP_REFILL_MAX_DUPLICATES") or 3)
+
+# После добавления еды сводка уходит сразу, совет ИИ дописывается правкой: сколько ждать совет (сек)
+# и общий лимит фоновой задачи (совет + проверка целей за день)
+TIP_TIMEOUT = float(os.getenv("TIP_TIMEOUT") or 10)
+AFTER_MEAL_TASK_TIMEOUT = float(os.getenv("AFTER_MEAL_TASK_TIMEOUT") or 60)
+
+# Кэш целей КБЖУ по профилю (calculate_goals_ai): размер в памяти, TTL в памяти (сек), срок жизни в БД (дни)
+GOALS_CACHE_SIZE = int(os.getenv("GOALS_CACHE_SIZE") or 2000)
+GOALS_CACHE_TTL = int(os.getenv("GOALS_CACHE_TTL") or 24 * 3600)
+GOALS_CACHE_DB_DAYS = int(os.getenv("GOALS_CACHE_DB_DAYS") or 180)
+
+# Пул текстов для уведомлений о цели и 5-дневных сериях: сколько текстов на пару (вид, цель пользователя),
+# через сколько дней текст заменяется новым, как часто (часы) проверять и дополнять пул
+MESSAGE_POOL_SIZE = int(os.getenv("MESSAGE_POOL_SIZE") or 5)
+MESSAGE_POOL_MAX_AGE_DAYS = int(os.getenv("MESSAGE_POOL_MAX_AGE_DAYS") or 30)
+MESSAGE_POOL_REFRESH_HOURS = float(os.getenv("MESSAGE_POOL_REFRESH_HOURS") or 6)
+
+# Уровни моделей: быстрая — короткие тексты еды, советы, статус недели; сильная — остальное и эскалация
+# (кривой JSON, needs_clarification, confidence ниже ROUTER_MIN_CONFIDENCE)
+GEMINI_MODEL_FAST = os.getenv("GEMINI_MODEL_FAST") or "gemini-2.5-flash-lite"
+GEMINI_MODEL_STRONG = os.getenv("GEMINI_MODEL_STRONG") or "gemini-2.5-flash"
+ROUTER_FAST_MAX_TEXT_LEN = int(os.getenv("ROUTER_FAST_MAX_TEXT_LEN") or 60)
+ROUTER_MIN_CONFIDENCE = float(os.getenv("ROUTER_MIN_CONFIDENCE") or 0.6)
+
+# Повтор запроса при невалидном JSON от модели: сколько повторов на вызов и общий бюджет
+# (доля от успешных запросов и максимальный запас), чтобы при сбое модели повторы не удваивали нагрузку
+JSON_MAX_RETRIES = int(os.getenv("JSON_MAX_RETRIES") or 1)
+JSON_RETRY_RATIO = float(os.getenv("JSON_RETRY_RATIO") or 0.1)
+JSON_RETRY_CAPACITY = float(os.getenv("JSON_RETRY_CAPACITY") or 10)
+
+# Таймауты ИИ: крайний срок на все запросы одного апдейта (сек с момента прихода), таймаут вызова по умолчанию,
+# жёсткий таймаут HTTP-запроса к Gemini (освобождает слот планировщика, даже если ответа уже никто не ждёт)
+AI_UPDATE_DEADLINE = float(os.getenv("AI_UPDATE_DEADLINE") or 25)
+AI_CALL_TIMEOUT = float(os.getenv("AI_CALL_TIMEOUT") or 20)
+AI_HARD_TIMEOUT = float(os.getenv("AI_HARD_TIMEOUT") or 60)
+# Хеджирование идемпотентных запросов: второй запрос, если первый дольше p95 уровня (но не раньше HEDGE_MIN_DELAY сек)
+HEDGE_ENABLED = (os.getenv("HEDGE_ENABLED") or "1") not in ("0", "false", "no")
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY") or 1.0)
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES") or 20)
+
+# Предохранитель ИИ: после скольких ошибок подряд перестать обращаться к модели и на сколько секунд
+AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES") or 5)
+AI_BREAKER_OPEN_SECONDS = float(os.getenv("AI_BREAKER_OPEN_SECONDS") or 30)
+
+# Метрики ИИ по хелперам: как часто (мин) писать сводку в лог (0 — не писать) и цены ($ за 1M токенов: вход, выход)
+# для оценки стоимости по уровням моделей
+AI_METRICS_LOG_MINUTES = float(os.getenv("AI_METRICS_LOG_MINUTES") or 60)
+AI_PRICE_PER_M_TOKENS = {
+    "fast": (float(os.getenv("AI_PRICE_FAST_IN") or 0.10), float(os.getenv("AI_PRICE_FAST_OUT") or 0.40)),
+    "strong": (float(os.getenv("AI_PRICE_STRONG_IN") or 0.30), float(os.getenv("AI_PRICE_STRONG_OUT") or 2.50)),
+}
+
+# Бэкенд модели (ai_backend.py): gemini — настоящий API; fake — локальная заглушка для нагрузочных тестов;
+# record — Gemini с записью ответов в кассету; replay — ответы из кассеты без сети
+AI_BACKEND = (os.getenv("AI_BACKEND") or "gemini").lower()
+AI_CASSETTE_PATH = os.getenv("AI_CASSETTE_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "ai_cassette.jsonl")
+AI_REPLAY_SPEED = float(os.getenv("AI_REPLAY_SPEED") or 1.0)
+# Заглушка: медиана (сек) и разброс (sigma логнормального распределения) задержки, доля ошибок, seed (пусто — случайный)
+FAKE_AI_LATENCY_MEDIAN = float(os.getenv("FAKE_AI_LATENCY_MEDIAN") or 1.0)
+FAKE_AI_LATENCY_SIGMA = float(os.getenv("FAKE_AI_LATENCY_SIGMA") or 0.5)
+FAKE_AI_ERROR_RATE = float(os.getenv("FAKE_AI_ERROR_RATE") or 0.0)
+FAKE_AI_SEED = int(os.getenv("FAKE_AI_SEED")) if os.getenv("FAKE_AI_SEED") else None
+
+# Сверка агрегата daily_totals с meals: в котором часу ночи (по серверному времени) и за сколько последних дней
+DAILY_TOTALS_VERIFY_HOUR = int(os.getenv("DAILY_TOTALS_VERIFY_HOUR") or 3)
+DAILY_TOTALS_VERIFY_DAYS = int(os.getenv("DAILY_TOTALS_VERIFY_DAYS") or 7)
@@ -1,8 +1,11 @@
 """
 PostgreSQL (Neon) через asyncpg. Пул создаётся в bot.py и передаётся в set_pool().
 """
+import json
 import asyncpg
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+
+from migrations import migrate
 
 _pool: asyncpg.Pool | None = None
 
@@ -18,104 +21,9 @@ def _get_pool():
     return _pool
 
 
-async def init_db(pool: asyncpg.Pool | None = None):
-    """Создать таблицы и опционально колонки. Вызывать с pool при старте бота."""
-    p = pool or _get_pool()
-    async with p.acquire() as conn:
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                name TEXT,
-                weight REAL,
-                height REAL,
-                age INTEGER,
-                gender TEXT,
-                activity TEXT,
-                goal TEXT,
-                target_weight REAL,
-                calories_goal INTEGER,
-                protein_goal INTEGER,
-                fat_goal INTEGER,
-                carbs_goal INTEGER,
-                water_goal INTEGER,
-                pace TEXT,
-                reminders_enabled INTEGER DEFAULT 1,
-                reminders_per_day INTEGER DEFAULT 3,
-                username TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        for col, typ in [("water_goal", "INTEGER"), ("pace", "TEXT"), ("username", "TEXT")]:
-            try:
-                await conn.execute(f"ALTER TABLE users ADD COLUMN {col} {typ}")
-            except asyncpg.exceptions.DuplicateColumnError:
-                pass
-        try:
-            await conn.execute("ALTER TABLE users ADD COLUMN last_activity_at TIMESTAMP")
-        except asyncpg.exceptions.DuplicateColumnError:
-            pass
-        for col, typ in [("reengage_enabled", "INTEGER DEFAULT 1"), ("progress_notifications_enabled", "INTEGER DEFAULT 1")]:
-            try:
-                await conn.execute(f"ALTER TABLE users ADD COLUMN {col} {typ}")
-            except asyncpg.exceptions.DuplicateColumnError:
-                pass
-        try:
-            await conn.execute("ALTER TABLE users ADD COLUMN week_status_enabled INTEGER DEFAULT 1")
-        except asyncpg.exceptions.DuplicateColumnError:
-            pass
-
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS reminder_log (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                sent_at TIMESTAMP,
-                date DATE
-            )
-        """)
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS meals (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                name TEXT,
-                calories INTEGER,
-                protein REAL,
-                fat REAL,
-                carbs REAL,
-                date DATE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS weight_log (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                weight REAL,
-                date DATE
-            )
-        """)
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS quick_foods (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                name TEXT,
-                calories INTEGER,
-                protein REAL,
-                fat REAL,
-                carbs REAL
-            )
-        """)
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS notification_sent (
-                user_id BIGINT NOT NULL,
-                sent_date DATE NOT NULL,
-                notification_type VARCHAR(50) NOT NULL,
-                PRIMARY KEY (user_id, sent_date, notification_type)
-            )
-        """)
-        try:
-            await conn.execute("ALTER TABLE notification_sent ADD COLUMN sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-        except asyncpg.exceptions.DuplicateColumnError:
-            pass
+async def init_db(pool: asyncpg.Pool | None = None) -> int:
+    """Привести схему к актуальной версии (migrations.py). Вызывать с pool при старте бота; возвращает число применённых миграций."""
+    return await migrate(pool or _get_pool())
 
 
 # --- Users ---
@@ -138,19 +46,39 @@ async def get_user(user_id: int):
     return None
 
 
-async def save_user(user_id: int, data: dict):
+async def save_user(user_id: int, data: dict, current: dict | None = None) -> dict:
+    """
+    Создать или обновить пользователя одним INSERT ... ON CONFLICT DO UPDATE и вернуть свежую строку.
+    current — уже прочитанная строка: пишутся только изменившиеся колонки, ничего не изменилось — без запроса.
+    """
+    data = {k: v for k, v in data.items() if k != "user_id"}
+    if current is not None:
+        data = {k: v for k, v in data.items() if k not in current or current[k] != v}
+        if not data:
+            return current
+    sel = ", ".join(USER_KEYS)
+    keys = ["user_id", *data]
+    placeholders = ", ".join(f"${i+1}" for i in range(len(keys)))
+    # Без изменённых колонок DO UPDATE всё равно нужен — иначе RETURNING не вернёт существующую строку
+    sets = ", ".join(f"{k} = EXCLUDED.{k}" for k in data) or "user_id = EXCLUDED.user_id"
     p = _get_pool()
     async with p.acquire() as conn:
-        exists = await conn.fetchval("SELECT 1 FROM users WHERE user_id = $1", user_id)
-        if exists:
-            n = len(data)
-            sets = ", ".join(f"{k} = ${i+1}" for i, k in enumerate(data.keys()))
-            await conn.execute(f"UPDATE users SET {sets} WHERE user_id = ${n+1}", *data.values(), user_id)
-        else:
-            data = {**data, "user_id": user_id}
-            keys = ", ".join(data.keys())
-            placeholders = ", ".join(f"${i+1}" for i in range(len(data)))
-            await conn.execute(f"INSERT INTO users ({keys}) VALUES ({placeholders})", *data.values())
+        row = await conn.fetchrow(
+            f"INSERT INTO users ({', '.join(keys)}) VALUES ({placeholders}) "
+            f"ON CONFLICT (user_id) DO UPDATE SET {sets} RETURNING {sel}",
+            user_id, *data.values()
+        )
+    return dict(row)
+
+
+async def update_user(user_id: int, data: dict) -> dict | None:
+    """Изменить колонки существующего пользователя и вернуть свежую строку (None — пользователя нет). Один запрос."""
+    sel = ", ".join(USER_KEYS)
+    sets = ", ".join(f"{k} = ${i+2}" for i, k in enumerate(data))
+    p = _get_pool()
+    async with p.acquire() as conn:
+        row = await conn.fetchrow(f"UPDATE users SET {sets} WHERE user_id = $1 RETURNING {sel}", user_id, *data.values())
+    return dict(row) if row else None
 
 
 async def get_users_for_reminders():
@@ -172,6 +100,69 @@ async def get_users_for_reengage():
     return [r["user_id"] for r in rows]
 
 
+# $1 — день, $2 — последний user_id предыдущей страницы, $3 — размер страницы
+REMINDER_CANDIDATES_SQL = f"""
+    SELECT {', '.join('u.' + k for k in USER_KEYS)},
+           COALESCE(dt.calories, 0) AS total_cal, COALESCE(dt.protein, 0) AS total_prot,
+           COALESCE(dt.fat, 0) AS total_fat, COALESCE(dt.carbs, 0) AS total_carb,
+           rl.cnt AS reminders_today, rl.last_sent AS last_reminder_at,
+           lm.created_at AS last_meal_at, lm.name AS last_meal_name, lm.calories AS last_meal_cal,
+           COALESCE(mt.names, '{{}}') AS meal_names
+    FROM users u
+    LEFT JOIN daily_totals dt ON dt.user_id = u.user_id AND dt.date = $1
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*) AS cnt, MAX(sent_at) AS last_sent FROM reminder_log r WHERE r.user_id = u.user_id AND r.date = $1
+    ) rl
+    LEFT JOIN LATERAL (
+        SELECT created_at, name, calories FROM meals m WHERE m.user_id = u.user_id AND m.date = $1 ORDER BY id DESC LIMIT 1
+    ) lm ON true
+    CROSS JOIN LATERAL (
+        SELECT array_agg(name ORDER BY id) AS names FROM meals m WHERE m.user_id = u.user_id AND m.date = $1
+    ) mt
+    WHERE (u.reminders_enabled IS NULL OR u.reminders_enabled = 1) AND u.calories_goal IS NOT NULL AND u.calories_goal > 0
+      AND u.user_id > $2
+    ORDER BY u.user_id
+    LIMIT $3"""
+
+
+async def iter_reminder_candidates(day: date, page_size: int = 500):
+    """
+    Всё, что нужно проверке напоминаний, для всех пользователей с включёнными напоминаниями и целью по калориям —
+    одним запросом на страницу (LATERAL по индексам «пользователь + день»): профиль, суммы за день,
+    число и время последнего напоминания, последний приём (время, название, калории) и названия приёмов за день.
+    Отдаёт словари по одному; страницы по user_id (keyset) — соединение не держится, пока вызывающий шлёт сообщения.
+    """
+    p = _get_pool()
+    after = -(2 ** 63)
+    while True:
+        async with p.acquire() as conn:
+            rows = await conn.fetch(REMINDER_CANDIDATES_SQL, day, after, page_size)
+        for r in rows:
+            last_sent = r["last_reminder_at"]
+            if getattr(last_sent, "tzinfo", None):
+                last_sent = last_sent.replace(tzinfo=None)
+            last_meal = None
+            if r["last_meal_at"] is not None:
+                created = r["last_meal_at"]
+                last_meal = (str(created.isoformat() if hasattr(created, "isoformat") else created), r["last_meal_name"], int(r["last_meal_cal"] or 0))
+            yield {
+                "user": {k: r[k] for k in USER_KEYS},
+                "totals": {
+                    "calories": int(r["total_cal"] or 0),
+                    "protein": float(r["total_prot"] or 0),
+                    "fat": float(r["total_fat"] or 0),
+                    "carbs": float(r["total_carb"] or 0),
+                },
+                "reminders_today": r["reminders_today"],
+                "last_reminder_at": last_sent,
+                "last_meal": last_meal,
+                "meals_today": list(r["meal_names"]),
+            }
+        if len(rows) < page_size:
+            return
+        after = rows[-1]["user_id"]
+
+
 async def log_reminder_sent(user_id: int):
     p = _get_pool()
     now = datetime.now()
@@ -182,28 +173,6 @@ async def log_reminder_sent(user_id: int):
         )
 
 
-async def get_reminder_count_today(user_id: int):
-    today = date.today()
-    p = _get_pool()
-    async with p.acquire() as conn:
-        n = await conn.fetchval("SELECT COUNT(*) FROM reminder_log WHERE user_id = $1 AND date = $2", user_id, today)
-    return n
-
-
-async def get_last_reminder_sent_at(user_id: int):
-    today = date.today()
-    p = _get_pool()
-    async with p.acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT sent_at FROM reminder_log WHERE user_id = $1 AND date = $2 ORDER BY sent_at DESC LIMIT 1",
-            user_id, today
-        )
-    if not row or not row["sent_at"]:
-        return None
-    ts = row["sent_at"]
-    return ts.replace(tzinfo=None) if getattr(ts, "tzinfo", None) else ts
-
-
 # --- Meals ---
 
 async def add_meal(user_id: int, name: str, calories: int, protein: float, fat: float, carbs: float):
@@ -216,31 +185,49 @@ async def add_meal(user_id: int, name: str, calories: int, protein: float, fat:
         )
 
 
-async def get_meals_today(user_id: int):
+async def add_meal_with_summary(user_id: int, name: str, calories: int, protein: float, fat: float, carbs: float):
+    """
+    add_meal + get_user + get_daily_totals за один запрос. Возвращает (user или None, totals с учётом нового приёма).
+    Подзапрос prev читает daily_totals до срабатывания триггера (один снимок), поэтому новый приём прибавляется явно.
+    """
     p = _get_pool()
     today = date.today()
+    sel = ", ".join(f"u.{k}" for k in USER_KEYS)
     async with p.acquire() as conn:
-        rows = await conn.fetch(
-            "SELECT id, name, calories, protein, fat, carbs FROM meals WHERE user_id = $1 AND date = $2 ORDER BY id",
-            user_id, today
+        row = await conn.fetchrow(
+            f"""WITH ins AS (
+                   INSERT INTO meals (user_id, name, calories, protein, fat, carbs, date) VALUES ($1,$2,$3,$4,$5,$6,$7)
+                   RETURNING calories, protein, fat, carbs
+               ), prev AS (
+                   SELECT COALESCE(SUM(calories), 0) AS cal, COALESCE(SUM(protein), 0) AS prot,
+                          COALESCE(SUM(fat), 0) AS fat, COALESCE(SUM(carbs), 0) AS carb
+                   FROM daily_totals WHERE user_id = $1 AND date = $7
+               )
+               SELECT prev.cal + ins.calories AS total_cal, prev.prot + ins.protein AS total_prot,
+                      prev.fat + ins.fat AS total_fat, prev.carb + ins.carbs AS total_carb,
+                      u.user_id IS NOT NULL AS has_user, {sel}
+               FROM ins CROSS JOIN prev LEFT JOIN users u ON u.user_id = $1""",
+            user_id, name, calories, protein, fat, carbs, today
         )
-    return [(r["id"], r["name"], r["calories"], r["protein"], r["fat"], r["carbs"]) for r in rows]
+    totals = {
+        "calories": int(row["total_cal"] or 0),
+        "protein": float(row["total_prot"] or 0),
+        "fat": float(row["total_fat"] or 0),
+        "carbs": float(row["total_carb"] or 0),
+    }
+    user = {k: row[k] for k in USER_KEYS} if row["has_user"] else None
+    return user, totals
+
 
+MEALS_TODAY_SQL = "SELECT id, name, calories, protein, fat, carbs FROM meals WHERE user_id = $1 AND date = $2 ORDER BY id"
 
-async def get_last_meal_today(user_id: int):
+
+async def get_meals_today(user_id: int):
     p = _get_pool()
     today = date.today()
     async with p.acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT created_at, name, calories FROM meals WHERE user_id = $1 AND date = $2 ORDER BY id DESC LIMIT 1",
-            user_id, today
-        )
-    if not row:
-        return None
-    created = row["created_at"]
-    if hasattr(created, "isoformat"):
-        created = created.isoformat()
-    return (str(created), row["name"], int(row["calories"] or 0))
+        rows = await conn.fetch(MEALS_TODAY_SQL, user_id, today)
+    return [(r["id"], r["name"], r["calories"], r["protein"], r["fat"], r["carbs"]) for r in rows]
 
 
 async def delete_last_meal(user_id: int):
@@ -261,14 +248,17 @@ async def delete_meal_by_id(meal_id: int, user_id: int):
     return r == "DELETE 1"
 
 
+DAILY_TOTALS_SQL = "SELECT calories AS cal, protein AS prot, fat, carbs AS carb FROM daily_totals WHERE user_id = $1 AND date = $2"
+
+
 async def get_daily_totals(user_id: int, target_date: date | None = None):
+    """Суммы КБЖУ за день — одна строка daily_totals по первичному ключу (её ведёт триггер на meals)."""
     p = _get_pool()
     d = target_date or date.today()
     async with p.acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT SUM(calories) AS cal, SUM(protein) AS prot, SUM(fat) AS fat, SUM(carbs) AS carb FROM meals WHERE user_id = $1 AND date = $2",
-            user_id, d
-        )
+        row = await conn.fetchrow(DAILY_TOTALS_SQL, user_id, d)
+    if not row:
+        return {"calories": 0, "protein": 0.0, "fat": 0.0, "carbs": 0.0}
     return {
         "calories": int(row["cal"] or 0),
         "protein": float(row["prot"] or 0),
@@ -277,14 +267,15 @@ async def get_daily_totals(user_id: int, target_date: date | None = None):
     }
 
 
+MEALS_RANGE_SQL = """SELECT date::text AS d, calories AS cal, protein AS prot, fat, carbs AS carb
+    FROM daily_totals WHERE user_id = $1 AND date BETWEEN $2 AND $3 ORDER BY date"""
+
+
 async def get_meals_range(user_id: int, from_date: date, to_date: date):
+    """Суммы по дням с едой (date_str, cal, prot, fat, carb) — диапазон по первичному ключу daily_totals."""
     p = _get_pool()
     async with p.acquire() as conn:
-        rows = await conn.fetch(
-            """SELECT date::text AS d, SUM(calories) AS cal, SUM(protein) AS prot, SUM(fat) AS fat, SUM(carbs) AS carb
-               FROM meals WHERE user_id = $1 AND date BETWEEN $2 AND $3 GROUP BY date ORDER BY date""",
-            user_id, from_date, to_date
-        )
+        rows = await conn.fetch(MEALS_RANGE_SQL, user_id, from_date, to_date)
     return [(r["d"], r["cal"] or 0, r["prot"] or 0, r["fat"] or 0, r["carb"] or 0) for r in rows]
 
 
@@ -292,10 +283,50 @@ async def get_first_meal_date(user_id: int) -> date | None:
     """Дата первого приёма пищи (для расчёта «всего дней в системе» и серий)."""
     p = _get_pool()
     async with p.acquire() as conn:
-        row = await conn.fetchval("SELECT MIN(date) FROM meals WHERE user_id = $1", user_id)
+        row = await conn.fetchval("SELECT MIN(date) FROM daily_totals WHERE user_id = $1", user_id)
     return row
 
 
+async def verify_daily_totals(days: int) -> int:
+    """
+    Сверить daily_totals с суммами по meals за последние days дней и исправить расхождения
+    (триггер выключали, правили meals вручную). Возвращает число исправленных дней.
+    Поиск — без блокировок; исправление — под SHARE-блокировкой meals, чтобы новый приём не потерялся между пересчётом и записью.
+    """
+    p = _get_pool()
+    since = date.today() - timedelta(days=days)
+    diff_sql = """
+        WITH fresh AS (
+            SELECT user_id, date, COALESCE(SUM(calories), 0) AS calories, COALESCE(SUM(protein::double precision), 0) AS protein,
+                   COALESCE(SUM(fat::double precision), 0) AS fat, COALESCE(SUM(carbs::double precision), 0) AS carbs, COUNT(*) AS meals
+            FROM meals WHERE date >= $1 AND user_id IS NOT NULL GROUP BY user_id, date
+        ), stored AS (
+            SELECT * FROM daily_totals WHERE date >= $1
+        )
+        SELECT user_id, date FROM fresh FULL JOIN stored USING (user_id, date)
+        WHERE fresh.meals IS DISTINCT FROM stored.meals
+           OR fresh.calories IS DISTINCT FROM stored.calories
+           OR abs(fresh.protein - stored.protein) > 0.01
+           OR abs(fresh.fat - stored.fat) > 0.01
+           OR abs(fresh.carbs - stored.carbs) > 0.01"""
+    async with p.acquire() as conn:
+        if not await conn.fetch(diff_sql, since):
+            return 0
+        async with conn.transaction():
+            await conn.execute("LOCK TABLE meals IN SHARE MODE")
+            keys = await conn.fetch(diff_sql, since)
+            for k in keys:
+                await conn.execute("DELETE FROM daily_totals WHERE user_id = $1 AND date = $2", k["user_id"], k["date"])
+                await conn.execute(
+                    """INSERT INTO daily_totals (user_id, date, calories, protein, fat, carbs, meals)
+                       SELECT user_id, date, COALESCE(SUM(calories), 0), COALESCE(SUM(protein::double precision), 0),
+                              COALESCE(SUM(fat::double precision), 0), COALESCE(SUM(carbs::double precision), 0), COUNT(*)
+                       FROM meals WHERE user_id = $1 AND date = $2 GROUP BY user_id, date""",
+                    k["user_id"], k["date"]
+                )
+    return len(keys)
+
+
 # --- Weight ---
 
 async def log_weight(user_id: int, weight: float):
@@ -306,22 +337,25 @@ async def log_weight(user_id: int, weight: float):
         await conn.execute("UPDATE users SET weight = $1 WHERE user_id = $2", weight, user_id)
 
 
+WEIGHT_HISTORY_SQL = "SELECT weight, date FROM weight_log WHERE user_id = $1 ORDER BY date DESC LIMIT $2"
+
+
 async def get_weight_history(user_id: int, limit: int = 30):
     p = _get_pool()
     async with p.acquire() as conn:
-        rows = await conn.fetch(
-            "SELECT weight, date FROM weight_log WHERE user_id = $1 ORDER BY date DESC LIMIT $2",
-            user_id, limit
-        )
+        rows = await conn.fetch(WEIGHT_HISTORY_SQL, user_id, limit)
     return [(r["weight"], r["date"].isoformat() if hasattr(r["date"], "isoformat") else str(r["date"])) for r in rows]
 
 
 # --- Quick foods ---
 
+QUICK_FOODS_SQL = "SELECT id, name, calories, protein, fat, carbs FROM quick_foods WHERE user_id = $1"
+
+
 async def get_quick_foods(user_id: int):
     p = _get_pool()
     async with p.acquire() as conn:
-        rows = await conn.fetch("SELECT id, name, calories, protein, fat, carbs FROM quick_foods WHERE user_id = $1", user_id)
+        rows = await conn.fetch(QUICK_FOODS_SQL, user_id)
     return [(r["id"], r["name"], r["calories"], r["protein"], r["fat"], r["carbs"]) for r in rows]
 
 
@@ -361,14 +395,16 @@ async def was_notification_sent(user_id: int, sent_date: date, notification_type
     return row is not None
 
 
+LAST_STREAK_NOTIFICATION_SQL = (
+    "SELECT sent_date FROM notification_sent WHERE user_id = $1 AND notification_type = $2 ORDER BY sent_date DESC LIMIT 1"
+)
+
+
 async def get_last_streak_notification_date(user_id: int, notification_type: str) -> date | None:
     """Дата последней отправки уведомления о 5-дневной серии (protein_shortfall / fat_over / cal_over)."""
     p = _get_pool()
     async with p.acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT sent_date FROM notification_sent WHERE user_id = $1 AND notification_type = $2 ORDER BY sent_date DESC LIMIT 1",
-            user_id, notification_type
-        )
+        row = await conn.fetchrow(LAST_STREAK_NOTIFICATION_SQL, user_id, notification_type)
     return row["sent_date"] if row else None
 
 
@@ -383,14 +419,16 @@ async def update_last_activity(user_id: int):
         )
 
 
+LAST_REENGAGE_SENT_SQL = (
+    "SELECT sent_at FROM notification_sent WHERE user_id = $1 AND notification_type = $2 ORDER BY sent_at DESC LIMIT 1"
+)
+
+
 async def get_last_reengage_sent_at(user_id: int, notification_type: str) -> datetime | None:
     """Время последней отправки reengage-напоминания (reengage_48h / reengage_5d)."""
     p = _get_pool()
     async with p.acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT sent_at FROM notification_sent WHERE user_id = $1 AND notification_type = $2 ORDER BY sent_at DESC LIMIT 1",
-            user_id, notification_type
-        )
+        row = await conn.fetchrow(LAST_REENGAGE_SENT_SQL, user_id, notification_type)
     if not row or not row.get("sent_at"):
         return None
     ts = row["sent_at"]
@@ -407,3 +445,153 @@ async def log_reengage_sent(user_id: int, notification_type: str):
             "INSERT INTO notification_sent (user_id, sent_date, notification_type, sent_at) VALUES ($1, $2, $3, $4) ON CONFLICT (user_id, sent_date, notification_type) DO UPDATE SET sent_at = $4",
             user_id, today, notification_type, now
         )
+
+
+# --- Кэш ответов ИИ (cache.TwoTierCache) ---
+
+async def ai_cache_get(namespace: str, key: str, version: int, max_age_days: int | None = None):
+    """Значение из ai_cache или None (нет записи, другая версия промпта или запись старше max_age_days)."""
+    p = _get_pool()
+    async with p.acquire() as conn:
+        if max_age_days:
+            raw = await conn.fetchval(
+                "SELECT value::text FROM ai_cache WHERE namespace = $1 AND key = $2 AND version = $3 AND created_at > NOW() - make_interval(days => $4)",
+                namespace, key, version, max_age_days
+            )
+        else:
+            raw = await conn.fetchval(
+                "SELECT value::text FROM ai_cache WHERE namespace = $1 AND key = $2 AND version = $3",
+                namespace, key, version
+            )
+    return json.loads(raw) if raw is not None else None
+
+
+async def ai_cache_set(namespace: str, key: str, version: int, value):
+    p = _get_pool()
+    async with p.acquire() as conn:
+        await conn.execute(
+            "INSERT INTO ai_cache (namespace, key, version, value, created_at) VALUES ($1, $2, $3, $4::jsonb, NOW()) "
+            "ON CONFLICT (namespace, key) DO UPDATE SET version = EXCLUDED.version, value = EXCLUDED.value, created_at = EXCLUDED.created_at",
+            namespace, key, version, json.dumps(value, ensure_ascii=False)
+        )
+
+
+async def ai_cache_purge(namespace: str, keep_version: int | None = None):
+    """Удалить записи namespace; при keep_version — только записи других версий промпта."""
+    p = _get_pool()
+    async with p.acquire() as conn:
+        if keep_version is None:
+            await conn.execute("DELETE FROM ai_cache WHERE namespace = $1", namespace)
+        else:
+            await conn.execute("DELETE FROM ai_cache WHERE namespace = $1 AND version <> $2", namespace, keep_version)
+
+
+# --- Пул заранее сгенерированных текстов уведомлений ---
+
+async def message_pool_get(kind: str, goal: str) -> list:
+    """Все тексты пула для (вид уведомления, цель пользователя)."""
+    p = _get_pool()
+    async with p.acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT payload::text AS payload FROM message_pool WHERE kind = $1 AND goal = $2",
+            kind, goal
+        )
+    return [json.loads(r["payload"]) for r in rows]
+
+
+async def message_pool_counts() -> dict:
+    """(kind, goal) -> сколько текстов в пуле."""
+    p = _get_pool()
+    async with p.acquire() as conn:
+        rows = await conn.fetch("SELECT kind, goal, COUNT(*) AS n FROM message_pool GROUP BY kind, goal")
+    return {(r["kind"], r["goal"]): r["n"] for r in rows}
+
+
+async def message_pool_add(kind: str, goal: str, payload):
+    p = _get_pool()
+    async with p.acquire() as conn:
+        await conn.execute(
+            "INSERT INTO message_pool (kind, goal, payload) VALUES ($1, $2, $3::jsonb)",
+            kind, goal, json.dumps(payload, ensure_ascii=False)
+        )
+
+
+async def message_pool_purge(max_age_days: int):
+    """Удалить тексты старше max_age_days — пул постепенно обновляется."""
+    p = _get_pool()
+    async with p.acquire() as conn:
+        await conn.execute(
+            "DELETE FROM message_pool WHERE created_at < NOW() - make_interval(days => $1)",
+            max_age_days
+        )
+
+
+# --- Проверка планов запросов ---
+
+_SAMPLE_DAY = date(2024, 1, 1)
+
+# Запросы горячих путей — те же константы, что выполняют функции (проверяется ровно исполняемый SQL), пример
+# параметров и индексы (миграции user_day_indexes, daily_totals), которыми запрос должен читаться, — check_access_paths
+ACCESS_PATHS = [
+    ("get_meals_today", MEALS_TODAY_SQL, (0, _SAMPLE_DAY), ("meals_user_date_id",)),
+    ("get_daily_totals", DAILY_TOTALS_SQL, (0, _SAMPLE_DAY), ("daily_totals_pkey",)),
+    ("get_meals_range", MEALS_RANGE_SQL, (0, _SAMPLE_DAY, _SAMPLE_DAY), ("daily_totals_pkey",)),
+    ("iter_reminder_candidates", REMINDER_CANDIDATES_SQL, (_SAMPLE_DAY, 0, 500),
+     ("users_pkey", "daily_totals_pkey", "reminder_log_user_date_sent", "meals_user_date_id")),
+    ("get_weight_history", WEIGHT_HISTORY_SQL, (0, 30), ("weight_log_user_date",)),
+    ("get_last_streak_notification_date", LAST_STREAK_NOTIFICATION_SQL, (0, "protein_shortfall"), ("notification_sent_user_type_date",)),
+    ("get_last_reengage_sent_at", LAST_REENGAGE_SENT_SQL, (0, "reengage_48h"), ("notification_sent_user_type_sent_at",)),
+    ("get_quick_foods", QUICK_FOODS_SQL, (0,), ("quick_foods_user",)),
+]
+
+
+def _plan_indexes(node: dict) -> tuple[set[str], bool]:
+    """Индексы в плане EXPLAIN (FORMAT JSON) и есть ли последовательное сканирование."""
+    indexes = {node["Index Name"]} if "Index Name" in node else set()
+    seq = node.get("Node Type") == "Seq Scan"
+    for child in node.get("Plans", []):
+        child_indexes, child_seq = _plan_indexes(child)
+        indexes |= child_indexes
+        seq = seq or child_seq
+    return indexes, seq
+
+
+async def check_access_paths(pool: asyncpg.Pool | None = None) -> list[str]:
+    """
+    EXPLAIN каждого запроса из ACCESS_PATHS с запретом seq scan: запрос обязан читаться своими индексами.
+    На маленьких таблицах планировщик и так выбрал бы seq scan, поэтому он выключается — проверяется, что индекс
+    подходит под форму запроса. Возвращает описания расхождений (пусто — всё в порядке).
+    """
+    p = pool or _get_pool()
+    problems = []
+    async with p.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("SET LOCAL enable_seqscan = off")
+            for name, sql, args, expected in ACCESS_PATHS:
+                plan = json.loads(await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *args))[0]["Plan"]
+                indexes, seq = _plan_indexes(plan)
+                missing = [i for i in expected if i not in indexes]
+                if missing or seq:
+                    problems.append(f"{name}: ожидались {', '.join(expected)}, в плане {sorted(indexes) or 'seq scan'}")
+    return problems
+
+
+async def _check_main() -> int:
+    from config import DATABASE_URL
+    pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=1)
+    try:
+        problems = await check_access_paths(pool)
+    finally:
+        await pool.close()
+    for problem in problems:
+        print(f"Индекс не используется: {problem}")
+    print(f"Проверено запросов: {len(ACCESS_PATHS)}, расхождений: {len(problems)}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    # Проверка планов по требованию (после изменения запросов или схемы, в CI): код выхода 1 — есть расхождения
+    import asyncio
+    import sys
+
+    sys.exit(asyncio.run(_check_main()))
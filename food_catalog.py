@@ -0,0 +1,164 @@
+"""
+Локальный справочник КБЖУ на 100 г (data/foods.csv) с поиском по триграммам.
+Простые запросы «<продукт> <граммы>г» / «<продукт> <N> шт» считаются без модели, только если каждое слово
+запроса (включая жирность: «молоко 1%») есть в одном названии или синониме продукта — «картошка фри»,
+«рис жареный», «не гречка» уходят в Gemini, как и составные блюда и неоднозначные названия.
+"""
+import csv
+import logging
+import os
+from collections import defaultdict
+
+from config import FOOD_CATALOG_PATH, FOOD_CATALOG_MIN_SCORE
+from food_text import canonical_food_text, is_composite, parse_portion
+
+logger = logging.getLogger("food_catalog")
+
+# Для составного текста («кофе с молоком») принимаем только почти точное совпадение с названием/синонимом
+COMPOSITE_MIN_SCORE = 0.9
+# Порция по умолчанию, когда ИИ недоступен и граммы не указаны
+DEFAULT_PORTION_G = 100.0
+
+
+def _trigrams(text: str) -> set[str]:
+    t = f"  {text} "
+    return {t[i:i + 3] for i in range(len(t) - 2)}
+
+
+class FoodCatalog:
+    def __init__(self):
+        self.foods: list[dict] = []
+        self._names: list[tuple[str, int, set[str], set[str]]] = []  # (название/синоним, индекс продукта, триграммы, слова)
+        self._index: dict[str, set[int]] = defaultdict(set)  # триграмма -> индексы в _names
+
+    def load_csv(self, path: str) -> int:
+        """Загрузить продукты из CSV (name, aliases через |, calories, protein, fat, carbs на 100 г, piece_g)."""
+        with open(path, encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                try:
+                    food = {
+                        "name": row["name"].strip(),
+                        "calories": float(row["calories"]),
+                        "protein": float(row["protein"]),
+                        "fat": float(row["fat"]),
+                        "carbs": float(row["carbs"]),
+                        "piece_g": float(row["piece_g"]) if (row.get("piece_g") or "").strip() else None,
+                    }
+                except (KeyError, ValueError) as e:
+                    logger.warning("Пропущена строка справочника %s: %s", row, e)
+                    continue
+                self.add(food, [food["name"]] + [a for a in (row.get("aliases") or "").split("|") if a.strip()])
+        return len(self.foods)
+
+    def add(self, food: dict, names: list[str]):
+        idx = len(self.foods)
+        self.foods.append(food)
+        for name in names:
+            key = canonical_food_text(name)
+            if not key:
+                continue
+            grams = _trigrams(key)
+            name_idx = len(self._names)
+            self._names.append((key, idx, grams, set(key.split())))
+            for g in grams:
+                self._index[g].add(name_idx)
+
+    def _piece_food(self, text: str) -> bool:
+        found = self.match(text)
+        return bool(found and found[0]["piece_g"])
+
+    def match(self, text: str) -> tuple[dict, float] | None:
+        """
+        Лучший продукт и оценка сходства (коэффициент Дайса по триграммам, 0–1; 1.0 — точное название/синоним).
+        Кандидаты — только названия/синонимы, содержащие все слова запроса: лишнее слово («фри», «жареный», «не»,
+        другая жирность) означает другой продукт, и ответа нет. Без точного совпадения запрос, подходящий к разным
+        продуктам («гречка» — сухая или отварная, «курица» — грудка или жареная), считается неоднозначным — тоже None.
+        """
+        query = canonical_food_text(text)
+        if not query:
+            return None
+        grams = _trigrams(query)
+        words = set(query.split())
+        shared: dict[int, int] = defaultdict(int)
+        for g in grams:
+            for name_idx in self._index.get(g, ()):
+                shared[name_idx] += 1
+        best, best_score = None, 0.0
+        candidates: set[int] = set()
+        for name_idx, common in shared.items():
+            key, idx, name_grams, name_words = self._names[name_idx]
+            if not words <= name_words:
+                continue
+            if key == query:
+                return self.foods[idx], 1.0
+            candidates.add(idx)
+            score = 2 * common / (len(grams) + len(name_grams))
+            if score > best_score:
+                best, best_score = self.foods[idx], score
+        if len(candidates) > 1:
+            return None
+        return (best, best_score) if best else None
+
+    def lookup(self, text: str, default_portion: bool = False) -> dict | None:
+        """
+        Ответ в формате analyze_food_text для «<продукт> <количество>» или None, если запрос не простой,
+        продукт не найден уверенно или для штук не известен вес одной штуки.
+        default_portion=True (локальный режим без ИИ): только точное название или синоним; количество не указано —
+        одна штука или 100 г, и в comment сказано, что порция принята по умолчанию.
+        """
+        portion = parse_portion(text)
+        assumed = False
+        if not portion:
+            if not default_portion:
+                return None
+            portion = (text, 1.0, "шт") if self._piece_food(text) else (text, DEFAULT_PORTION_G, "г")
+            assumed = True
+        food_text, qty, unit = portion
+        found = self.match(food_text)
+        if not found:
+            return None
+        food, score = found
+        if default_portion:
+            min_score = 1.0
+        else:
+            min_score = COMPOSITE_MIN_SCORE if is_composite(food_text) else FOOD_CATALOG_MIN_SCORE
+        if score < min_score:
+            return None
+        if unit == "шт":
+            if not food["piece_g"]:
+                return None
+            grams = qty * food["piece_g"]
+            portion_label = f"{qty:g} шт, ~{grams:.0f}г"
+        else:
+            grams = qty
+            portion_label = f"{grams:.0f}г"
+        k = grams / 100
+        comment = f"По справочнику: {food['calories']:.0f} ккал на 100 г."
+        if assumed:
+            comment += f" Порция не указана — принято {portion_label}; если съел другое количество, напиши с граммами."
+        return {
+            "name": f"{food['name']} ({portion_label})",
+            "calories": round(food["calories"] * k),
+            "protein": round(food["protein"] * k, 1),
+            "fat": round(food["fat"] * k, 1),
+            "carbs": round(food["carbs"] * k, 1),
+            "comment": comment,
+            "source": "catalog",
+        }
+
+
+catalog = FoodCatalog()
+_loaded = False
+
+
+def lookup(text: str, default_portion: bool = False) -> dict | None:
+    """Поиск в справочнике; CSV читается при первом обращении."""
+    global _loaded
+    if not _loaded:
+        _loaded = True
+        if os.path.exists(FOOD_CATALOG_PATH):
+            n = catalog.load_csv(FOOD_CATALOG_PATH)
+            logger.info("Справочник продуктов загружен: %s позиций", n)
+        else:
+            logger.warning("Справочник продуктов не найден: %s", FOOD_CATALOG_PATH)
+    return catalog.lookup(text, default_portion)
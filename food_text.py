@@ -0,0 +1,75 @@
+"""
+Нормализация текстовых описаний еды («Овсянка 50 гр», «банан средний») — ключи для кэша анализа текста.
+"""
+import re
+
+# Написания единиц → каноническая форма (после числа)
+_UNIT_PATTERNS = [
+    (re.compile(r"(\d+(?:\.\d+)?)\s*(?:килограмм(?:ов|а)?|кг)\.?(?=\W|$)"), r"\1кг"),
+    (re.compile(r"(\d+(?:\.\d+)?)\s*(?:грамм(?:ов|а)?|гр|г)\.?(?=\W|$)"), r"\1г"),
+    (re.compile(r"(\d+(?:\.\d+)?)\s*(?:миллилитр(?:ов|а)?|мл)\.?(?=\W|$)"), r"\1мл"),
+    (re.compile(r"(\d+(?:\.\d+)?)\s*(?:литр(?:ов|а)?|л)\.?(?=\W|$)"), r"\1л"),
+    (re.compile(r"(\d+(?:\.\d+)?)\s*(?:штук(?:и|а)?|шт)\.?(?=\W|$)"), r"\1шт"),
+]
+
+# Разделители компонентов: «гречка, курица», «гречка + курица», «гречка и курица», «гречка с курицей»
+_SPLIT_RE = re.compile(r"\s*(?:[,;+]|\bи\b|\bс\b|\bплюс\b)\s*")
+_JUNK_RE = re.compile(r"[^\w\s.]")
+
+
+def _clean(text: str) -> str:
+    text = _JUNK_RE.sub(" ", text)
+    return " ".join(text.split()).strip(" .")
+
+
+def _unify(text: str) -> str:
+    t = (text or "").lower().replace("ё", "е")
+    t = re.sub(r"(\d),(\d)", r"\1.\2", t)
+    for pattern, repl in _UNIT_PATTERNS:
+        t = pattern.sub(repl, t)
+    return t
+
+
+def canonical_food_text(text: str) -> str:
+    """Регистр, ё→е, десятичная запятая, единицы («50 гр» → «50г»), пробелы — без перестановки компонентов."""
+    return _clean(_unify(text))
+
+
+def normalize_food_text(text: str) -> str:
+    """
+    Ключ кэша: canonical_food_text + порядок компонентов.
+    «Курица 200 гр, гречка» и «гречка + курица 200г» дают один ключ; повторы компонентов сохраняются
+    («банан, банан» ≠ «банан»).
+    """
+    parts = [_clean(part) for part in _SPLIT_RE.split(_unify(text))]
+    return " + ".join(sorted(p for p in parts if p))
+
+
+def is_composite(text: str) -> bool:
+    """Несколько компонентов через запятую, «+», «и», «с»."""
+    return len([p for p in _SPLIT_RE.split(_unify(text)) if _clean(p)]) > 1
+
+
+_PORTION_AFTER_RE = re.compile(r"^(?P<food>.*?\D)\s*(?P<qty>\d+(?:\.\d+)?)(?P<unit>кг|г|мл|л|шт)$")
+_PORTION_BEFORE_RE = re.compile(r"^(?P<qty>\d+(?:\.\d+)?)(?P<unit>кг|г|мл|л|шт)\s+(?P<food>.+)$")
+# Жидкости считаем по плотности ~1 г/мл
+_UNIT_TO_GRAMS = {"г": 1, "кг": 1000, "мл": 1, "л": 1000}
+
+
+def parse_portion(text: str) -> tuple[str, float, str] | None:
+    """
+    «Овсянка 50 гр» → ("овсянка", 50.0, "г"), «2 шт яйцо» → ("яйцо", 2.0, "шт").
+    Масса/объём переводятся в граммы (unit «г»), штуки остаются «шт». Не простой «<продукт> <количество>» — None.
+    """
+    t = canonical_food_text(text)
+    m = _PORTION_AFTER_RE.match(t) or _PORTION_BEFORE_RE.match(t)
+    if not m:
+        return None
+    food = m.group("food").strip()
+    qty = float(m.group("qty"))
+    unit = m.group("unit")
+    if not food or qty <= 0:
+        return None
+    if unit in _UNIT_TO_GRAMS:
+        return food, qty * _UNIT_TO_GRAMS[unit], "г"
+    return food, qty, "шт"
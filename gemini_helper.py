@@ -1,10 +1,422 @@
+import asyncio
+import hashlib
 import google.generativeai as genai
 import json
-import re
-from config import GEMINI_API_KEY
+import logging
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+from config import (
+    GEMINI_API_KEY,
+    FOOD_TEXT_CACHE_SIZE,
+    FOOD_TEXT_CACHE_TTL,
+    FOOD_TEXT_CACHE_DB_DAYS,
+    REMINDER_BATCH_SIZE,
+    TIP_BUCKET_PCT,
+    TIP_POOL_SIZE,
+    TIP_CACHE_SIZE,
+    TIP_CACHE_TTL,
+    TIP_REFILL_MAX_DUPLICATES,
+    AFTER_MEAL_TASK_TIMEOUT,
+    GOALS_CACHE_SIZE,
+    GOALS_CACHE_TTL,
+    GOALS_CACHE_DB_DAYS,
+    GEMINI_MODEL_FAST,
+    GEMINI_MODEL_STRONG,
+    ROUTER_FAST_MAX_TEXT_LEN,
+    ROUTER_MIN_CONFIDENCE,
+    JSON_MAX_RETRIES,
+    JSON_RETRY_RATIO,
+    JSON_RETRY_CAPACITY,
+    AI_CALL_TIMEOUT,
+    AI_HARD_TIMEOUT,
+    HEDGE_ENABLED,
+    HEDGE_MIN_DELAY,
+    HEDGE_MIN_SAMPLES,
+    AI_BREAKER_FAILURES,
+    AI_BREAKER_OPEN_SECONDS,
+)
+from cache import LRUCache, TwoTierCache
+from food_text import normalize_food_text, is_composite
+import food_catalog
+from portion_cache import PortionCache
+from ai_scheduler import scheduler, current_priority, set_priority, time_left, INTERACTIVE, BACKGROUND, RetryBudget, percentile
+from ai_json import parse_json_response, JSONParseError
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from image_prep import prepare_image
+from ai_backend import create_model
+from ai_metrics import instrument, current_helper, record_usage, record_error, record_cache_hit
+from background import spawn
 
 genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel("gemini-2.5-flash")
+
+# Два уровня моделей: FAST — короткие тексты еды, советы, статус недели; STRONG — всё остальное и эскалация
+FAST = "fast"
+STRONG = "strong"
+# Модели создаёт ai_backend: настоящий Gemini или заглушка / запись / воспроизведение кассеты (AI_BACKEND)
+models = {
+    FAST: create_model(GEMINI_MODEL_FAST),
+    STRONG: create_model(GEMINI_MODEL_STRONG),
+}
+model = models[STRONG]
+
+logger = logging.getLogger("gemini")
+
+
+# Single-flight: одинаковые промпты, пришедшие одновременно, ждут один запрос к модели
+_inflight: dict[str, asyncio.Future] = {}
+singleflight_stats = {"calls": 0, "coalesced": 0}
+
+
+def _prompt_key(contents) -> str:
+    """Хэш промпта (текст и байты картинок) — ключ для склейки одинаковых запросов."""
+    h = hashlib.sha256()
+    for part in contents if isinstance(contents, list) else [contents]:
+        if isinstance(part, dict):
+            h.update(str(part.get("mime_type", "")).encode())
+            h.update(part.get("data") or b"")
+        else:
+            h.update(str(part).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _forget_inflight(key: str, task: asyncio.Future):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if not task.cancelled():
+        task.exception()  # ошибку уже получили ожидающие; иначе asyncio пишет «exception was never retrieved»
+
+
+# Маршрутизация по уровням: вызовы и задержка по уровню, эскалации FAST → STRONG по причинам
+router_stats = {
+    "calls": {FAST: 0, STRONG: 0},
+    "errors": {FAST: 0, STRONG: 0},
+    "escalations": {},
+}
+# Задержка только успешных ответов: по уровню и по (хелпер, уровень) — у фото и совета дня разные p95
+_tier_latency = {FAST: deque(maxlen=500), STRONG: deque(maxlen=500)}
+_helper_latency: dict[tuple[str, str], deque] = {}
+
+
+def _record_latency(tier: str, elapsed: float):
+    _tier_latency[tier].append(elapsed)
+    key = (current_helper(), tier)
+    if key not in _helper_latency:
+        _helper_latency[key] = deque(maxlen=500)
+    _helper_latency[key].append(elapsed)
+
+
+def tier_stats() -> dict:
+    out = {"escalations": dict(router_stats["escalations"])}
+    for tier in (FAST, STRONG):
+        latency = sorted(_tier_latency[tier])
+        out[tier] = {
+            "model": models[tier].model_name,
+            "calls": router_stats["calls"][tier],
+            "errors": router_stats["errors"][tier],
+            "latency_p50_ms": round(percentile(latency, 0.5) * 1000, 1),
+            "latency_p95_ms": round(percentile(latency, 0.95) * 1000, 1),
+            "helpers": {
+                name: {"samples": len(samples), "latency_p95_ms": round(percentile(sorted(samples), 0.95) * 1000, 1)}
+                for (name, t), samples in _helper_latency.items() if t == tier
+            },
+        }
+    return out
+
+
+def _json_config(schema: dict):
+    """Структурированный вывод: модель обязана вернуть JSON по схеме."""
+    return genai.GenerationConfig(response_mime_type="application/json", response_schema=schema)
+
+
+def _record_call_outcome(elapsed: float, call_timeout: float):
+    """
+    Успешный ответ — успех для предохранителя, если уложился в таймаут своего вида запроса (CALL_TIMEOUTS):
+    ответ дольше пользователь всё равно не дождался, это сбой. Сравнение с общим AI_CALL_TIMEOUT
+    размыкало бы цепь на нормальных 25-секундных фото и 30-секундных целях.
+    """
+    if elapsed > call_timeout:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+async def _scheduled_call(contents, tier: str = STRONG, schema: dict | None = None, call_timeout: float = AI_CALL_TIMEOUT):
+    """Запрос к модели через общий планировщик (лимит параллельности, частоты и приоритеты). call_timeout — таймаут вида запроса."""
+    kwargs = {"generation_config": _json_config(schema)} if schema else {}
+    async with scheduler.slot():
+        router_stats["calls"][tier] += 1
+        started = time.monotonic()
+        try:
+            # Жёсткий таймаут: зависший запрос не держит слот планировщика бесконечно
+            response = await asyncio.wait_for(
+                models[tier].generate_content_async(contents, request_options={"timeout": AI_HARD_TIMEOUT}, **kwargs),
+                AI_HARD_TIMEOUT,
+            )
+        except Exception as e:
+            router_stats["errors"][tier] += 1
+            breaker.record_error(e)
+            record_error(e)
+            raise
+        elapsed = time.monotonic() - started
+    # Упавшие и отменённые (проигравший хедж) попытки в задержку не пишем — иначе они сдвигают порог хеджирования
+    _record_latency(tier, elapsed)
+    _record_call_outcome(elapsed, call_timeout)
+    record_usage(tier, response)
+    return response
+
+
+# Таймауты: сколько ждать ответ модели по видам запросов (сек); остальные — AI_CALL_TIMEOUT.
+# Фактическое ожидание — не дольше, чем осталось до крайнего срока апдейта (ai_scheduler.set_deadline).
+CALL_TIMEOUTS = {
+    "food_photo": 25,
+    "food_text": 12,
+    "goals": 30,
+    "daily_tip": 8,
+    "week_status": 20,
+    "meal_suggestion": 20,
+}
+timeout_stats = {"timeouts": 0, "deadline_exceeded": 0, "hedged": 0, "hedge_won": 0}
+_timed_out: ContextVar[bool] = ContextVar("ai_timed_out", default=False)
+
+AI_TIMEOUT_MESSAGE = "⏳ ИИ сейчас отвечает слишком долго. Попробуй ещё раз через минуту или добавь еду текстом, например: <i>рис 200г</i>"
+AI_UNAVAILABLE_MESSAGE = "⚠️ ИИ временно недоступен. Простые продукты с граммами считаю по справочнику, например: <i>рис 200г</i>. Попробуй фото чуть позже."
+
+# Предохранитель: при серии сбоев модели запросы не отправляются, работает локальный режим
+breaker = CircuitBreaker(AI_BREAKER_FAILURES, AI_BREAKER_OPEN_SECONDS, probe_timeout=AI_HARD_TIMEOUT)
+
+
+def ai_degraded() -> bool:
+    """Модель сейчас недоступна (цепь разомкнута) — использовать локальные замены, необязательное пропустить."""
+    return breaker.is_open()
+
+
+class AITimeoutError(TimeoutError):
+    """Модель не ответила за таймаут вызова или до крайнего срока апдейта."""
+
+
+def ai_timed_out() -> bool:
+    """Последний запрос к ИИ в этом апдейте упал по таймауту — для сообщения «ИИ отвечает слишком долго»."""
+    return _timed_out.get()
+
+
+def ai_failure_text(default: str) -> str:
+    """Текст для пользователя, когда ИИ не дал ответ: модель недоступна или таймаут — отдельные сообщения, иначе default."""
+    if ai_degraded():
+        return AI_UNAVAILABLE_MESSAGE
+    return AI_TIMEOUT_MESSAGE if ai_timed_out() else default
+
+
+def _hedge_delay(tier: str) -> float | None:
+    """
+    Через сколько секунд дублировать запрос: p95 задержки текущего хелпера на этом уровне (пока замеров меньше
+    HEDGE_MIN_SAMPLES — p95 уровня), но не меньше HEDGE_MIN_DELAY. None — не дублировать.
+    """
+    if not HEDGE_ENABLED or current_priority() != INTERACTIVE:
+        return None
+    latency = _helper_latency.get((current_helper(), tier))
+    if latency is None or len(latency) < HEDGE_MIN_SAMPLES:
+        latency = _tier_latency[tier]
+    if len(latency) < HEDGE_MIN_SAMPLES:
+        return None
+    return max(HEDGE_MIN_DELAY, percentile(sorted(latency), 0.95))
+
+
+async def _hedged_call(contents, tier: str, schema: dict | None, delay: float, call_timeout: float):
+    """
+    Идемпотентный запрос с хеджированием: если за delay ответа нет — второй такой же запрос,
+    берём первый успешный ответ, второй отменяем.
+    """
+    primary = asyncio.ensure_future(_scheduled_call(contents, tier, schema, call_timeout))
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+    timeout_stats["hedged"] += 1
+    backup = asyncio.ensure_future(_scheduled_call(contents, tier, schema, call_timeout))
+    pending = {primary, backup}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None:
+                    if t is backup:
+                        timeout_stats["hedge_won"] += 1
+                    return t.result()
+        return primary.result()  # оба упали — ошибка основного
+    finally:
+        for t in (primary, backup):
+            if not t.done():
+                t.cancel()
+
+
+def _call_limit(timeout: float | None) -> float:
+    """Сколько ждать ответ: timeout (по умолчанию AI_CALL_TIMEOUT), но не дольше крайнего срока апдейта. Срок вышел — AITimeoutError."""
+    limit = timeout or AI_CALL_TIMEOUT
+    left = time_left()
+    if left is not None:
+        if left <= 0:
+            timeout_stats["deadline_exceeded"] += 1
+            _timed_out.set(True)
+            e = AITimeoutError("update deadline exceeded")
+            record_error(e)
+            raise e
+        limit = min(limit, left)
+    return limit
+
+
+async def _generate(contents, tier: str = STRONG, schema: dict | None = None, timeout: float | None = None, hedge: bool = False):
+    """
+    Единая точка вызова модели. Нативный async API SDK — запрос не блокирует event loop,
+    пока один пользователь ждёт разбор фото, остальные апдейты и reminder_loop продолжают работать.
+    Если такой же промпт уже в полёте — ждём его результат вместо нового запроса.
+    Ждём не дольше timeout (по умолчанию AI_CALL_TIMEOUT) и крайнего срока апдейта — иначе AITimeoutError.
+    hedge=True — запрос идемпотентный, при долгом ответе можно отправить дубль.
+    """
+    if not breaker.allow():
+        e = CircuitOpenError("AI circuit is open")
+        record_error(e)
+        raise e
+    limit = _call_limit(timeout)
+    call_timeout = timeout or AI_CALL_TIMEOUT
+    # Класс приоритета входит в ключ: интерактивный запрос не должен ждать фоновый, стоящий в очереди планировщика
+    key = f"{current_priority()}:{tier}:{'json' if schema else 'text'}:{_prompt_key(contents)}"
+    singleflight_stats["calls"] += 1
+    task = _inflight.get(key)
+    if task is not None:
+        singleflight_stats["coalesced"] += 1
+    else:
+        delay = _hedge_delay(tier) if hedge else None
+        if delay is not None and delay < limit:
+            task = asyncio.ensure_future(_hedged_call(contents, tier, schema, delay, call_timeout))
+        else:
+            task = asyncio.ensure_future(_scheduled_call(contents, tier, schema, call_timeout))
+        _inflight[key] = task
+        task.add_done_callback(lambda t, k=key: _forget_inflight(k, t))
+    # shield: отмена одного ожидающего (пользователь ушёл или истёк его таймаут) не отменяет запрос для остальных
+    try:
+        response = await asyncio.wait_for(asyncio.shield(task), limit)
+    except asyncio.TimeoutError:
+        timeout_stats["timeouts"] += 1
+        _timed_out.set(True)
+        e = AITimeoutError(f"no response in {limit:.1f}s")
+        record_error(e)
+        raise e from None
+    _timed_out.set(False)
+    return response
+
+
+# Повторы при невалидном JSON: не больше JSON_MAX_RETRIES на вызов и в пределах общего бюджета
+json_retry_budget = RetryBudget(JSON_RETRY_RATIO, JSON_RETRY_CAPACITY)
+json_retry_stats = {"retries": 0, "exhausted": 0}
+
+
+async def _generate_json(contents, name: str, schema: dict, tier: str = STRONG, retries: int = JSON_MAX_RETRIES, hedge: bool = False):
+    """Запрос в режиме JSON по схеме и разбор общим парсером; невалидный ответ — повтор, пока есть бюджет."""
+    attempt = 0
+    while True:
+        response = await _generate(contents, tier, schema, timeout=CALL_TIMEOUTS.get(name), hedge=hedge)
+        try:
+            data = parse_json_response(response.text, schema)
+        except JSONParseError as e:
+            if attempt >= retries or not json_retry_budget.withdraw():
+                json_retry_stats["exhausted"] += 1
+                record_error(e)
+                raise
+            attempt += 1
+            json_retry_stats["retries"] += 1
+            logger.warning("%s: невалидный JSON от модели, повтор %s/%s", name, attempt, retries)
+            continue
+        json_retry_budget.deposit()
+        return data
+
+
+async def _generate_text(contents, tier: str = STRONG, name: str | None = None, hedge: bool = False) -> str:
+    response = await _generate(contents, tier, timeout=CALL_TIMEOUTS.get(name), hedge=hedge)
+    text = response.text.strip()
+    if not text:
+        e = ValueError("empty response")
+        record_error(e)
+        raise e
+    return text
+
+
+async def _generate_routed(name: str, call, escalate=None):
+    """
+    call(tier) — запрос к модели на уровне tier. Сначала FAST; STRONG — если FAST упал (в т.ч. кривой JSON,
+    пустой ответ) или escalate(результат) вернул причину (уточнение, низкая уверенность). Решения пишутся в лог.
+    """
+    started = time.monotonic()
+    reason = None
+    try:
+        result = await call(FAST)
+        reason = escalate(result) if escalate else None
+    except Exception as e:
+        reason = f"error: {type(e).__name__}"
+    if reason is None:
+        logger.info("route %s: fast ok (%.0f ms)", name, (time.monotonic() - started) * 1000)
+        return result
+    reason_key = reason.split(":", 1)[0]
+    router_stats["escalations"][reason_key] = router_stats["escalations"].get(reason_key, 0) + 1
+    logger.info("route %s: fast -> strong (%s) after %.0f ms", name, reason, (time.monotonic() - started) * 1000)
+    return await call(STRONG)
+
+
+# Схемы структурированного вывода (подмножество OpenAPI, которое принимает Gemini)
+# calories — INTEGER: meals.calories и quick_foods.calories целые, asyncpg не примет 312.5 для int4
+FOOD_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "name": {"type": "STRING"},
+        "calories": {"type": "INTEGER"},
+        "protein": {"type": "NUMBER"},
+        "fat": {"type": "NUMBER"},
+        "carbs": {"type": "NUMBER"},
+        "comment": {"type": "STRING"},
+        "confidence": {"type": "NUMBER"},
+        "needs_clarification": {"type": "BOOLEAN"},
+        "question": {"type": "STRING"},
+    },
+    "required": ["name", "calories", "protein", "fat", "carbs", "comment"],
+}
+
+GOALS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "bmr": {"type": "NUMBER"},
+        "tdee": {"type": "NUMBER"},
+        "calories": {"type": "NUMBER"},
+        "protein": {"type": "NUMBER"},
+        "fat": {"type": "NUMBER"},
+        "carbs": {"type": "NUMBER"},
+        "comment": {"type": "STRING"},
+        "nuances": {"type": "STRING"},
+    },
+    "required": ["bmr", "tdee", "calories", "protein", "fat", "carbs", "comment", "nuances"],
+}
+
+GOAL_MESSAGE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "benefit": {"type": "STRING"},
+        "motivation": {"type": "STRING"},
+    },
+    "required": ["benefit", "motivation"],
+}
+
+REMINDER_BATCH_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "id": {"type": "INTEGER"},
+            "text": {"type": "STRING"},
+        },
+        "required": ["id", "text"],
+    },
+}
+
 
 SYSTEM_PROMPT = """Ты нутрициолог-ассистент. Твоя задача — оценить КБЖУ еды.
 Всегда отвечай ТОЛЬКО валидным JSON без лишнего текста.
@@ -15,8 +427,10 @@ SYSTEM_PROMPT = """Ты нутрициолог-ассистент. Твоя за
   "protein": 00.0,
   "fat": 00.0,
   "carbs": 00.0,
-  "comment": "короткий комментарий"
+  "comment": "короткий комментарий",
+  "confidence": 0.0
 }
+confidence — насколько ты уверен в оценке, от 0 до 1: ниже 0.6, если блюдо неоднозначное или размер порции не ясен.
 Оценивай реалистично. Если на фото несколько блюд — суммируй всё."""
 
 PHOTO_SYSTEM_PROMPT = """Ты нутрициолог-ассистент. Твоя задача — по фото оценить КБЖУ еды и размер порции.
@@ -37,23 +451,75 @@ PHOTO_SYSTEM_PROMPT = """Ты нутрициолог-ассистент. Тво
 }
 Оценивай реалистично. Если на фото несколько блюд/компонентов — укажи каждый в name с граммами и суммируй КБЖУ."""
 
-def analyze_food_photo(image_bytes: bytes, mime_type: str = "image/jpeg", caption: str = None) -> dict | None:
+@instrument
+async def analyze_food_photo(image_bytes: bytes, mime_type: str = "image/jpeg", caption: str = None, prepare: bool = True) -> dict | None:
     try:
+        if prepare:
+            # Модели хватает ~1024px по длинной стороне: меньше байт на загрузку и дешевле vision-запрос
+            image_bytes, mime_type = await prepare_image(image_bytes, mime_type)
         prompt = PHOTO_SYSTEM_PROMPT
         if caption:
             prompt = f"{prompt}\n\nПользователь уточнил: {caption}\nОцени порцию и КБЖУ с учётом этого уточнения. В name по-прежнему укажи компоненты с граммами."
-        response = model.generate_content([
+        return _whole_calories(await _generate_json([
             prompt,
             {"mime_type": mime_type, "data": image_bytes}
-        ])
-        text = response.text.strip()
-        text = re.sub(r"```json|```", "", text).strip()
-        return json.loads(text)
+        ], "food_photo", FOOD_SCHEMA))
     except Exception as e:
         print(f"Gemini photo error: {e}")
         return None
 
-def calculate_goals_ai(weight, height, age, gender, lifestyle, training_count, training_type, training_duration, goal, pace="slow", target_weight=None) -> dict | None:
+# Версия промпта calculate_goals_ai. Поменял промпт или пост-коррекцию — увеличь: старые записи кэша целей удалятся при старте.
+GOALS_PROMPT_VERSION = 1
+
+# Цели по профилю: у многих пользователей одинаковый набор параметров (вес с точностью до 0.5 кг)
+goals_cache = TwoTierCache(
+    "goals",
+    GOALS_PROMPT_VERSION,
+    maxsize=GOALS_CACHE_SIZE,
+    ttl=GOALS_CACHE_TTL,
+    db_ttl_days=GOALS_CACHE_DB_DAYS,
+)
+
+
+def _round_half(value) -> float | None:
+    return round(float(value) * 2) / 2 if value is not None else None
+
+
+def _goals_profile(weight, height, age, gender, lifestyle, training_count, training_type, training_duration, goal, pace, target_weight) -> tuple:
+    """Канонический профиль: вес и желаемый вес до 0.5 кг, рост и возраст целые, без тренировок — без типа и длительности."""
+    training_count = str(training_count)
+    no_training = training_count == "0"
+    return (
+        _round_half(weight),
+        round(float(height)),
+        int(age),
+        gender,
+        lifestyle,
+        training_count,
+        None if no_training else training_type,
+        None if no_training else str(training_duration),
+        goal,
+        pace,
+        _round_half(target_weight) if target_weight else None,
+    )
+
+
+@instrument
+async def calculate_goals_ai(weight, height, age, gender, lifestyle, training_count, training_type, training_duration, goal, pace="slow", target_weight=None) -> dict | None:
+    """Цели КБЖУ по профилю. Считаются по каноническому профилю, результат (после поправки BMR) кэшируется."""
+    profile = _goals_profile(weight, height, age, gender, lifestyle, training_count, training_type, training_duration, goal, pace, target_weight)
+    key = json.dumps(profile, ensure_ascii=False)
+    cached = await goals_cache.get(key)
+    if cached is not None:
+        record_cache_hit("goals_cache")
+        return dict(cached)
+    data = await _calculate_goals_ai(*profile)
+    if data is not None:
+        await goals_cache.set(key, data)
+    return data
+
+
+async def _calculate_goals_ai(weight, height, age, gender, lifestyle, training_count, training_type, training_duration, goal, pace="slow", target_weight=None) -> dict | None:
     gender_ru = "мужчина" if gender == "male" else "женщина"
 
     lifestyle_labels = {
@@ -146,10 +612,7 @@ def calculate_goals_ai(weight, height, age, gender, lifestyle, training_count, t
 Все поля обязательны. bmr и tdee должны быть числами, не строками."""
 
     try:
-        response = model.generate_content(prompt)
-        text_resp = response.text.strip()
-        text_resp = re.sub(r"```json|```", "", text_resp).strip()
-        data = json.loads(text_resp)
+        data = await _generate_json(prompt, "goals", GOALS_SCHEMA)
         # Гарантированно правильный BMR по полу (модель иногда путает мужскую/женскую формулу)
         bmr_correct = _bmr_mifflin_st_jeor(weight, height, age, gender)
         old_bmr, old_tdee = data.get("bmr"), data.get("tdee")
@@ -174,31 +637,115 @@ def _bmr_mifflin_st_jeor(weight: float, height: float, age: int, gender: str) ->
     base = 10 * weight + 6.25 * height - 5 * age
     return base + 5 if gender == "male" else base - 161
 
-def analyze_food_text(text: str) -> dict | None:
+
+# Версия SYSTEM_PROMPT, FOOD_SCHEMA и ключа (normalize_food_text) для анализа текста. Поменял что-то из них — увеличь:
+# записи кэша старой версии станут промахами и удалятся при старте (food_text_cache.purge_stale()).
+FOOD_TEXT_PROMPT_VERSION = 4
+
+food_text_cache = TwoTierCache(
+    "food_text",
+    FOOD_TEXT_PROMPT_VERSION,
+    maxsize=FOOD_TEXT_CACHE_SIZE,
+    ttl=FOOD_TEXT_CACHE_TTL,
+    db_ttl_days=FOOD_TEXT_CACHE_DB_DAYS,
+)
+
+portion_cache = PortionCache(
+    FOOD_TEXT_PROMPT_VERSION,
+    maxsize=FOOD_TEXT_CACHE_SIZE,
+    ttl=FOOD_TEXT_CACHE_TTL,
+    db_ttl_days=FOOD_TEXT_CACHE_DB_DAYS,
+)
+
+
+def _whole_calories(data: dict) -> dict:
+    """Калории — целым числом, даже если модель вернула дробное или строку (колонки calories — INTEGER)."""
+    try:
+        data["calories"] = round(float(data["calories"]))
+    except (KeyError, TypeError, ValueError):
+        raise JSONParseError(f"bad calories: {data.get('calories')!r}") from None
+    return data
+
+
+def _is_simple_food_text(text: str) -> bool:
+    """Короткий текст из одного компонента — сначала на FAST."""
+    return len(text) <= ROUTER_FAST_MAX_TEXT_LEN and not is_composite(text)
+
+
+async def _food_text_call(prompt: str, tier: str) -> dict:
+    # На FAST без повторов: невалидный ответ сразу уходит на STRONG
+    data = await _generate_json(prompt, "food_text", FOOD_SCHEMA, tier, retries=0 if tier == FAST else JSON_MAX_RETRIES, hedge=True)
+    if not isinstance(data, dict):
+        raise JSONParseError("not a JSON object")
+    return _whole_calories(data)
+
+
+def _food_escalation_reason(data: dict) -> str | None:
+    if data.get("needs_clarification"):
+        return "needs_clarification"
+    try:
+        confidence = float(data.get("confidence", 1))
+    except (TypeError, ValueError):
+        return "bad_confidence"
+    if confidence < ROUTER_MIN_CONFIDENCE:
+        return f"low_confidence: {confidence:.2f}"
+    return None
+
+
+@instrument
+async def analyze_food_text(text: str) -> dict | None:
+    # Простое «<продукт> <граммы>г» — из локального справочника, без модели
+    local = food_catalog.lookup(text)
+    if local:
+        record_cache_hit("catalog")
+        return local
+    key = normalize_food_text(text)
+    cached = await food_text_cache.get(key) if key else None
+    if cached is not None:
+        record_cache_hit("food_text_cache")
+        return dict(cached)
+    # То же блюдо, другая порция — пересчёт по КБЖУ на грамм/штуку
+    scaled = await portion_cache.lookup(text)
+    if scaled:
+        record_cache_hit("portion_cache")
+        return scaled
     try:
         prompt = f"{SYSTEM_PROMPT}\n\nПользователь написал: {text}\nОцени КБЖУ для этого."
-        response = model.generate_content(prompt)
-        result = response.text.strip()
-        result = re.sub(r"```json|```", "", result).strip()
-        return json.loads(result)
+        if _is_simple_food_text(text):
+            data = await _generate_routed("food_text", lambda tier: _food_text_call(prompt, tier), _food_escalation_reason)
+        else:
+            data = await _food_text_call(prompt, STRONG)
     except Exception as e:
         print(f"Gemini text error: {e}")
+        if isinstance(e, (CircuitOpenError, AITimeoutError)) or ai_degraded():
+            # Локальный режим: справочник со стандартной порцией, если граммы не указаны
+            return food_catalog.lookup(text, default_portion=True)
         return None
+    # Вопрос-уточнение не кэшируем — это не ответ по КБЖУ
+    if key and isinstance(data, dict) and not data.get("needs_clarification"):
+        await food_text_cache.set(key, data)
+        await portion_cache.remember(text, data)
+    return data
 
 
-def get_daily_tip(totals: dict, user: dict) -> str | None:
-    goal = user.get("goal", "")
-    cal_goal = user.get("calories_goal", 0)
-    prot_goal = user.get("protein_goal", 0)
-    carb_goal = user.get("carbs_goal", 0)
+# Кэш советов после приёма пищи: ключ — цель и проценты КБЖУ, округлённые до TIP_BUCKET_PCT.
+# На каждый ключ копится до TIP_POOL_SIZE разных советов, отдаётся случайный — чтобы не повторять одно и то же.
+tip_cache = LRUCache(maxsize=TIP_CACHE_SIZE, ttl=TIP_CACHE_TTL)
+tip_stats = {"hits": 0, "misses": 0, "refills": 0, "duplicates": 0}
+# Корзины, для которых сейчас идёт запрос совета (не больше одного на корзину), и число повторов подряд:
+# модель, раз за разом возвращающая известный совет, не должна тратить запрос на каждое подтверждение приёма
+_tip_refilling: set = set()
+_tip_duplicates = LRUCache(maxsize=TIP_CACHE_SIZE, ttl=TIP_CACHE_TTL)
 
-    if not cal_goal:
-        return None
+# Выше этого процента все значения попадают в одну корзину («сильно больше цели»)
+TIP_PCT_CAP = 150
 
-    cal_pct = totals["calories"] / cal_goal * 100
-    prot_pct = totals["protein"] / prot_goal * 100 if prot_goal else 0
-    carb_pct = totals["carbs"] / carb_goal * 100 if carb_goal else 0
 
+def _tip_bucket(pct: float) -> int:
+    return min(TIP_PCT_CAP, int(pct // TIP_BUCKET_PCT) * TIP_BUCKET_PCT)
+
+
+def _tip_prompt(goal: str, cal_b: int, prot_b: int, carb_b: int) -> str:
     goal_labels = {
         "loss": "похудение",
         "gain": "набор массы",
@@ -207,13 +754,16 @@ def get_daily_tip(totals: dict, user: dict) -> str | None:
         "cutting": "сушка",
     }
 
-    prompt = f"""Ты нутрициолог-ассистент. Дай короткий практический совет (1 предложение) на основе данных.
+    def pct_label(b: int) -> str:
+        return f"{TIP_PCT_CAP}% и больше" if b >= TIP_PCT_CAP else f"{b}–{b + TIP_BUCKET_PCT}%"
+
+    return f"""Ты нутрициолог-ассистент. Дай короткий практический совет (1 предложение) на основе данных.
 
 Цель пользователя: {goal_labels.get(goal, goal)}
-Прогресс за сегодня:
-- Калории: {totals['calories']}/{cal_goal} ккал ({cal_pct:.0f}%)
-- Белки: {totals['protein']:.0f}/{prot_goal} г ({prot_pct:.0f}%)
-- Углеводы: {totals['carbs']:.0f}/{carb_goal} г ({carb_pct:.0f}%)
+Прогресс за сегодня (доля от дневной цели):
+- Калории: {pct_label(cal_b)}
+- Белки: {pct_label(prot_b)}
+- Углеводы: {pct_label(carb_b)}
 
 Правила:
 - Если превышение калорий > 90% — предупреди
@@ -222,16 +772,100 @@ def get_daily_tip(totals: dict, user: dict) -> str | None:
 - Для набора — следи за калориями и белком
 - Для рекомпозиции — калории на уровне цели, белок в приоритете
 - Если всё хорошо — скажи коротко что всё идёт по плану
+- Не называй точные граммы и калории — только проценты или «больше/меньше»
 - Только 1 предложение, без приветствий"""
 
+
+def _template_tip(goal: str, cal_b: int, prot_b: int, carb_b: int) -> str:
+    """Совет без модели (локальный режим) — по тем же корзинам процентов."""
+    if cal_b >= 100:
+        return "Калории на сегодня уже набраны — дальше лучше лёгкие продукты: овощи, кефир, нежирный творог."
+    if prot_b < 50:
+        return "Белка пока меньше половины нормы — добавь в следующий приём мясо, рыбу, яйца или творог."
+    if goal == "cutting" and carb_b >= 80:
+        return "Углеводы на сушке почти набраны — в следующий приём сделай упор на белок и овощи."
+    if goal == "gain" and cal_b < 50:
+        return "Для набора калорий пока мало — не пропускай следующий приём и добавь крупу или орехи."
+    return "Всё идёт по плану — продолжай в том же духе."
+
+
+async def _generate_tip(key: tuple) -> str | None:
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        return await _generate_routed("daily_tip", lambda tier: _generate_text(_tip_prompt(*key), tier, "daily_tip", hedge=True))
     except Exception as e:
         print(f"Gemini tip error: {e}")
         return None
 
 
+def _add_tip(key: tuple, tip: str | None):
+    """Новый совет — в пул корзины; повтор уже известного — в счётчик повторов подряд."""
+    if not tip:
+        return
+    pool = tip_cache.get(key) or []
+    if tip in pool:
+        tip_stats["duplicates"] += 1
+        _tip_duplicates.set(key, _tip_duplicates.get(key, 0) + 1)
+    elif len(pool) < TIP_POOL_SIZE:
+        tip_cache.set(key, pool + [tip])
+        _tip_duplicates.pop(key)
+
+
+def _tip_pool_full(key: tuple, pool: list) -> bool:
+    return len(pool) >= TIP_POOL_SIZE or _tip_duplicates.get(key, 0) >= TIP_REFILL_MAX_DUPLICATES
+
+
+async def _fill_tip_pool(key: tuple) -> str | None:
+    try:
+        tip = await _generate_tip(key)
+        _add_tip(key, tip)
+        return tip
+    finally:
+        _tip_refilling.discard(key)
+
+
+async def _refill_tip_pool(key: tuple):
+    set_priority(BACKGROUND)
+    await _fill_tip_pool(key)
+
+
+@instrument
+async def get_daily_tip(totals: dict, user: dict) -> str | None:
+    goal = user.get("goal", "")
+    cal_goal = user.get("calories_goal", 0)
+    prot_goal = user.get("protein_goal", 0)
+    carb_goal = user.get("carbs_goal", 0)
+
+    if not cal_goal:
+        return None
+
+    cal_pct = totals["calories"] / cal_goal * 100
+    prot_pct = totals["protein"] / prot_goal * 100 if prot_goal else 0
+    carb_pct = totals["carbs"] / carb_goal * 100 if carb_goal else 0
+    key = (goal, _tip_bucket(cal_pct), _tip_bucket(prot_pct), _tip_bucket(carb_pct))
+
+    pool = tip_cache.get(key)
+    if ai_degraded():
+        return random.choice(pool) if pool else _template_tip(*key)
+    if pool:
+        tip_stats["hits"] += 1
+        record_cache_hit("tip_pool")
+        if not _tip_pool_full(key, pool) and key not in _tip_refilling:
+            # Пополняем пул в фоне — пользователь получает готовый совет сразу
+            _tip_refilling.add(key)
+            tip_stats["refills"] += 1
+            spawn(_refill_tip_pool(key), name="tip_refill", timeout=AFTER_MEAL_TASK_TIMEOUT)
+        return random.choice(pool)
+    tip_stats["misses"] += 1
+    if key in _tip_refilling:
+        # Совет для корзины уже запрашивается: тот же промпт склеится в один запрос (single-flight),
+        # а в пул его положит первый вызов — повтор не засчитывается как дубликат
+        tip = await _generate_tip(key)
+    else:
+        _tip_refilling.add(key)
+        tip = await _fill_tip_pool(key)
+    return tip or (_template_tip(*key) if ai_degraded() else None)
+
+
 MEAL_TYPE_LABELS = {
     "завтрак": "завтрак",
     "обед": "обед",
@@ -240,8 +874,8 @@ MEAL_TYPE_LABELS = {
 }
 
 
-def get_meal_suggestion(totals: dict, user: dict, meal_type: str, eaten_today: list[str] | None = None) -> str | None:
-    """Совет что съесть на выбранный приём пищи с учётом цели и текущих КБЖУ за день."""
+def _meal_suggestion_prompt(totals: dict, user: dict, meal_type: str, eaten_today: list[str] | None = None) -> str | None:
+    """Промпт совета на приём пищи; None — в профиле нет целей."""
     cal_goal = user.get("calories_goal", 0)
     prot_goal = user.get("protein_goal", 0)
     fat_goal = user.get("fat_goal", 0)
@@ -287,19 +921,120 @@ def get_meal_suggestion(totals: dict, user: dict, meal_type: str, eaten_today: l
 [1–2 предложения]
 
 Без общих фраз, только по цифрам. Не используй markdown — только переносы строк и цифры. Пиши на русском."""
+    return prompt
+
 
+def _clean_suggestion(text: str) -> str:
+    # Убрать markdown-звёздочки, чтобы в Telegram не светились ** и *
+    return text.strip().replace("**", "").replace("* ", "• ").replace("*", "•")
+
+
+_TEMPLATE_MEALS = {
+    "завтрак": "омлет из 2–3 яиц с овощами и тост или овсянка с творогом и ягодами",
+    "обед": "крупа (гречка или рис, ~150 г готовой) с курицей или рыбой (~150 г) и салат",
+    "ужин": "рыба или курица (~150 г) с тушёными овощами",
+    "перекус": "творог (~150 г) с фруктом или кефир с горстью орехов",
+}
+
+
+def _template_meal_suggestion(totals: dict, user: dict, meal_type: str) -> str | None:
+    """Совет на приём пищи без модели (локальный режим): типовое блюдо и недобор по цифрам."""
+    cal_goal = user.get("calories_goal", 0)
+    if not cal_goal:
+        return None
+    cal_rem = cal_goal - totals["calories"]
+    prot_rem = (user.get("protein_goal", 0) or 0) - totals["protein"]
+    note = "ИИ сейчас недоступен — это типовой вариант, подробный совет будет чуть позже."
+    if cal_rem <= 0:
+        return ("1) Блюдо: лёгкий вариант — овощной салат, кефир или нежирный творог.\n"
+                f"2) Что добрать: калории на сегодня уже набраны (+{-cal_rem:.0f} ккал), лучше ограничить жирное и сладкое.\n{note}")
+    need = f"~{cal_rem:.0f} ккал" + (f", белок {prot_rem:.0f} г" if prot_rem >= 5 else "")
+    return (f"1) Блюдо: {_TEMPLATE_MEALS.get(meal_type, _TEMPLATE_MEALS['перекус'])}.\n"
+            f"2) Что добрать: до цели ещё {need}.\n{note}")
+
+
+@instrument
+async def get_meal_suggestion(totals: dict, user: dict, meal_type: str, eaten_today: list[str] | None = None) -> str | None:
+    """Совет что съесть на выбранный приём пищи с учётом цели и текущих КБЖУ за день. ИИ недоступен — шаблон."""
+    prompt = _meal_suggestion_prompt(totals, user, meal_type, eaten_today)
+    if not prompt:
+        return None
+    if ai_degraded():
+        return _template_meal_suggestion(totals, user, meal_type)
     try:
-        response = model.generate_content(prompt)
-        text = response.text.strip()
-        # Убрать markdown-звёздочки, чтобы в Telegram не светились ** и *
-        text = text.replace("**", "").replace("* ", "• ").replace("*", "•")
-        return text
+        response = await _generate(prompt, timeout=CALL_TIMEOUTS.get("meal_suggestion"))
+        return _clean_suggestion(response.text)
     except Exception as e:
         print(f"Gemini meal suggestion error: {e}")
-        return None
+        return _template_meal_suggestion(totals, user, meal_type) if isinstance(e, CircuitOpenError) or ai_degraded() else None
 
 
-def get_reminder_suggestion(
+async def _stream_to_queue(prompt: str, queue: asyncio.Queue, call_timeout: float):
+    """
+    Читает поток ответа модели внутри слота планировщика и кладёт накопленный текст в очередь.
+    Слот освобождается, как только модель договорила, — правки сообщения в Telegram (и их RetryAfter) его не держат.
+    """
+    text = ""
+    async with scheduler.slot():
+        started = time.monotonic()
+        try:
+            response = await model.generate_content_async(prompt, stream=True, request_options={"timeout": AI_HARD_TIMEOUT})
+            async for chunk in response:
+                try:
+                    text += chunk.text
+                except ValueError:  # кусок без текста (например, только finish_reason)
+                    continue
+                queue.put_nowait(text)
+        except Exception as e:
+            breaker.record_error(e)
+            record_error(e)
+            raise
+        elapsed = time.monotonic() - started
+    _record_call_outcome(elapsed, call_timeout)
+    # usage_metadata стримингового ответа заполнен после последнего куска
+    record_usage(STRONG, response)
+
+
+@instrument
+async def get_meal_suggestion_stream(totals: dict, user: dict, meal_type: str, eaten_today: list[str] | None = None):
+    """
+    То же, что get_meal_suggestion, но по мере генерации: отдаёт накопленный текст после каждого куска ответа модели.
+    Нет целей в профиле — ничего не отдаёт. Ошибки модели пробрасываются; цепь разомкнута — CircuitOpenError.
+    Весь поток (а не только первый ответ) ограничен таймаутом вызова и крайним сроком апдейта — иначе AITimeoutError.
+    """
+    prompt = _meal_suggestion_prompt(totals, user, meal_type, eaten_today)
+    if not prompt:
+        return
+    if not breaker.allow():
+        e = CircuitOpenError("AI circuit is open")
+        record_error(e)
+        raise e
+    call_timeout = CALL_TIMEOUTS.get("meal_suggestion") or AI_CALL_TIMEOUT
+    limit = _call_limit(call_timeout)
+    queue: asyncio.Queue = asyncio.Queue()
+    producer = asyncio.ensure_future(asyncio.wait_for(_stream_to_queue(prompt, queue, call_timeout), limit))
+    producer.add_done_callback(lambda _: queue.put_nowait(None))
+    try:
+        while (text := await queue.get()) is not None:
+            yield _clean_suggestion(text)
+        try:
+            producer.result()  # ошибка модели — вызывающему
+        except asyncio.TimeoutError:
+            timeout_stats["timeouts"] += 1
+            breaker.record_failure()
+            _timed_out.set(True)
+            e = AITimeoutError(f"stream not finished in {limit:.1f}s")
+            record_error(e)
+            raise e from None
+        _timed_out.set(False)
+    finally:
+        if not producer.done():
+            producer.cancel()  # потребитель ушёл раньше — поток больше не нужен
+        elif not producer.cancelled():
+            producer.exception()  # уже проброшена выше; иначе asyncio пишет «exception was never retrieved»
+
+
+def _reminder_context(
     totals: dict,
     user: dict,
     eaten_today: list[str],
@@ -307,9 +1042,7 @@ def get_reminder_suggestion(
     last_meal_minutes_ago: int | None = None,
     last_meal_name: str | None = None,
 ) -> str | None:
-    """
-    Короткое напоминание «пора поесть» с учётом недобора, всего рациона за день и времени последнего приёма.
-    """
+    """Данные пользователя для промпта напоминания или None, если недобора почти нет."""
     cal_goal = user.get("calories_goal", 0) or 1
     prot_goal = user.get("protein_goal", 0) or 1
     carb_goal = user.get("carbs_goal", 0) or 1
@@ -340,15 +1073,36 @@ def get_reminder_suggestion(
     if last_meal_minutes_ago is not None and last_meal_name:
         last_meal_block = f" Последний приём был {last_meal_minutes_ago} мин назад («{last_meal_name}») — можно упомянуть в одном предложении, что прошло уже достаточно времени."
 
-    prompt = f"""Ты нутрициолог. Напоминание пользователю «пора поесть» с учётом недобора и всего рациона за день.
-
-Цель пользователя: {goal}.
+    return f"""Цель пользователя: {goal}.
 Цели на день: {cal_goal} ккал, белки {prot_goal} г, углеводы {carb_goal} г.
 Съедено за сегодня: {totals['calories']} ккал, Б {totals['protein']:.0f} г, У {totals['carbs']:.0f} г.
 Недобор: калории {cal_rem:.0f}, белок {prot_rem:.0f} г, углеводы {carb_rem:.0f} г.{eaten_block}{last_meal_block}
 
-Время: сейчас {hour}:00. {time_context}
-Обязательно предлагай что-то другое по составу и продуктам, не повторяй уже съеденное сегодня.
+Время: сейчас {hour}:00. {time_context}"""
+
+
+def _template_reminder(totals: dict, user: dict, eaten_today: list[str], hour: int, **_) -> str | None:
+    """Напоминание без модели (локальный режим): недобор по цифрам и типовой вариант по времени суток."""
+    cal_rem = (user.get("calories_goal", 0) or 1) - totals["calories"]
+    prot_rem = (user.get("protein_goal", 0) or 1) - totals["protein"]
+    carb_rem = (user.get("carbs_goal", 0) or 1) - totals["carbs"]
+    if cal_rem < 30 and prot_rem < 5 and carb_rem < 10:
+        return None
+    if hour < 11:
+        idea = "омлет с овощами или творог с ягодами"
+    elif hour < 18:
+        idea = "крупа с курицей или рыбой и салат"
+    else:
+        idea = "творог, кефир или омлет — что-то лёгкое"
+    parts = []
+    if cal_rem >= 30:
+        parts.append(f"~{cal_rem:.0f} ккал")
+    if prot_rem >= 5:
+        parts.append(f"{prot_rem:.0f} г белка")
+    return f"Пора поесть: до цели ещё {' и '.join(parts) or 'немного'}. Например, {idea}."
+
+
+REMINDER_RULES = """Обязательно предлагай что-то другое по составу и продуктам, не повторяй уже съеденное сегодня.
 
 Ответь коротко (2–4 предложения), в формате:
 1) «Пора перекусить» / «Пора поесть» + что именно съесть (конкретно: порция и продукт, например «200 г творога + банан» или «омлет из 2 яиц + тост»).
@@ -356,75 +1110,147 @@ def get_reminder_suggestion(
 
 Без приветствий и лишнего. Только суть. На русском."""
 
+
+@instrument
+async def get_reminder_suggestion(
+    totals: dict,
+    user: dict,
+    eaten_today: list[str],
+    hour: int,
+    last_meal_minutes_ago: int | None = None,
+    last_meal_name: str | None = None,
+) -> str | None:
+    """
+    Короткое напоминание «пора поесть» с учётом недобора, всего рациона за день и времени последнего приёма.
+    """
+    context = _reminder_context(totals, user, eaten_today, hour, last_meal_minutes_ago, last_meal_name)
+    if context is None:
+        return None
+
+    prompt = f"""Ты нутрициолог. Напоминание пользователю «пора поесть» с учётом недобора и всего рациона за день.
+
+{context}
+{REMINDER_RULES}"""
+
     try:
-        response = model.generate_content(prompt)
+        response = await _generate(prompt)
         return response.text.strip()
     except Exception as e:
         print(f"Gemini reminder suggestion error: {e}")
         return None
 
 
-def get_goal_reached_message(goal_type: str, user: dict, totals: dict) -> dict | None:
+async def _reminder_batch(items: list[dict], contexts: list[str]) -> list[str | None]:
+    """Один запрос на пачку пользователей; кого не удалось разобрать из ответа — отдельным запросом."""
+    blocks = "\n\n".join(f"### Пользователь {i}\n{ctx}" for i, ctx in enumerate(contexts))
+    prompt = f"""Ты нутрициолог. Составь напоминания «пора поесть» для {len(contexts)} разных пользователей — для каждого отдельно, по его данным.
+
+{blocks}
+
+Правила для каждого напоминания:
+{REMINDER_RULES}
+
+Ответь ТОЛЬКО валидным JSON-массивом без markdown, по одному объекту на пользователя:
+[{{"id": 0, "text": "текст напоминания"}}, ...]"""
+
+    texts: dict[int, str] = {}
+    try:
+        for entry in await _generate_json(prompt, "reminder_batch", REMINDER_BATCH_SCHEMA):
+            try:
+                idx, text = int(entry["id"]), str(entry["text"]).strip()
+            except (KeyError, TypeError, ValueError):
+                continue
+            if 0 <= idx < len(contexts) and text:
+                texts[idx] = text
+    except Exception as e:
+        print(f"Gemini reminder batch error: {e}")
+
+    missing = [i for i in range(len(contexts)) if i not in texts]
+    if missing and ai_degraded():
+        texts.update((i, _template_reminder(**items[i])) for i in missing)
+    elif missing:
+        fallback = await asyncio.gather(*(get_reminder_suggestion(**items[i]) for i in missing))
+        texts.update(zip(missing, fallback))
+    return [texts.get(i) for i in range(len(contexts))]
+
+
+@instrument
+async def get_reminder_suggestions_batch(items: list[dict], batch_size: int = REMINDER_BATCH_SIZE) -> list[str | None]:
+    """
+    То же, что get_reminder_suggestion, но для многих пользователей: по batch_size человек в одном запросе.
+    items — словари с аргументами get_reminder_suggestion. Ответ — список в том же порядке (None — напоминание не нужно/не вышло).
+    """
+    results: list[str | None] = [None] * len(items)
+    pending = []  # (индекс в items, контекст)
+    for i, item in enumerate(items):
+        ctx = _reminder_context(**item)
+        if ctx is not None:
+            pending.append((i, ctx))
+    chunks = [pending[k:k + max(1, batch_size)] for k in range(0, len(pending), max(1, batch_size))]
+    chunk_results = await asyncio.gather(*(
+        _reminder_batch([items[i] for i, _ in chunk], [ctx for _, ctx in chunk]) for chunk in chunks
+    ))
+    for chunk, texts in zip(chunks, chunk_results):
+        for (i, _), text in zip(chunk, texts):
+            results[i] = text
+    return results
+
+
+USER_GOAL_LABELS = {"loss": "похудение", "gain": "набор", "maintain": "поддержание", "recomp": "рекомпозиция", "cutting": "сушка"}
+
+
+@instrument
+async def get_goal_reached_message(goal_type: str, user_goal: str = "") -> dict | None:
     """
     Возвращает блоки 💪 Польза и 🔥 Мотивация для сообщения о достижении цели.
-    Факт (🎯) формируется в вызывающем коде с точными цифрами.
-    Возвращает {"benefit": "...", "motivation": "..."} или None.
+    Без цифр пользователя — тексты заранее копятся в пуле (message_pool), факт (🎯) с точными цифрами
+    формируется в вызывающем коде. Возвращает {"benefit": "...", "motivation": "..."} или None.
     """
-    cal_g = user.get("calories_goal") or 0
-    prot_g = user.get("protein_goal") or 0
-    fat_g = user.get("fat_goal") or 0
-    carb_g = user.get("carbs_goal") or 0
-    if goal_type == "protein" and not prot_g:
-        return None
-    if goal_type == "calories" and not cal_g:
-        return None
-    if goal_type == "full" and not (cal_g and prot_g):
-        return None
-
     prompts = {
         "protein": """Пользователь закрыл дневную норму белка (факт с цифрами бот подставит сам).
 
-Ответь СТРОГО в два коротких абзаца, по одному предложению в каждом — без эмодзи и без заголовков:
-1) Польза: чем конкретно полезен достаточный белок для организма (восстановление, мышцы, сытость) — одно предложение.
-2) Мотивация: одна короткая фраза в духе «Продолжай в том же духе — стабильность даёт результат».
+Ответь JSON с двумя полями, по одному предложению в каждом — без эмодзи и без заголовков:
+1) benefit — чем конкретно полезен достаточный белок для организма (восстановление, мышцы, сытость) — одно предложение.
+2) motivation — одна короткая фраза в духе «Продолжай в том же духе — стабильность даёт результат».
 
-Только эти два абзаца, на русском.""",
+На русском.""",
         "calories": """Пользователь достиг дневной цели по калориям (факт с цифрами бот подставит сам).
 
-Ответь СТРОГО в два коротких абзаца, по одному предложению в каждом — без эмодзи и без заголовков:
-1) Польза: зачем держать калории в норме — одно предложение.
-2) Мотивация: одна короткая фраза в духе «Продолжай в том же духе — стабильность даёт результат».
+Ответь JSON с двумя полями, по одному предложению в каждом — без эмодзи и без заголовков:
+1) benefit — зачем держать калории в норме — одно предложение.
+2) motivation — одна короткая фраза в духе «Продолжай в том же духе — стабильность даёт результат».
 
-Только эти два абзаца, на русском.""",
+На русском.""",
         "full": """Пользователь выполнил все дневные цели по питанию (калории, белок, жиры, углеводы). Факт с цифрами бот подставит сам.
 
-Ответь СТРОГО в два коротких абзаца, по одному предложению в каждом — без эмодзи и без заголовков:
-1) Польза: чем хорош сбалансированный день по КБЖУ — одно предложение.
-2) Мотивация: одна короткая фраза в духе «Продолжай в том же духе — стабильность даёт результат».
+Ответь JSON с двумя полями, по одному предложению в каждом — без эмодзи и без заголовков:
+1) benefit — чем хорош сбалансированный день по КБЖУ — одно предложение.
+2) motivation — одна короткая фраза в духе «Продолжай в том же духе — стабильность даёт результат».
 
-Только эти два абзаца, на русском.""",
+На русском.""",
     }
     prompt = prompts.get(goal_type)
     if not prompt:
         return None
+    if user_goal in USER_GOAL_LABELS:
+        prompt += f"\nЦель пользователя в приложении: {USER_GOAL_LABELS[user_goal]} — пользу опиши с учётом этой цели."
     try:
-        response = model.generate_content(prompt)
-        text = response.text.strip()
-        lines = [s.strip() for s in text.split("\n") if s.strip()]
-        benefit = lines[0] if lines else ""
-        motivation = lines[1] if len(lines) > 1 else ""
+        data = await _generate_json(prompt, "goal_reached", GOAL_MESSAGE_SCHEMA)
+        benefit = str(data.get("benefit") or "").strip()
         if not benefit:
             return None
-        return {"benefit": benefit, "motivation": motivation}
+        return {"benefit": benefit, "motivation": str(data.get("motivation") or "").strip()}
     except Exception as e:
         print(f"Gemini goal_reached error: {e}")
         return None
 
 
-def get_5day_streak_message(streak_type: str, user: dict, days_summary: list) -> str | None:
+@instrument
+async def get_5day_streak_message(streak_type: str, user_goal: str = "") -> str | None:
     """
     Мягкий комментарий при 5 днях подряд: недобор белка или перебор калорий/жиров.
     Тон: забота, а не контроль. Не обвинять («ты всё делаешь неправильно»), а заметить и поддержать.
+    Без цифр пользователя — тексты копятся в пуле (message_pool), средние за 5 дней подставляет вызывающий код.
     """
     type_labels = {
         "protein_shortfall": "недобор белка 5 дней подряд",
@@ -432,30 +1258,29 @@ def get_5day_streak_message(streak_type: str, user: dict, days_summary: list) ->
         "cal_over": "перебор калорий 5 дней подряд",
     }
     label = type_labels.get(streak_type)
-    if not label or not days_summary:
+    if not label:
         return None
-    goal_ru = {"loss": "похудение", "gain": "набор", "maintain": "поддержание", "recomp": "рекомпозиция", "cutting": "сушка"}.get(user.get("goal", ""), "питание")
+    goal_ru = USER_GOAL_LABELS.get(user_goal, "питание")
 
     prompt = f"""Ты нутрициолог-ассистент. У пользователя {label}. Цель в приложении: {goal_ru}.
 
-Данные по дням (сумма за день / цель):
-{chr(10).join(f"- {d.get('date', '')}: калории {d.get('totals', {}).get('calories', 0)}/{d.get('goals', {}).get('calories_goal', 0)}, белок {d.get('totals', {}).get('protein', 0):.0f}/{d.get('goals', {}).get('protein_goal', 0)}, жиры {d.get('totals', {}).get('fat', 0):.0f}/{d.get('goals', {}).get('fat_goal', 0)}" for d in days_summary)}
-
 ВАЖНО — тон заботы, не контроля:
 - Напиши в духе: «Я заметил(а), что 5 дней подряд есть недобор белка / перебор калорий. Это может замедлить прогресс.» (подставь нужное по контексту).
 - Никогда не писать «ты всё делаешь неправильно», «ты не справляешься», обвинения или нравоучения.
 - Одно короткое предложение с заботой: почему это важно (без давления). Можно добавить один мягкий совет (например: «Попробуй добавить один белковый перекус» или «Можно чуть уменьшить порцию вечером») — по желанию, не обязательно.
+- Не называй конкретные цифры — средние за 5 дней бот добавит сам.
 - Итог: 2–3 коротких предложения, ощущение поддержки, не контроля. На русском."""
 
     try:
-        response = model.generate_content(prompt)
+        response = await _generate(prompt)
         return response.text.strip()
     except Exception as e:
         print(f"Gemini 5day_streak error: {e}")
         return None
 
 
-def get_week_status_recommendation(
+@instrument
+async def get_week_status_recommendation(
     status_key: str,
     goal: str,
     avg_deficit: float,
@@ -484,14 +1309,14 @@ def get_week_status_recommendation(
 Только текст рекомендации, без заголовков и эмодзи. На русском."""
 
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        return await _generate_routed("week_status", lambda tier: _generate_text(prompt, tier, "week_status"))
     except Exception as e:
         print(f"Gemini week_status recommendation error: {e}")
         return None
 
 
-def answer_user_question(context: str, user_message: str) -> str | None:
+@instrument
+async def answer_user_question(context: str, user_message: str) -> str | None:
     """Ответ ИИ на вопрос пользователя в контексте сообщения бота (напоминание, совет и т.д.)."""
     if not context and not user_message:
         return None
@@ -506,7 +1331,7 @@ def answer_user_question(context: str, user_message: str) -> str | None:
 Дай краткий ответ по существу (1–4 предложения), без приветствий. Если вопрос не по питанию — ответь коротко и дружелюбно."""
 
     try:
-        response = model.generate_content(prompt)
+        response = await _generate(prompt)
         return response.text.strip()
     except Exception as e:
         print(f"Gemini answer_user_question error: {e}")
@@ -1,12 +1,16 @@
+import asyncio
 import logging
+import time
 from aiogram import Router, F
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from aiogram.types import Message, CallbackQuery, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import CommandStart, Command, BaseFilter
 from aiogram.fsm.context import FSMContext
 from database import get_user, get_meals_today, delete_last_meal, delete_meal_by_id, get_daily_totals
 from keyboards import main_keyboard, stats_keyboard, meal_choice_keyboard
 from calculator import format_daily_summary
-from gemini_helper import get_meal_suggestion, answer_user_question
+from config import STREAM_EDIT_INTERVAL
+from gemini_helper import get_meal_suggestion, get_meal_suggestion_stream, answer_user_question, ai_degraded, ai_timed_out, ai_failure_text
 from handlers.profile import ProfileState
 from handlers.food import FoodState
 
@@ -98,7 +102,7 @@ async def help_cmd(message: Message):
 async def reply_to_bot_question(message: Message):
     """Ответ пользователя на сообщение бота (напоминание, совет и т.д.) — отправляем в ИИ с контекстом."""
     context = message.reply_to_message.text or message.reply_to_message.caption or ""
-    reply = answer_user_question(context, message.text or "")
+    reply = await answer_user_question(context, message.text or "")
     if reply:
         await message.answer(reply)
     else:
@@ -191,6 +195,42 @@ async def what_to_eat_menu(message: Message):
     )
 
 
+async def _edit_progress(message: Message, text: str) -> float:
+    """Промежуточная правка сообщения. Возвращает, сколько секунд Telegram просит подождать (0 — всё ок)."""
+    try:
+        await message.edit_text(text, parse_mode="HTML")
+    except TelegramRetryAfter as e:
+        return float(e.retry_after)
+    except TelegramBadRequest as e:
+        # «message is not modified» и недописанная разметка в середине ответа — просто ждём следующий кусок
+        logger.debug("Промежуточная правка пропущена: %s", e)
+    return 0.0
+
+
+async def _stream_suggestion(message: Message, header: str, totals: dict, user: dict, meal_type: str, eaten_names: list[str]) -> str | None:
+    """
+    Совет по мере генерации: сообщение правится не чаще раза в STREAM_EDIT_INTERVAL (и реже, если Telegram просит RetryAfter).
+    Возвращает полный текст ("" — нет целей в профиле) или None, если поток не удался — тогда зовём обычный запрос.
+    """
+    text = ""
+    next_edit = 0.0  # первый кусок показываем сразу
+    try:
+        async for text in get_meal_suggestion_stream(totals, user, meal_type, eaten_today=eaten_names):
+            if time.monotonic() < next_edit:
+                continue
+            pause = await _edit_progress(message, header + text + " ▌")
+            next_edit = time.monotonic() + max(STREAM_EDIT_INTERVAL, pause)
+    except Exception as e:
+        logger.warning("Потоковый совет не удался, обычный запрос: %s", e)
+        return None
+    if text:
+        # Перед финальной правкой выдержать паузу, чтобы не словить RetryAfter на последнем шаге
+        delay = next_edit - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(min(delay, STREAM_EDIT_INTERVAL))
+    return text
+
+
 @router.callback_query(F.data.startswith("meal_"))
 async def meal_suggestion_callback(callback: CallbackQuery):
     meal_map = {
@@ -209,14 +249,20 @@ async def meal_suggestion_callback(callback: CallbackQuery):
     totals = await get_daily_totals(user_id)
     meals_today = await get_meals_today(user_id)
     eaten_names = [m[1] for m in meals_today] if meals_today else []
-    suggestion = get_meal_suggestion(totals, user, meal_type, eaten_today=eaten_names)
+    header = f"💡 <b>Что съесть на {meal_type}:</b>\n\n"
+    # ИИ недоступен — без потока: get_meal_suggestion сразу отдаёт шаблонный совет
+    suggestion = None if ai_degraded() else await _stream_suggestion(callback.message, header, totals, user, meal_type, eaten_names)
+    # Поток не уложился в срок — второй полный запрос не успеет; упал иначе (в т.ч. цепь разомкнулась) — обычный запрос или шаблон
+    if suggestion is None and not ai_timed_out():
+        suggestion = await get_meal_suggestion(totals, user, meal_type, eaten_today=eaten_names)
 
     if not suggestion:
         await callback.message.edit_text(
-            "Не удалось сформировать совет. Проверь, что в профиле заданы цели по КБЖУ."
+            ai_failure_text("Не удалось сформировать совет. Проверь, что в профиле заданы цели по КБЖУ."),
+            parse_mode="HTML",
         )
         return
-    await callback.message.edit_text(f"💡 <b>Что съесть на {meal_type}:</b>\n\n{suggestion}", parse_mode="HTML")
+    await callback.message.edit_text(header + suggestion, parse_mode="HTML")
 
 
 @router.message(Command("undo"))
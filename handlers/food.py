@@ -1,14 +1,21 @@
+import asyncio
+import logging
 from aiogram import Router, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from database import add_meal, get_user, get_daily_totals
-from gemini_helper import analyze_food_photo, analyze_food_text, get_daily_tip
+from background import spawn
+from config import TIP_TIMEOUT, AFTER_MEAL_TASK_TIMEOUT
+from database import add_meal_with_summary
+from gemini_helper import analyze_food_text, get_daily_tip, ai_failure_text
+from photo_cache import analyze_photo_cached
 from reminders import check_goal_reached_and_send
 from keyboards import main_keyboard, confirm_food_keyboard
 from calculator import format_daily_summary
 
 router = Router()
+logger = logging.getLogger(__name__)
 
 class FoodState(StatesGroup):
     waiting_confirm = State()
@@ -28,26 +35,21 @@ async def handle_photo(message: Message, state: FSMContext):
     await message.answer("🔍 Анализирую фото...")
 
     photo = message.photo[-1]
-    bot = message.bot
-    file = await bot.get_file(photo.file_id)
-    file_bytes = await bot.download_file(file.file_path)
-    image_data = file_bytes.read()
-
-    result = analyze_food_photo(image_data, caption=message.caption)
+    result = await analyze_photo_cached(message.bot, photo.file_id, photo.file_unique_id, caption=message.caption)
 
     if not result and message.caption:
-        result = analyze_food_text(message.caption.strip())
+        result = await analyze_food_text(message.caption.strip())
 
     if not result:
-        await message.answer("❌ Не удалось распознать еду. Попробуй ещё раз или опиши текстом.")
+        await message.answer(ai_failure_text("❌ Не удалось распознать еду. Попробуй ещё раз или опиши текстом."), parse_mode="HTML")
         return
     if result.get("needs_clarification"):
-        await state.update_data(food=result, photo_file_id=photo.file_id)
+        await state.update_data(food=result, photo_file_id=photo.file_id, photo_unique_id=photo.file_unique_id)
         await state.set_state(FoodState.waiting_clarification)
         await message.answer(f"🤔 {result['question']}\n\nОтветь текстом в следующем сообщении — пересмотрю фото с учётом твоего уточнения.")
         return
 
-    await state.update_data(food=result, photo_file_id=photo.file_id)
+    await state.update_data(food=result, photo_file_id=photo.file_id, photo_unique_id=photo.file_unique_id)
     await state.set_state(FoodState.waiting_confirm)
 
     await message.answer(
@@ -69,40 +71,35 @@ async def handle_clarification(message: Message, state: FSMContext):
     if photo_file_id:
         await message.answer("🔍 Пересматриваю фото с твоим уточнением...")
         try:
-            bot = message.bot
-            file = await bot.get_file(photo_file_id)
-            file_bytes = await bot.download_file(file.file_path)
-            image_data = file_bytes.read()
+            result = await analyze_photo_cached(message.bot, photo_file_id, data.get("photo_unique_id"), caption=message.text)
         except Exception as e:
             print(f"Download photo for clarification: {e}")
-            image_data = None
-        if image_data:
-            result = analyze_food_photo(image_data, caption=message.text)
-            if result and not result.get("needs_clarification"):
-                await state.update_data(food=result)
-                await state.set_state(FoodState.waiting_confirm)
-                await message.answer(
-                    f"🍽 <b>{result['name']}</b>\n\n"
-                    f"🔥 Калории: <b>{result['calories']} ккал</b>\n"
-                    f"🥩 Белки: {result['protein']} г\n"
-                    f"🧈 Жиры: {result['fat']} г\n"
-                    f"🍞 Углеводы: {result['carbs']} г\n\n"
-                    f"💬 {result.get('comment', '')}\n\n"
-                    f"Всё верно?",
-                    parse_mode="HTML",
-                    reply_markup=confirm_food_keyboard()
-                )
-                return
+            result = None
+        if result and not result.get("needs_clarification"):
+            await state.update_data(food=result)
+            await state.set_state(FoodState.waiting_confirm)
+            await message.answer(
+                f"🍽 <b>{result['name']}</b>\n\n"
+                f"🔥 Калории: <b>{result['calories']} ккал</b>\n"
+                f"🥩 Белки: {result['protein']} г\n"
+                f"🧈 Жиры: {result['fat']} г\n"
+                f"🍞 Углеводы: {result['carbs']} г\n\n"
+                f"💬 {result.get('comment', '')}\n\n"
+                f"Всё верно?",
+                parse_mode="HTML",
+                reply_markup=confirm_food_keyboard()
+            )
+            return
     original_text = data.get("original_food_text", "")
     original = data.get("food", {})
     original_name = original.get("name", "")
     full_prompt = f"Пользователь хотел добавить: '{original_text}'. Распознано как '{original_name}'. Пользователь уточняет: '{message.text}'. Рассчитай итоговое КБЖУ с учётом контекста."
-    result = analyze_food_text(full_prompt)
+    result = await analyze_food_text(full_prompt)
     if not result or result.get("needs_clarification"):
-        result = analyze_food_text(full_prompt, no_clarification=True)
+        result = await analyze_food_text(full_prompt, no_clarification=True)
     if not result or result.get("needs_clarification"):
         await state.clear()
-        await message.answer("❌ Не удалось посчитать. Попробуй написать иначе.")
+        await message.answer(ai_failure_text("❌ Не удалось посчитать. Попробуй написать иначе."), parse_mode="HTML")
         return
 
     await state.update_data(food=result)
@@ -136,20 +133,17 @@ async def handle_text_food(message: Message, state: FSMContext):
     if photo_file_id:
         await message.answer("🔍 Пересматриваю фото с твоей правкой...")
         try:
-            file = await message.bot.get_file(photo_file_id)
-            file_bytes = await message.bot.download_file(file.file_path)
-            image_data = file_bytes.read()
-            result = analyze_food_photo(image_data, caption=message.text)
+            result = await analyze_photo_cached(message.bot, photo_file_id, data.get("photo_unique_id"), caption=message.text)
         except Exception as e:
             print(f"Download photo for correction: {e}")
             result = None
         if not result:
-            result = analyze_food_text(message.text)
+            result = await analyze_food_text(message.text)
     else:
         await message.answer("🔍 Считаю КБЖУ...")
-        result = analyze_food_text(message.text)
+        result = await analyze_food_text(message.text)
     if not result:
-        await message.answer("❌ Не смог обработать. Попробуй написать иначе, например: <i>куриная грудка 200г</i>", parse_mode="HTML")
+        await message.answer(ai_failure_text("❌ Не смог обработать. Попробуй написать иначе, например: <i>куриная грудка 200г</i>"), parse_mode="HTML")
         return
     if result.get("needs_clarification"):
         await state.update_data(original_food_text=message.text, food=result)
@@ -176,24 +170,43 @@ async def food_confirmed(callback: CallbackQuery, state: FSMContext):
     food = data["food"]
     user_id = callback.from_user.id
 
-    await add_meal(user_id, food["name"], food["calories"], food["protein"], food["fat"], food["carbs"])
+    user, totals = await add_meal_with_summary(user_id, food["name"], food["calories"], food["protein"], food["fat"], food["carbs"])
     await state.clear()
 
-    user = await get_user(user_id)
-    totals = await get_daily_totals(user_id)
-
+    await callback.answer()
     await callback.message.edit_text(f"✅ <b>{food['name']}</b> добавлено!", parse_mode="HTML")
+    await answer_summary_with_tip(callback.message, user_id, user, totals)
 
-    if user:
-        summary = format_daily_summary(totals, user)
-        tip = get_daily_tip(totals, user)
-        text = summary
-        if tip:
-            text += f"\n\n💡 {tip}"
-        await callback.message.answer(text, parse_mode="HTML")
 
-    await check_goal_reached_and_send(user_id, callback.bot)
-    await callback.answer()
+async def _append_tip_and_check_goal(summary_message: Message | None, text: str, user_id: int, user: dict | None, totals: dict, bot):
+    if summary_message and user:
+        try:
+            tip = await asyncio.wait_for(get_daily_tip(totals, user), TIP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.info("Совет для user_id=%s не успел за %s с — сводка остаётся без него", user_id, TIP_TIMEOUT)
+            tip = None
+        if tip:
+            try:
+                await summary_message.edit_text(f"{text}\n\n💡 {tip}", parse_mode="HTML")
+            except TelegramBadRequest as e:
+                logger.info("Не удалось дописать совет (сообщение удалено?): %s", e)
+    await check_goal_reached_and_send(user_id, bot)
+
+
+async def answer_summary_with_tip(message: Message, user_id: int, user: dict | None, totals: dict, header: str = ""):
+    """
+    Сводка за день уходит сразу; совет ИИ дописывается правкой этого сообщения, а проверка целей за день
+    идёт следом — в фоновой задаче, чтобы пользователь не ждал модель.
+    """
+    summary_message, text = None, ""
+    if user:
+        text = header + format_daily_summary(totals, user)
+        summary_message = await message.answer(text, parse_mode="HTML")
+    spawn(
+        _append_tip_and_check_goal(summary_message, text, user_id, user, totals, message.bot),
+        name=f"after_meal:{user_id}",
+        timeout=AFTER_MEAL_TASK_TIMEOUT,
+    )
 
 @router.callback_query(F.data == "food_edit", FoodState.waiting_confirm)
 async def food_edit(callback: CallbackQuery, state: FSMContext):
@@ -5,7 +5,7 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from datetime import datetime
-from database import get_user, save_user, log_weight
+from database import get_user, save_user, update_user, log_weight
 from keyboards import main_keyboard, gender_keyboard
 from gemini_helper import calculate_goals_ai
 from calculator import calculate_goals, calculate_water_goal
@@ -118,10 +118,7 @@ async def profile_button(message: Message, state: FSMContext):
     else:
         # обновляем username при открытии профиля (актуальный @nick)
         if message.from_user.username is not None and user.get("username") != message.from_user.username:
-            updates = {k: user[k] for k in user if k != "user_id"}
-            updates["username"] = message.from_user.username
-            await save_user(message.from_user.id, updates)
-            user["username"] = message.from_user.username
+            user = await save_user(message.from_user.id, {"username": message.from_user.username}, current=user)
         goal_label = GOAL_LABELS.get(user.get("goal", ""), user.get("goal", "—"))
         activity_label = ACTIVITY_LABELS.get(user.get("activity", ""), "—")
         kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -306,9 +303,8 @@ async def profile_edit_kbju_apply(message: Message, state: FSMContext):
     )
     updates["water_goal"] = water
     updates["username"] = message.from_user.username
-    await save_user(message.from_user.id, updates)
+    u = await save_user(message.from_user.id, updates, current=user)
     await state.clear()
-    u = await get_user(message.from_user.id)
     await message.answer(
         f"✅ Обновлено. Цели: 🔥 {u.get('calories_goal')} ккал · 🥩 {u.get('protein_goal')} г · "
         f"🧈 {u.get('fat_goal')} г · 🍞 {u.get('carbs_goal')} г · 💧 {u.get('water_goal')} мл",
@@ -356,12 +352,7 @@ async def profile_reminders_screen(callback: CallbackQuery):
 @router.callback_query(F.data.startswith("profile_reminders_"))
 async def profile_reminders_toggle(callback: CallbackQuery):
     action = callback.data.replace("profile_reminders_", "")
-    user = await get_user(callback.from_user.id)
-    if not user:
-        await callback.answer()
-        return
-    updates = {k: user[k] for k in user if k != "user_id"}
-    updates["username"] = callback.from_user.username
+    updates = {"username": callback.from_user.username}
     if action == "off":
         updates["reminders_enabled"] = 0
     elif action == "on":
@@ -372,9 +363,12 @@ async def profile_reminders_toggle(callback: CallbackQuery):
     else:
         await callback.answer()
         return
-    await save_user(callback.from_user.id, updates)
+    # Один запрос: UPDATE ... RETURNING сразу отдаёт строку для экрана
+    user = await update_user(callback.from_user.id, updates)
+    if not user:
+        await callback.answer()
+        return
     await callback.answer("Сохранено")
-    user = await get_user(callback.from_user.id)
     status = "включены" if (user.get("reminders_enabled") or 0) != 0 else "выключены"
     per_day = user.get("reminders_per_day") or 3
     text = (
@@ -414,16 +408,14 @@ async def profile_reengage_screen(callback: CallbackQuery):
 @router.callback_query(F.data.startswith("profile_reengage_"))
 async def profile_reengage_toggle(callback: CallbackQuery):
     action = callback.data.replace("profile_reengage_", "")
-    user = await get_user(callback.from_user.id)
+    user = await update_user(callback.from_user.id, {
+        "username": callback.from_user.username,
+        "reengage_enabled": 1 if action == "on" else 0,
+    })
     if not user:
         await callback.answer()
         return
-    updates = {k: user[k] for k in user if k != "user_id"}
-    updates["username"] = callback.from_user.username
-    updates["reengage_enabled"] = 1 if action == "on" else 0
-    await save_user(callback.from_user.id, updates)
     await callback.answer("Сохранено")
-    user = await get_user(callback.from_user.id)
     enabled = user.get("reengage_enabled") is None or user.get("reengage_enabled") != 0
     status = "включены" if enabled else "выключены"
     text = (
@@ -463,16 +455,14 @@ async def profile_progress_screen(callback: CallbackQuery):
 @router.callback_query(F.data.startswith("profile_progress_"))
 async def profile_progress_toggle(callback: CallbackQuery):
     action = callback.data.replace("profile_progress_", "")
-    user = await get_user(callback.from_user.id)
+    user = await update_user(callback.from_user.id, {
+        "username": callback.from_user.username,
+        "progress_notifications_enabled": 1 if action == "on" else 0,
+    })
     if not user:
         await callback.answer()
         return
-    updates = {k: user[k] for k in user if k != "user_id"}
-    updates["username"] = callback.from_user.username
-    updates["progress_notifications_enabled"] = 1 if action == "on" else 0
-    await save_user(callback.from_user.id, updates)
     await callback.answer("Сохранено")
-    user = await get_user(callback.from_user.id)
     enabled = user.get("progress_notifications_enabled") is None or user.get("progress_notifications_enabled") != 0
     status = "включены" if enabled else "выключены"
     text = (
@@ -511,16 +501,14 @@ async def profile_week_status_screen(callback: CallbackQuery):
 @router.callback_query(F.data.startswith("profile_week_status_"))
 async def profile_week_status_toggle(callback: CallbackQuery):
     action = callback.data.replace("profile_week_status_", "")
-    user = await get_user(callback.from_user.id)
+    user = await update_user(callback.from_user.id, {
+        "username": callback.from_user.username,
+        "week_status_enabled": 1 if action == "on" else 0,
+    })
     if not user:
         await callback.answer()
         return
-    updates = {k: user[k] for k in user if k != "user_id"}
-    updates["username"] = callback.from_user.username
-    updates["week_status_enabled"] = 1 if action == "on" else 0
-    await save_user(callback.from_user.id, updates)
     await callback.answer("Сохранено")
-    user = await get_user(callback.from_user.id)
     enabled = user.get("week_status_enabled") is None or user.get("week_status_enabled") != 0
     status = "включён" if enabled else "выключен"
     text = (
@@ -697,7 +685,7 @@ async def get_target_weight(message: Message, state: FSMContext):
 
         await message.answer("🤖 ИИ анализирует твои данные и рассчитывает КБЖУ...")
 
-        result = calculate_goals_ai(
+        result = await calculate_goals_ai(
             weight=data["weight"],
             height=data["height"],
             age=data["age"],
@@ -801,7 +789,7 @@ async def save_weight(message: Message, state: FSMContext):
             goal = user.get("goal") or "maintain"
             goal_key = goal if goal in ("loss", "gain", "maintain", "cutting", "recomp") else "maintain"
             pace = user.get("pace") or "slow"
-            result = calculate_goals_ai(
+            result = await calculate_goals_ai(
                 weight=weight,
                 height=user["height"],
                 age=user["age"],
@@ -825,8 +813,7 @@ async def save_weight(message: Message, state: FSMContext):
                     user["gender"], user.get("activity") or "sedentary", goal_key
                 )
             water = calculate_water_goal(weight, goal, pace, carbs)
-            updates = {k: user[k] for k in user if k != "user_id"}
-            updates.update({
+            await save_user(message.from_user.id, {
                 "weight": weight,
                 "calories_goal": cal,
                 "protein_goal": prot,
@@ -834,8 +821,7 @@ async def save_weight(message: Message, state: FSMContext):
                 "carbs_goal": carbs,
                 "water_goal": water,
                 "username": message.from_user.username,
-            })
-            await save_user(message.from_user.id, updates)
+            }, current=user)
             text += f"\n\n🔄 Цели пересчитаны под новый вес:\n🔥 {cal} ккал · 🥩 {prot} г · 🧈 {fat} г · 🍞 {carbs} г · 💧 {water} мл"
 
         if user and user.get("target_weight"):
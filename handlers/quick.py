@@ -2,11 +2,11 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from database import get_quick_foods, add_quick_food, delete_quick_food, add_meal, get_user, get_daily_totals
+from database import get_quick_foods, add_quick_food, delete_quick_food, add_meal_with_summary
 from keyboards import quick_foods_keyboard, main_keyboard
-from calculator import format_daily_summary
-from gemini_helper import analyze_food_text, analyze_food_photo
-from reminders import check_goal_reached_and_send
+from gemini_helper import analyze_food_text, ai_failure_text
+from photo_cache import analyze_photo_cached
+from handlers.food import answer_summary_with_tip
 
 router = Router()
 
@@ -43,18 +43,10 @@ async def quick_add(callback: CallbackQuery):
         return
 
     fid, name, cal, p, f, c = food
-    await add_meal(user_id, name, cal, p, f, c)
-
-    user = await get_user(user_id)
-    totals = await get_daily_totals(user_id)
+    user, totals = await add_meal_with_summary(user_id, name, cal, p, f, c)
 
     await callback.answer(f"✅ {name} добавлено!")
-
-    if user:
-        summary = format_daily_summary(totals, user)
-        await callback.message.answer(f"✅ <b>{name}</b> добавлено!\n\n{summary}", parse_mode="HTML")
-
-    await check_goal_reached_and_send(user_id, callback.bot)
+    await answer_summary_with_tip(callback.message, user_id, user, totals, header=f"✅ <b>{name}</b> добавлено!\n\n")
 
 @router.callback_query(F.data == "quick_new")
 async def quick_new(callback: CallbackQuery, state: FSMContext):
@@ -79,15 +71,14 @@ async def quick_analyze(message: Message, state: FSMContext):
     if photo_file_id and message.text:
         await message.answer("🔍 Пересматриваю фото с твоим уточнением...")
         try:
-            file = await message.bot.get_file(photo_file_id)
-            file_bytes = await message.bot.download_file(file.file_path)
-            image_data = file_bytes.read()
+            result = await analyze_photo_cached(
+                message.bot, photo_file_id, data.get("quick_photo_unique_id"), caption=message.text.strip()
+            )
         except Exception as e:
             print(f"Quick add: download photo for clarification: {e}")
             await message.answer("❌ Не удалось загрузить фото. Попробуй отправить заново.")
             return
-        result = analyze_food_photo(image_data, caption=message.text.strip())
-        await state.update_data(quick_photo_file_id=None)
+        await state.update_data(quick_photo_file_id=None, quick_photo_unique_id=None)
         if not result or result.get("needs_clarification"):
             await message.answer("❌ Всё равно не вышло. Добавь текстом, например: <i>рис 200г</i>", parse_mode="HTML")
             return
@@ -99,20 +90,17 @@ async def quick_analyze(message: Message, state: FSMContext):
         await message.answer("🔍 Считаю КБЖУ по фото...")
         photo = message.photo[-1]
         try:
-            file = await message.bot.get_file(photo.file_id)
-            file_bytes = await message.bot.download_file(file.file_path)
-            image_data = file_bytes.read()
+            result = await analyze_photo_cached(message.bot, photo.file_id, photo.file_unique_id, caption=message.caption)
         except Exception as e:
             print(f"Quick add: download photo: {e}")
             await message.answer("❌ Не удалось загрузить фото. Попробуй ещё раз.")
             return
-        result = analyze_food_photo(image_data, caption=message.caption)
 
         if not result:
-            await message.answer("❌ Не смог распознать еду на фото. Напиши текстом, например: <i>овсянка 50г</i>", parse_mode="HTML")
+            await message.answer(ai_failure_text("❌ Не смог распознать еду на фото. Напиши текстом, например: <i>овсянка 50г</i>"), parse_mode="HTML")
             return
         if result.get("needs_clarification"):
-            await state.update_data(quick_photo_file_id=photo.file_id)
+            await state.update_data(quick_photo_file_id=photo.file_id, quick_photo_unique_id=photo.file_unique_id)
             await message.answer(
                 f"🤔 {result['question']}\n\nОтветь в следующем сообщении — пересмотрю фото с учётом этого.",
                 parse_mode="HTML"
@@ -126,10 +114,10 @@ async def quick_analyze(message: Message, state: FSMContext):
         await message.answer("Отправь текст (название и количество) или фото блюда.")
         return
     await message.answer("🔍 Считаю КБЖУ...")
-    result = analyze_food_text(message.text.strip())
+    result = await analyze_food_text(message.text.strip())
 
     if not result:
-        await message.answer("❌ Не смог обработать. Попробуй иначе.")
+        await message.answer(ai_failure_text("❌ Не смог обработать. Попробуй иначе."), parse_mode="HTML")
         await state.clear()
         return
 
@@ -0,0 +1,110 @@
+"""
+Подготовка фото еды перед отправкой в Gemini: декодирование, поворот по EXIF и удаление метаданных,
+уменьшение до PHOTO_MAX_EDGE по длинной стороне и перекодирование в JPEG с качеством PHOTO_JPEG_QUALITY.
+Работа с Pillow идёт в отдельном пуле потоков (PHOTO_PREP_WORKERS), чтобы не блокировать event loop.
+Без Pillow или на нечитаемом файле отдаём исходные байты.
+
+Бенчмарк размеров: python image_prep.py photo1.jpg photo2.jpg [--sizes 512,768,1024,1600] [--model]
+(с --model каждый вариант отправляется в модель и ответ сравнивается с ответом на исходное фото).
+"""
+import asyncio
+import io
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import PHOTO_MAX_EDGE, PHOTO_JPEG_QUALITY, PHOTO_PREP_WORKERS
+
+logger = logging.getLogger("image_prep")
+
+_executor = ThreadPoolExecutor(max_workers=max(1, PHOTO_PREP_WORKERS), thread_name_prefix="image_prep")
+
+stats = {"prepared": 0, "skipped": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def prepare_image_sync(image_bytes: bytes, max_edge: int = PHOTO_MAX_EDGE, quality: int = PHOTO_JPEG_QUALITY) -> tuple[bytes, str] | None:
+    """(JPEG-байты, "image/jpeg") или None, если Pillow нет или картинку не удалось прочитать."""
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img = ImageOps.exif_transpose(img)
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            if max_edge and max(img.size) > max_edge:
+                img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            out = io.BytesIO()
+            # exif не передаём — метаданные (геолокация, модель камеры) в модель не уходят
+            img.save(out, format="JPEG", quality=quality, optimize=True)
+    except Exception as e:
+        logger.debug("prepare_image: %s", e)
+        return None
+    return out.getvalue(), "image/jpeg"
+
+
+async def prepare_image(image_bytes: bytes, mime_type: str = "image/jpeg") -> tuple[bytes, str]:
+    """Уменьшенная и очищенная копия фото для модели; при неудаче — исходные байты и mime_type."""
+    prepared = await asyncio.get_running_loop().run_in_executor(_executor, prepare_image_sync, image_bytes)
+    if prepared is None:
+        stats["skipped"] += 1
+        return image_bytes, mime_type
+    stats["prepared"] += 1
+    stats["bytes_in"] += len(image_bytes)
+    stats["bytes_out"] += len(prepared[0])
+    return prepared
+
+
+def _agreement(base: dict | None, other: dict | None) -> str:
+    """Насколько ответ на уменьшенное фото совпадает с ответом на исходное: разница калорий и общие слова в названии."""
+    if not isinstance(base, dict) or not isinstance(other, dict):
+        return "n/a"
+    try:
+        base_cal, other_cal = float(base["calories"]), float(other["calories"])
+    except (KeyError, TypeError, ValueError):
+        return "n/a"
+    diff = abs(other_cal - base_cal) / max(base_cal, 1) * 100
+    base_words = set(str(base.get("name", "")).lower().split())
+    other_words = set(str(other.get("name", "")).lower().split())
+    overlap = len(base_words & other_words) / max(len(base_words | other_words), 1) * 100
+    return f"ккал {diff:+.0f}%, название {overlap:.0f}%"
+
+
+async def _benchmark(paths: list[str], sizes: list[int], use_model: bool):
+    from gemini_helper import analyze_food_photo
+
+    for path in paths:
+        with open(path, "rb") as f:
+            original = f.read()
+        print(f"\n{path}: исходник {len(original) / 1024:.0f} КБ")
+        base = None
+        if use_model:
+            t0 = time.perf_counter()
+            base = await analyze_food_photo(original, prepare=False)
+            print(f"  {'raw':>6}: {len(original) / 1024:7.0f} КБ  модель {(time.perf_counter() - t0) * 1000:6.0f} мс  {base}")
+        for size in sizes:
+            t0 = time.perf_counter()
+            prepared = prepare_image_sync(original, max_edge=size)
+            prep_ms = (time.perf_counter() - t0) * 1000
+            if prepared is None:
+                print(f"  {size:>6}: не удалось подготовить (нет Pillow?)")
+                continue
+            data, mime_type = prepared
+            line = f"  {size:>6}: {len(data) / 1024:7.0f} КБ  подготовка {prep_ms:5.0f} мс"
+            if use_model:
+                t0 = time.perf_counter()
+                result = await analyze_food_photo(data, mime_type=mime_type, prepare=False)
+                line += f"  модель {(time.perf_counter() - t0) * 1000:6.0f} мс  {_agreement(base, result)}"
+            print(line)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Сравнение размеров фото перед отправкой в Gemini")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--sizes", default="512,768,1024,1600", help="длинная сторона, через запятую")
+    parser.add_argument("--model", action="store_true", help="отправлять варианты в модель и сравнивать ответы")
+    args = parser.parse_args()
+    asyncio.run(_benchmark(args.paths, [int(s) for s in args.sizes.split(",") if s.strip()], args.model))
@@ -0,0 +1,134 @@
+"""
+Пул заранее сгенерированных текстов для уведомлений о достижении цели и о 5-дневных сериях.
+Тексты (без цифр пользователя) копятся в таблице message_pool по (вид уведомления, цель пользователя)
+и обновляются фоновой задачей refresh_pools — при рассылке модель не вызывается: берётся случайный текст
+из пула, цифры подставляются на месте. Пул пуст или БД недоступна — статический текст.
+"""
+import logging
+import random
+import time
+
+import database
+from background import spawn
+from cache import LRUCache
+from config import (
+    MESSAGE_POOL_SIZE,
+    MESSAGE_POOL_MAX_AGE_DAYS,
+    MESSAGE_POOL_REFRESH_HOURS,
+)
+from gemini_helper import USER_GOAL_LABELS, get_goal_reached_message, get_5day_streak_message, ai_degraded
+
+logger = logging.getLogger("message_pool")
+
+GOAL_TYPES = ("protein", "calories", "full")
+STREAK_TYPES = ("protein_shortfall", "fat_over", "cal_over")
+
+# Если пул ещё не наполнен
+STATIC_GOAL_MESSAGES = {
+    "protein": {
+        "benefit": "Достаточно белка — это восстановление мышц после нагрузки и сытость на дольше.",
+        "motivation": "Продолжай в том же духе — стабильность даёт результат.",
+    },
+    "calories": {
+        "benefit": "Калории в норме — энергии хватает на день, а вес движется в нужную сторону.",
+        "motivation": "Продолжай в том же духе — стабильность даёт результат.",
+    },
+    "full": {
+        "benefit": "Сбалансированный день по КБЖУ — лучшая опора для самочувствия и прогресса.",
+        "motivation": "Продолжай в том же духе — стабильность даёт результат.",
+    },
+}
+STATIC_STREAK_MESSAGES = {
+    "protein_shortfall": "Я заметил, что 5 дней подряд белка меньше цели — это может замедлить прогресс. Попробуй добавить один белковый перекус.",
+    "fat_over": "Я заметил, что 5 дней подряд жиров больше цели — это может замедлить прогресс. Можно чуть уменьшить масло и соусы.",
+    "cal_over": "Я заметил, что 5 дней подряд калорий больше цели — это может замедлить прогресс. Можно чуть уменьшить порцию вечером.",
+}
+
+# (kind, goal) -> список текстов из БД; перечитываем раз в 10 минут, чтобы подхватить обновлённый пул
+_pools = LRUCache(maxsize=256, ttl=600)
+_last_refresh = 0.0
+_refreshing = False
+
+stats = {"pool_hits": 0, "static": 0, "generated": 0}
+
+
+def _goal_key(user_goal: str | None) -> str:
+    return user_goal if user_goal in USER_GOAL_LABELS else "maintain"
+
+
+async def _sample(kind: str, user_goal: str | None):
+    key = (kind, _goal_key(user_goal))
+    pool = _pools.get(key)
+    if pool is None:
+        try:
+            pool = await database.message_pool_get(*key)
+        except Exception as e:
+            logger.warning("message_pool_get %s: %s", key, e)
+            pool = []
+        _pools.set(key, pool)
+    if not pool:
+        stats["static"] += 1
+        return None
+    stats["pool_hits"] += 1
+    return random.choice(pool)
+
+
+async def sample_goal_reached(goal_type: str, user_goal: str | None) -> dict:
+    """{"benefit": ..., "motivation": ...} для уведомления о цели (protein / calories / full)."""
+    payload = await _sample(f"goal:{goal_type}", user_goal)
+    if isinstance(payload, dict) and payload.get("benefit"):
+        return payload
+    return STATIC_GOAL_MESSAGES[goal_type]
+
+
+async def sample_streak(streak_type: str, user_goal: str | None) -> str:
+    """Текст мягкого комментария к 5-дневной серии (без цифр)."""
+    payload = await _sample(f"streak:{streak_type}", user_goal)
+    if isinstance(payload, dict) and payload.get("text"):
+        return payload["text"]
+    return STATIC_STREAK_MESSAGES[streak_type]
+
+
+async def _generate(kind: str, user_goal: str):
+    if kind.startswith("goal:"):
+        return await get_goal_reached_message(kind.split(":", 1)[1], user_goal)
+    text = await get_5day_streak_message(kind.split(":", 1)[1], user_goal)
+    return {"text": text} if text else None
+
+
+async def refresh_pools():
+    """Удалить устаревшие тексты и догенерировать пулы до MESSAGE_POOL_SIZE на каждую пару (вид, цель)."""
+    global _refreshing
+    _refreshing = True
+    try:
+        await database.message_pool_purge(MESSAGE_POOL_MAX_AGE_DAYS)
+        counts = await database.message_pool_counts()
+        kinds = [f"goal:{t}" for t in GOAL_TYPES] + [f"streak:{t}" for t in STREAK_TYPES]
+        for kind in kinds:
+            for user_goal in USER_GOAL_LABELS:
+                missing = MESSAGE_POOL_SIZE - counts.get((kind, user_goal), 0)
+                # По одному: одинаковые промпты, отправленные разом, склеились бы в один ответ
+                for _ in range(max(0, missing)):
+                    if ai_degraded():
+                        logger.info("Пул уведомлений: ИИ недоступен, догенерация отложена")
+                        return
+                    payload = await _generate(kind, user_goal)
+                    if not payload:
+                        break
+                    await database.message_pool_add(kind, user_goal, payload)
+                    stats["generated"] += 1
+                if missing > 0:
+                    _pools.pop((kind, user_goal))
+        logger.info("Пул уведомлений обновлён, сгенерировано всего: %s", stats["generated"])
+    finally:
+        _refreshing = False
+
+
+def schedule_refresh():
+    """Запустить refresh_pools в фоне, если с прошлого обновления прошло MESSAGE_POOL_REFRESH_HOURS и ИИ доступен."""
+    global _last_refresh
+    now = time.monotonic()
+    if _refreshing or ai_degraded() or (_last_refresh and now - _last_refresh < MESSAGE_POOL_REFRESH_HOURS * 3600):
+        return
+    _last_refresh = now
+    spawn(refresh_pools(), name="message_pool_refresh", timeout=30 * 60)
@@ -0,0 +1,243 @@
+"""
+Версионированные миграции схемы. Применённые шаги записаны в schema_migrations (версия, имя, контрольная сумма SQL).
+При старте — один SELECT из schema_migrations: всё применено и суммы совпали — больше запросов нет.
+Иначе под advisory lock (параллельные инстансы не применяют одно и то же дважды) перечитываем версию
+и применяем недостающие шаги по порядку, каждый в своей транзакции вместе с записью о нём.
+
+Применённую миграцию не редактируют (контрольная сумма не сойдётся и старт упадёт) — изменения схемы только новым шагом
+в конец MIGRATIONS.
+"""
+import hashlib
+import logging
+
+import asyncpg
+
+logger = logging.getLogger("migrations")
+
+# Ключ pg_advisory_lock для миграций (произвольная константа, общая для всех инстансов)
+MIGRATION_LOCK_KEY = 7_214_530_118
+
+# (версия, имя, SQL). Шаг 1 повторяет прежний init_db через IF NOT EXISTS — существующая база проходит его без изменений.
+MIGRATIONS: list[tuple[int, str, str]] = [
+    (1, "baseline", """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            name TEXT,
+            weight REAL,
+            height REAL,
+            age INTEGER,
+            gender TEXT,
+            activity TEXT,
+            goal TEXT,
+            target_weight REAL,
+            calories_goal INTEGER,
+            protein_goal INTEGER,
+            fat_goal INTEGER,
+            carbs_goal INTEGER,
+            water_goal INTEGER,
+            pace TEXT,
+            reminders_enabled INTEGER DEFAULT 1,
+            reminders_per_day INTEGER DEFAULT 3,
+            username TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS water_goal INTEGER;
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS pace TEXT;
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS username TEXT;
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS last_activity_at TIMESTAMP;
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS reengage_enabled INTEGER DEFAULT 1;
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS progress_notifications_enabled INTEGER DEFAULT 1;
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS week_status_enabled INTEGER DEFAULT 1;
+
+        CREATE TABLE IF NOT EXISTS reminder_log (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            sent_at TIMESTAMP,
+            date DATE
+        );
+        CREATE TABLE IF NOT EXISTS meals (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            name TEXT,
+            calories INTEGER,
+            protein REAL,
+            fat REAL,
+            carbs REAL,
+            date DATE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS weight_log (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            weight REAL,
+            date DATE
+        );
+        CREATE TABLE IF NOT EXISTS quick_foods (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            name TEXT,
+            calories INTEGER,
+            protein REAL,
+            fat REAL,
+            carbs REAL
+        );
+        CREATE TABLE IF NOT EXISTS notification_sent (
+            user_id BIGINT NOT NULL,
+            sent_date DATE NOT NULL,
+            notification_type VARCHAR(50) NOT NULL,
+            PRIMARY KEY (user_id, sent_date, notification_type)
+        );
+        ALTER TABLE notification_sent ADD COLUMN IF NOT EXISTS sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+
+        CREATE TABLE IF NOT EXISTS ai_cache (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            value JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (namespace, key)
+        );
+        CREATE TABLE IF NOT EXISTS message_pool (
+            id SERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            goal TEXT NOT NULL,
+            payload JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS message_pool_kind_goal ON message_pool (kind, goal);
+    """),
+    # Индексы под запросы «пользователь + день/тип»: сначала равенства, затем колонка сортировки
+    # (ORDER BY ... LIMIT 1 без сортировки). Проверка — database.check_access_paths.
+    (2, "user_day_indexes", """
+        CREATE INDEX IF NOT EXISTS meals_user_date_id ON meals (user_id, date, id);
+        CREATE INDEX IF NOT EXISTS reminder_log_user_date_sent ON reminder_log (user_id, date, sent_at);
+        CREATE INDEX IF NOT EXISTS notification_sent_user_type_sent_at ON notification_sent (user_id, notification_type, sent_at);
+        CREATE INDEX IF NOT EXISTS notification_sent_user_type_date ON notification_sent (user_id, notification_type, sent_date);
+        CREATE INDEX IF NOT EXISTS weight_log_user_date ON weight_log (user_id, date);
+        CREATE INDEX IF NOT EXISTS quick_foods_user ON quick_foods (user_id);
+    """),
+    # Суммы КБЖУ по (пользователь, день): ведёт триггер на meals в той же транзакции, что и запись о еде.
+    # Строка удаляется, когда за день не осталось приёмов — дни без еды отсутствуют, как в GROUP BY по meals.
+    # Триггер создаётся до заполнения: блокировка meals держится до конца миграции, записи не теряются.
+    (3, "daily_totals", """
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            user_id BIGINT NOT NULL,
+            date DATE NOT NULL,
+            calories BIGINT NOT NULL DEFAULT 0,
+            protein DOUBLE PRECISION NOT NULL DEFAULT 0,
+            fat DOUBLE PRECISION NOT NULL DEFAULT 0,
+            carbs DOUBLE PRECISION NOT NULL DEFAULT 0,
+            meals INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, date)
+        );
+
+        CREATE OR REPLACE FUNCTION daily_totals_apply(p_user BIGINT, p_date DATE, p_sign INTEGER,
+                                                      p_cal INTEGER, p_prot REAL, p_fat REAL, p_carb REAL)
+        RETURNS void AS $$
+        BEGIN
+            IF p_user IS NULL OR p_date IS NULL THEN
+                RETURN;
+            END IF;
+            INSERT INTO daily_totals AS t (user_id, date, calories, protein, fat, carbs, meals)
+            VALUES (p_user, p_date, p_sign * COALESCE(p_cal, 0), p_sign * COALESCE(p_prot, 0),
+                    p_sign * COALESCE(p_fat, 0), p_sign * COALESCE(p_carb, 0), p_sign)
+            ON CONFLICT (user_id, date) DO UPDATE SET
+                calories = t.calories + EXCLUDED.calories,
+                protein = t.protein + EXCLUDED.protein,
+                fat = t.fat + EXCLUDED.fat,
+                carbs = t.carbs + EXCLUDED.carbs,
+                meals = t.meals + EXCLUDED.meals;
+            IF p_sign < 0 THEN
+                DELETE FROM daily_totals WHERE user_id = p_user AND date = p_date AND meals <= 0;
+            END IF;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION meals_daily_totals() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM daily_totals_apply(OLD.user_id, OLD.date, -1, OLD.calories, OLD.protein, OLD.fat, OLD.carbs);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM daily_totals_apply(NEW.user_id, NEW.date, 1, NEW.calories, NEW.protein, NEW.fat, NEW.carbs);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS meals_daily_totals ON meals;
+        CREATE TRIGGER meals_daily_totals AFTER INSERT OR UPDATE OR DELETE ON meals
+            FOR EACH ROW EXECUTE FUNCTION meals_daily_totals();
+
+        INSERT INTO daily_totals (user_id, date, calories, protein, fat, carbs, meals)
+        SELECT user_id, date, COALESCE(SUM(calories), 0), COALESCE(SUM(protein::double precision), 0),
+               COALESCE(SUM(fat::double precision), 0), COALESCE(SUM(carbs::double precision), 0), COUNT(*)
+        FROM meals WHERE user_id IS NOT NULL AND date IS NOT NULL
+        GROUP BY user_id, date
+        ON CONFLICT (user_id, date) DO NOTHING;
+    """),
+]
+
+
+class MigrationError(RuntimeError):
+    """Применённая миграция не совпадает с кодом (изменён SQL, удалён шаг)."""
+
+
+def checksum(sql: str) -> str:
+    """Сумма SQL без учёта отступов и пустых строк — переформатирование не считается изменением."""
+    normalized = "\n".join(line.strip() for line in sql.strip().splitlines() if line.strip())
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+async def _applied(conn) -> dict[int, str] | None:
+    """{версия: сумма} применённых шагов или None, если таблицы миграций ещё нет."""
+    try:
+        rows = await conn.fetch("SELECT version, checksum FROM schema_migrations")
+    except asyncpg.exceptions.UndefinedTableError:
+        return None
+    return {r["version"]: r["checksum"] for r in rows}
+
+
+def _pending(applied: dict[int, str]) -> list[tuple[int, str, str]]:
+    known = {version for version, _, _ in MIGRATIONS}
+    unknown = sorted(set(applied) - known)
+    if unknown:
+        raise MigrationError(f"в базе есть миграции, которых нет в коде: {unknown}")
+    pending = []
+    for version, name, sql in MIGRATIONS:
+        if version not in applied:
+            pending.append((version, name, sql))
+        elif applied[version] != checksum(sql):
+            raise MigrationError(f"миграция {version} ({name}) изменена после применения")
+    return pending
+
+
+async def migrate(pool: asyncpg.Pool) -> int:
+    """Применить недостающие миграции. Возвращает число применённых шагов (0 — схема актуальна)."""
+    async with pool.acquire() as conn:
+        applied = await _applied(conn)
+        if applied is not None and not _pending(applied):
+            return 0
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_KEY)
+        try:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    checksum TEXT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            # Пока ждали блокировку, другой инстанс мог уже всё применить
+            pending = _pending(await _applied(conn) or {})
+            for version, name, sql in pending:
+                async with conn.transaction():
+                    await conn.execute(sql)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations (version, name, checksum) VALUES ($1, $2, $3)",
+                        version, name, checksum(sql),
+                    )
+                logger.info("Миграция %s (%s) применена", version, name)
+            return len(pending)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_KEY)
@@ -0,0 +1,103 @@
+"""
+Кэш распознавания фото еды. Точное совпадение — по file_unique_id из Telegram (пересланное/повторно отправленное фото),
+похожие снимки — по перцептивному хэшу (dHash) с порогом расстояния Хэмминга PHOTO_HASH_MAX_DISTANCE.
+Ключ включает подпись/уточнение: то же фото с другой подписью анализируется заново.
+Байты фото держим недолго, чтобы раунды уточнения не скачивали его из Telegram повторно.
+"""
+import asyncio
+import io
+import logging
+
+from cache import LRUCache
+from config import PHOTO_CACHE_SIZE, PHOTO_CACHE_TTL, PHOTO_HASH_MAX_DISTANCE
+from gemini_helper import analyze_food_photo
+
+logger = logging.getLogger("photo_cache")
+
+# (file_unique_id, подпись) -> результат analyze_food_photo
+_by_file = LRUCache(maxsize=PHOTO_CACHE_SIZE, ttl=PHOTO_CACHE_TTL)
+# (dhash, подпись) -> результат
+_by_hash = LRUCache(maxsize=PHOTO_CACHE_SIZE, ttl=PHOTO_CACHE_TTL)
+# file_unique_id -> (bytes, dhash) для раундов уточнения
+_images = LRUCache(maxsize=32, ttl=1800)
+
+stats = {"file_hits": 0, "hash_hits": 0, "misses": 0, "downloads": 0}
+
+
+def _caption_key(caption: str | None) -> str:
+    return " ".join((caption or "").lower().split())
+
+
+def dhash(image_bytes: bytes) -> int | None:
+    """Перцептивный хэш 64 бита (разница яркости соседних пикселей 9×8). Без Pillow — None."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            pixels = list(img.convert("L").resize((9, 8)).getdata())
+    except Exception as e:
+        logger.debug("dhash: %s", e)
+        return None
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def _find_similar(h: int, caption_key: str):
+    best = None
+    best_distance = PHOTO_HASH_MAX_DISTANCE + 1
+    for (other_hash, other_caption), result in _by_hash.items():
+        if other_caption != caption_key:
+            continue
+        distance = (h ^ other_hash).bit_count()
+        if distance < best_distance:
+            best, best_distance = result, distance
+    return best
+
+
+async def _load_image(bot, file_id: str, key: str) -> tuple[bytes, int | None]:
+    cached = _images.get(key)
+    if cached:
+        return cached
+    file = await bot.get_file(file_id)
+    file_bytes = await bot.download_file(file.file_path)
+    image_data = file_bytes.read()
+    stats["downloads"] += 1
+    h = await asyncio.to_thread(dhash, image_data)
+    _images.set(key, (image_data, h))
+    return image_data, h
+
+
+async def analyze_photo_cached(bot, file_id: str, file_unique_id: str | None = None, caption: str | None = None) -> dict | None:
+    """
+    analyze_food_photo с кэшем. Порядок: file_unique_id + подпись → скачивание и dHash → похожее фото с той же подписью → модель.
+    Ошибки скачивания пробрасываются, как и при прямом вызове bot.download_file.
+    """
+    key = file_unique_id or file_id
+    caption_key = _caption_key(caption)
+
+    result = _by_file.get((key, caption_key))
+    if result is not None:
+        stats["file_hits"] += 1
+        return dict(result)
+
+    image_data, h = await _load_image(bot, file_id, key)
+    if h is not None:
+        result = _find_similar(h, caption_key)
+        if result is not None:
+            stats["hash_hits"] += 1
+            _by_file.set((key, caption_key), result)
+            return dict(result)
+
+    stats["misses"] += 1
+    result = await analyze_food_photo(image_data, caption=caption)
+    # Вопрос-уточнение не кэшируем (как в analyze_food_text): повтор фото должен дойти до настоящего разбора
+    if isinstance(result, dict) and not result.get("needs_clarification"):
+        _by_file.set((key, caption_key), result)
+        if h is not None:
+            _by_hash.set((h, caption_key), result)
+    return result
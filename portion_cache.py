@@ -0,0 +1,98 @@
+"""
+Пересчёт порций по уже известному ответу: «гречка 200г» посчитана моделью → «гречка 300г» получается
+умножением КБЖУ на грамм (или на штуку) без нового запроса. В ответ добавляются источник и уверенность,
+чтобы пересчитанные ответы можно было проверить.
+"""
+import logging
+import math
+import re
+
+from cache import TwoTierCache
+from food_text import canonical_food_text, is_composite, normalize_food_text, parse_portion
+
+logger = logging.getLogger("portion_cache")
+
+# Пересчитываем только в разумном диапазоне: 50г → 2кг по одной плотности уже ненадёжно
+MAX_SCALE_RATIO = 5.0
+# Уверенность в исходном ответе модели, если модель её не вернула
+DEFAULT_MODEL_CONFIDENCE = 0.8
+
+_QTY_RE = re.compile(r"\d+(?:\.\d+)?(?:кг|г|мл|л|шт)(?=\W|$)")
+_QTY_IN_NAME_RE = re.compile(r"\s*\(?\s*\d+(?:[.,]\d+)?\s*(?:граммов|грамм|гр|г|мл|шт|штук|штуки)\.?\s*\)?", re.IGNORECASE)
+
+
+def _single_portion(text: str) -> tuple[str, float, str] | None:
+    """
+    parse_portion только для одного продукта с одним количеством. «гречка 200г, курица 100г» разбирается
+    как «гречка 200г курица» 100 г — пересчёт всего приёма по последней порции, такое не кэшируем.
+    """
+    portion = parse_portion(text)
+    if not portion or any(c.isdigit() for c in portion[0]):
+        return None
+    if is_composite(text) and len(_QTY_RE.findall(canonical_food_text(text))) > 1:
+        return None
+    return portion
+
+
+class PortionCache:
+    def __init__(self, version: int, maxsize: int, ttl: float, db_ttl_days: int | None):
+        self.store = TwoTierCache("food_density", version, maxsize=maxsize, ttl=ttl, db_ttl_days=db_ttl_days)
+        self.scaled = 0
+
+    async def lookup(self, text: str) -> dict | None:
+        """Ответ, пересчитанный с другой порции того же блюда, или None."""
+        portion = _single_portion(text)
+        if not portion:
+            return None
+        food, qty, unit = portion
+        density = await self.store.get(f"{unit}:{normalize_food_text(food)}")
+        if not density:
+            return None
+        ratio = qty / density["source_qty"]
+        if not (1 / MAX_SCALE_RATIO <= ratio <= MAX_SCALE_RATIO):
+            return None
+        per_unit = density["per_unit"]
+        # Чем дальше от исходной порции, тем ниже уверенность (×2 порции → −0.1)
+        confidence = round(max(0.0, density["confidence"] - 0.1 * abs(math.log2(ratio))), 2)
+        qty_label = f"{qty:g} шт" if unit == "шт" else f"{qty:.0f}г"
+        self.scaled += 1
+        logger.info("Scaled %r from %r (x%.2f, confidence %.2f)", text, density["source_text"], ratio, confidence)
+        return {
+            "name": f"{density['name']} ({qty_label})",
+            "calories": round(per_unit["calories"] * qty),
+            "protein": round(per_unit["protein"] * qty, 1),
+            "fat": round(per_unit["fat"] * qty, 1),
+            "carbs": round(per_unit["carbs"] * qty, 1),
+            "comment": density.get("comment") or "",
+            "source": "scaled",
+            "scaled_from": density["source_text"],
+            "scale_ratio": round(ratio, 3),
+            "confidence": confidence,
+        }
+
+    async def remember(self, text: str, result: dict):
+        """Разложить ответ модели на КБЖУ на грамм/штуку и сохранить для будущих порций."""
+        portion = _single_portion(text)
+        if not portion:
+            return
+        food, qty, unit = portion
+        try:
+            per_unit = {k: float(result[k]) / qty for k in ("calories", "protein", "fat", "carbs")}
+        except (KeyError, TypeError, ValueError):
+            return
+        try:
+            confidence = float(result.get("confidence", DEFAULT_MODEL_CONFIDENCE))
+        except (TypeError, ValueError):
+            confidence = DEFAULT_MODEL_CONFIDENCE
+        name = _QTY_IN_NAME_RE.sub("", str(result.get("name") or food)).strip() or food
+        await self.store.set(f"{unit}:{normalize_food_text(food)}", {
+            "name": name,
+            "per_unit": per_unit,
+            "source_qty": qty,
+            "source_text": text,
+            "comment": result.get("comment") or "",
+            "confidence": confidence,
+        })
+
+    def stats(self) -> dict:
+        return {**self.store.stats(), "scaled": self.scaled}
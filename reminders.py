@@ -2,7 +2,8 @@
 Напоминания «пора поесть» по недобору КБЖУ. Проверка каждые 15 минут.
 Напоминание приходит, когда прошло достаточно времени после последнего приёма (45/90/120 мин)
 и есть недобор по целям. Не слать ночью (до 8:00 и после 22:00).
-Дополнительно: уведомления о достижении целей за день и мягкий AI-комментарий при 5 днях подряд недобора/перебора.
+Дополнительно: уведомления о достижении целей за день и мягкий AI-комментарий при 5 днях подряд недобора/перебора
+(тексты — из заранее сгенерированного пула message_pool, без запроса к модели при рассылке).
 """
 import asyncio
 import logging
@@ -13,10 +14,9 @@ from database import (
     get_users_for_reengage,
     get_user,
     get_daily_totals,
-    get_meals_today,
-    get_last_meal_today,
-    get_reminder_count_today,
-    get_last_reminder_sent_at,
+    get_meals_range,
+    verify_daily_totals,
+    iter_reminder_candidates,
     log_reminder_sent,
     was_notification_sent,
     log_notification_sent,
@@ -24,8 +24,11 @@ from database import (
     get_last_reengage_sent_at,
     log_reengage_sent,
 )
-from gemini_helper import get_reminder_suggestion, get_goal_reached_message, get_5day_streak_message
+from gemini_helper import get_reminder_suggestions_batch, ai_degraded
+from message_pool import sample_goal_reached, sample_streak, schedule_refresh
 from week_status import run_week_status
+from ai_scheduler import set_priority, BACKGROUND
+from config import DAILY_TOTALS_VERIFY_HOUR, DAILY_TOTALS_VERIFY_DAYS, REMINDER_SCAN_PAGE_SIZE
 
 logger = logging.getLogger("reminders")
 
@@ -63,19 +66,21 @@ REENGAGE_MSG_48H = "Я тебя потерял 👀\n\nПродолжаем сл
 REENGAGE_MSG_5D = "Даже 1 пропущенный день может сбить ритм.\n\nЗаймёт 30 секунд — просто добавь последний приём пищи."
 
 
-async def check_goal_reached_and_send(user_id: int, bot):
+async def check_goal_reached_and_send(user_id: int, bot, user: dict | None = None, totals: dict | None = None):
     """
     Если пользователь достиг цели за день (белок / калории / все цели) — отправить поздравление и мотивирующее сообщение (раз в день на цель).
-    Вызывается после добавления еды и из run_reminders.
+    Вызывается после добавления еды и из run_reminders (тогда user и totals за сегодня уже прочитаны).
     Не шлёт, если у пользователя выключены уведомления «О прогрессе».
     """
     today = date.today()
-    user = await get_user(user_id)
+    if user is None:
+        user = await get_user(user_id)
     if not user:
         return
     if user.get("progress_notifications_enabled") == 0:
         return
-    totals = await get_daily_totals(user_id, today)
+    if totals is None:
+        totals = await get_daily_totals(user_id, today)
     prot_goal = user.get("protein_goal") or 0
     cal_goal = user.get("calories_goal") or 0
     fat_goal = user.get("fat_goal") or 0
@@ -84,7 +89,7 @@ async def check_goal_reached_and_send(user_id: int, bot):
     # Цель по белку
     if prot_goal and totals["protein"] >= prot_goal:
         if not await was_notification_sent(user_id, today, "protein_goal"):
-            data = get_goal_reached_message("protein", user, totals)
+            data = await sample_goal_reached("protein", user.get("goal"))
             if data and data.get("benefit"):
                 fact = f"Сегодня ты закрыл норму белка — {totals['protein']:.0f} г из {prot_goal} г"
                 text = f"🎯 {fact}\n\n💪 {data['benefit']}"
@@ -100,7 +105,7 @@ async def check_goal_reached_and_send(user_id: int, bot):
     # Цель по калориям
     if cal_goal and totals["calories"] >= cal_goal:
         if not await was_notification_sent(user_id, today, "calories_goal"):
-            data = get_goal_reached_message("calories", user, totals)
+            data = await sample_goal_reached("calories", user.get("goal"))
             if data and data.get("benefit"):
                 fact = f"Сегодня ты закрыл норму калорий — {totals['calories']} ккал из {cal_goal} ккал"
                 text = f"🎯 {fact}\n\n💪 {data['benefit']}"
@@ -117,7 +122,7 @@ async def check_goal_reached_and_send(user_id: int, bot):
     if prot_goal and cal_goal and fat_goal and carb_goal:
         if totals["protein"] >= prot_goal and totals["calories"] >= cal_goal and totals["fat"] >= fat_goal and totals["carbs"] >= carb_goal:
             if not await was_notification_sent(user_id, today, "full_goal"):
-                data = get_goal_reached_message("full", user, totals)
+                data = await sample_goal_reached("full", user.get("goal"))
                 if data and data.get("benefit"):
                     fact = f"Сегодня ты выполнил все дневные цели: калории {totals['calories']}/{cal_goal}, белок {totals['protein']:.0f}/{prot_goal} г, жиры {totals['fat']:.0f}/{fat_goal} г, углеводы {totals['carbs']:.0f}/{carb_goal} г"
                     text = f"🎯 {fact}\n\n💪 {data['benefit']}"
@@ -139,29 +144,48 @@ async def _get_5day_summary(user_id: int, user: dict) -> list:
         "fat_goal": user.get("fat_goal") or 0,
         "carbs_goal": user.get("carbs_goal") or 0,
     }
+    # Пять дней — один запрос по диапазону daily_totals; дни без еды — нули
+    by_date = {
+        d: {"calories": int(cal or 0), "protein": float(prot or 0), "fat": float(fat or 0), "carbs": float(carb or 0)}
+        for d, cal, prot, fat, carb in await get_meals_range(user_id, today - timedelta(days=4), today)
+    }
+    zero = {"calories": 0, "protein": 0.0, "fat": 0.0, "carbs": 0.0}
     out = []
     for i in range(5):
-        d = today - timedelta(days=i)
-        totals = await get_daily_totals(user_id, d)
+        d = (today - timedelta(days=i)).isoformat()
         out.append({
-            "date": d.isoformat(),
-            "totals": totals,
+            "date": d,
+            "totals": by_date.get(d, zero),
             "goals": goals,
         })
     return out
 
 
-async def check_5day_streak_and_send(user_id: int, bot):
+def _streak_fact(streak_type: str, summary: list) -> str:
+    """Средние за 5 дней — цифры подставляются к тексту из пула."""
+    field, goal_field, unit, label = {
+        "protein_shortfall": ("protein", "protein_goal", "г", "белок"),
+        "fat_over": ("fat", "fat_goal", "г", "жиры"),
+        "cal_over": ("calories", "calories_goal", "ккал", "калории"),
+    }[streak_type]
+    avg = sum(s["totals"][field] or 0 for s in summary) / len(summary)
+    goal = summary[0]["goals"].get(goal_field) or 0
+    return f"В среднем за 5 дней {label}: {avg:.0f} {unit} при цели {goal} {unit}."
+
+
+async def check_5day_streak_and_send(user_id: int, bot, user: dict | None = None):
     """
     Если 5 дней подряд: недобор белка (< 85% цели) или перебор жиров/калорий (> 110%) — отправить мягкий AI-комментарий (раз на серию).
     Запускаем вечером (с 19:00), чтобы не слать утром.
     Не шлёт, если у пользователя выключены уведомления «О прогрессе».
+    Пока ИИ недоступен — пропускаем: необязательный пуш, отправится на следующей проверке.
     """
     now = datetime.now()
-    if now.hour < 19:
+    if now.hour < 19 or ai_degraded():
         return
     today = date.today()
-    user = await get_user(user_id)
+    if user is None:
+        user = await get_user(user_id)
     if not user:
         return
     if user.get("progress_notifications_enabled") == 0:
@@ -202,11 +226,9 @@ async def check_5day_streak_and_send(user_id: int, bot):
         last_sent = await get_last_streak_notification_date(user_id, key)
         if last_sent is not None and (today - last_sent).days < 5:
             continue
-        msg = get_5day_streak_message(streak_type, user, summary)
-        if not msg:
-            continue
+        msg = await sample_streak(streak_type, user.get("goal"))
         try:
-            await bot.send_message(user_id, "💬 " + msg)
+            await bot.send_message(user_id, "💬 " + msg + "\n\n" + _streak_fact(streak_type, summary))
             await log_notification_sent(user_id, today, key)
             logger.info("5day_streak %s sent to user_id=%s", key, user_id)
         except Exception as e:
@@ -260,40 +282,38 @@ async def run_reminders(bot):
     now = datetime.now()
     if now.hour < START_HOUR or now.hour >= CUTOFF_HOUR:
         return
-    for user_id in await get_users_for_reminders():
+    candidates = []  # (user_id, аргументы get_reminder_suggestion)
+    # Профиль, суммы за день, напоминания и приёмы за сегодня — для всех пользователей разом, страницами
+    async for row in iter_reminder_candidates(now.date(), REMINDER_SCAN_PAGE_SIZE):
+        user = row["user"]
+        user_id = user["user_id"]
         try:
-            user = await get_user(user_id)
-            if not user:
-                continue
-            if user.get("reminders_enabled") == 0:
-                continue
             per_day = user.get("reminders_per_day") or 3
-            if await get_reminder_count_today(user_id) >= per_day:
+            if row["reminders_today"] >= per_day:
                 continue
-            last_sent = await get_last_reminder_sent_at(user_id)
+            last_sent = row["last_reminder_at"]
             if last_sent is not None:
                 mins_since = int((now - last_sent).total_seconds() / 60)
                 if mins_since < MIN_MINUTES_BETWEEN_REMINDERS:
                     continue
-            totals = await get_daily_totals(user_id)
+            totals = row["totals"]
             cal_goal = user.get("calories_goal") or 0
             prot_goal = user.get("protein_goal") or 0
             carb_goal = user.get("carbs_goal") or 0
             if not cal_goal:
                 continue
             # Проверка достижения целей за день (поздравление + мотивация)
-            await check_goal_reached_and_send(user_id, bot)
+            await check_goal_reached_and_send(user_id, bot, user, totals)
             # Проверка 5 дней подряд недобор/перебор — мягкий AI-комментарий (вечером)
-            await check_5day_streak_and_send(user_id, bot)
+            await check_5day_streak_and_send(user_id, bot, user)
             cal_rem = cal_goal - totals["calories"]
             prot_rem = prot_goal - totals["protein"]
             carb_rem = carb_goal - totals["carbs"]
             if cal_rem < MIN_SHORTFALL_CAL and prot_rem < MIN_SHORTFALL_PROT and carb_rem < MIN_SHORTFALL_CARB:
                 continue
-            meals_today = await get_meals_today(user_id)
-            eaten = [m[1] for m in meals_today]
+            eaten = row["meals_today"]
 
-            last_meal = await get_last_meal_today(user_id)
+            last_meal = row["last_meal"]
             last_meal_minutes_ago = None
             last_meal_name = None
             if last_meal:
@@ -310,13 +330,25 @@ async def run_reminders(bot):
                     last_meal_minutes_ago = None
                     last_meal_name = None
 
-            text = get_reminder_suggestion(
-                totals, user, eaten, now.hour,
-                last_meal_minutes_ago=last_meal_minutes_ago,
-                last_meal_name=last_meal_name,
-            )
-            if not text:
-                continue
+            candidates.append((user_id, {
+                "totals": totals,
+                "user": user,
+                "eaten_today": eaten,
+                "hour": now.hour,
+                "last_meal_minutes_ago": last_meal_minutes_ago,
+                "last_meal_name": last_meal_name,
+            }))
+        except Exception as e:
+            logger.exception("Reminder for user_id=%s: %s", user_id, e)
+
+    if not candidates:
+        return
+    # Тексты для всех кандидатов — пачками по REMINDER_BATCH_SIZE в одном запросе к модели
+    texts = await get_reminder_suggestions_batch([item for _, item in candidates])
+    for (user_id, _), text in zip(candidates, texts):
+        if not text:
+            continue
+        try:
             await bot.send_message(user_id, "🔔 " + text)
             await log_reminder_sent(user_id)
             logger.info("Reminder sent to user_id=%s", user_id)
@@ -357,11 +389,33 @@ async def run_midnight_today_update(bot):
             logger.exception("Midnight update for user_id=%s: %s", user_id, e)
 
 
+_daily_totals_checked: date | None = None
+
+
+async def run_daily_totals_check():
+    """Раз в сутки (ночью, в DAILY_TOTALS_VERIFY_HOUR) сверить daily_totals с meals за последние дни и исправить расхождения."""
+    global _daily_totals_checked
+    now = datetime.now()
+    if now.hour != DAILY_TOTALS_VERIFY_HOUR or _daily_totals_checked == now.date():
+        return
+    _daily_totals_checked = now.date()
+    fixed = await verify_daily_totals(DAILY_TOTALS_VERIFY_DAYS)
+    if fixed:
+        logger.warning("daily_totals: исправлено дней с расхождением: %s", fixed)
+
+
 async def reminder_loop(bot):
-    """Каждые 15 минут: напоминания по недобору, reengage при долгой неактивности, в 00:00 — обновление «Сегодня», в 19:00 раз в 7 дней — Статус недели."""
+    """Каждые 15 минут: напоминания по недобору, reengage при долгой неактивности, в 00:00 — обновление «Сегодня», в 19:00 раз в 7 дней — Статус недели, ночью — сверка daily_totals. Пул текстов уведомлений дополняется в фоне."""
+    # Все запросы к ИИ из этой задачи — фоновые: уступают очередь пользователю, который ждёт ответ
+    set_priority(BACKGROUND)
     while True:
         await asyncio.sleep(60 * 15)
+        schedule_refresh()
         await run_midnight_today_update(bot)
         await run_reminders(bot)
         await run_reengage_reminders(bot)
         await run_week_status(bot)
+        try:
+            await run_daily_totals_check()
+        except Exception as e:
+            logger.exception("daily_totals check: %s", e)
@@ -11,6 +11,13 @@ from aiohttp import web
 
 from config import WEBHOOK_BASE_URL, WEBHOOK_SECRET
 from bot import setup_bot_dp, log_updates, reminder_loop
+from ai_scheduler import scheduler
+from gemini_helper import singleflight_stats, tip_cache, tip_stats, tier_stats, json_retry_stats, json_retry_budget, timeout_stats, breaker
+from ai_json import stats as json_parse_stats
+from image_prep import stats as image_prep_stats
+from background import cancel_all as cancel_background, stats as background_stats
+import ai_metrics
+from ai_backend import stats as ai_backend_stats
 
 logging.basicConfig(
     level=logging.INFO,
@@ -22,8 +29,29 @@ PORT = int(os.environ.get("PORT", 8080))
 
 
 async def health(request: web.Request) -> web.Response:
-    """GET / — для проверки, что сервис жив (Render, браузер)."""
-    return web.Response(text="FitMeal AI bot is alive!", content_type="text/plain")
+    """GET / — для проверки, что сервис жив (Render, браузер); вторая строка — состояние предохранителя ИИ."""
+    return web.Response(text=f"FitMeal AI bot is alive!\nAI circuit: {breaker.state}", content_type="text/plain")
+
+
+async def stats(request: web.Request) -> web.Response:
+    """GET /stats — бэкенд модели, очередь и ожидание запросов к ИИ по классам приоритета, уровни моделей и эскалации, предохранитель ИИ, таймауты и хеджирование, разбор JSON и повторы, склейка одинаковых промптов, подготовка фото, кэш советов, фоновые задачи."""
+    return web.json_response({
+        "ai_backend": ai_backend_stats,
+        "ai_scheduler": scheduler.stats(),
+        "ai_singleflight": singleflight_stats,
+        "ai_tiers": tier_stats(),
+        "ai_breaker": breaker.snapshot(),
+        "ai_timeouts": timeout_stats,
+        "ai_json": {**json_parse_stats, **json_retry_stats, "retry_budget": round(json_retry_budget.balance, 2)},
+        "image_prep": image_prep_stats,
+        "daily_tip_cache": {**tip_stats, "buckets": len(tip_cache)},
+        "background_tasks": background_stats,
+    })
+
+
+async def metrics(request: web.Request) -> web.Response:
+    """GET /metrics — по каждому хелперу gemini_helper: вызовы, гистограмма времени, токены, оценка стоимости, ошибки, попадания в кэш."""
+    return web.json_response(ai_metrics.snapshot())
 
 
 async def create_app() -> web.Application:
@@ -46,6 +74,8 @@ async def create_app() -> web.Application:
     app["dp"] = dp
 
     app.router.add_get("/", health)
+    app.router.add_get("/stats", stats)
+    app.router.add_get("/metrics", metrics)
 
     from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
@@ -60,17 +90,23 @@ async def create_app() -> web.Application:
 
     async def start_reminders(app: web.Application) -> None:
         app["reminder_task"] = asyncio.create_task(reminder_loop(bot))
+        app["metrics_log_task"] = asyncio.create_task(ai_metrics.log_loop())
 
     async def stop_reminders(app: web.Application) -> None:
-        if "reminder_task" in app:
-            app["reminder_task"].cancel()
-            try:
-                await app["reminder_task"]
-            except asyncio.CancelledError:
-                pass
+        for key in ("reminder_task", "metrics_log_task"):
+            if key in app:
+                app[key].cancel()
+                try:
+                    await app[key]
+                except asyncio.CancelledError:
+                    pass
+
+    async def stop_background(app: web.Application) -> None:
+        await cancel_background()
 
     app.on_startup.append(start_reminders)
     app.on_shutdown.append(stop_reminders)
+    app.on_shutdown.append(stop_background)
 
     return app
 
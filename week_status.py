@@ -167,7 +167,7 @@ async def run_week_status(bot):
             status_key, status_label = _determine_status(user.get("goal", ""), stats)
             index_pct = _index_from_stats(stats, status_key)
             index_label = _index_label(index_pct)
-            rec = get_week_status_recommendation(
+            rec = await get_week_status_recommendation(
                 status_key,
                 user.get("goal", ""),
                 stats["avg_deficit"],